@@ -2,33 +2,27 @@ from logging import getLogger
 from .loggers import exception_logger,write_logger, query_logger
 from .enums import *
 from .force import *
-from .helpers import format_command
-from .baseSMU import SMU
+from .helpers import format_command, binary_current_ranges, binary_voltage_ranges
+from .baseSMU import SMU, RangeTable
 from .spgu import SPGUSMU
 from .SMU_capabilities import *
 
 
 # bundling up all the different Measuring Types possible with almost every SMU
 class GeneralSMU(SMU,DCForceUnit,SpotUnit, PulsedSpotUnit, SingleMeasure, StaircaseSweepUnit,PulsedSweepUnit,BinarySearchUnit, LinearSearchUnit):
-    pass
+    binary_ranges = (binary_voltage_ranges, binary_current_ranges)
 
 class HPSMU(GeneralSMU):
+    ranges = RangeTable((0, 20, 200, 400, 1000, 2000), [0] + list(range(11, 21)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0,20, 200, 400, 1000,
+                            2000, -20, -200,-400,-1000,-2000]+
+                           list(range(11,21))+list(range(-11,-21,-1))
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "High power source/monitor unit"
         self.models = ["B1510A"]
-        self.input_ranges = tuple([InputRanges_V[x] for x in
-                                   InputRanges_V.__members__
-                                   if InputRanges_V[x].value
-                                   in (0, 20, 200, 400, 1000, 2000)] +
-                                  [InputRanges_I[x] for x in
-                                   InputRanges_I.__members__
-                                   if InputRanges_I[x].value
-                                   in tuple([0] + list(range(11, 21)))])
-        self.measure_ranges = tuple([0,20, 200, 400, 1000,
-                                    2000, -20, -200,-400,-1000,-2000]+
-                                   list(range(11,21))+list(range(-11,-21,-1))
-                                    )
         self._search_max_voltage=100
         self._search_max_current=0.1
         self._search_min_voltage = 0
@@ -48,19 +42,16 @@ class HPSMU(GeneralSMU):
 
 
 class MPSMU(GeneralSMU):
+    ranges = RangeTable((0, 5, 50, 200, 400, 1000), [0] + list(range(8, 20)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0,5,20,50, 200, 400, 1000,
+                            -5, -20,-50, -200,-400,-1000,]+
+                           list(range(8,20))+list(range(-8,-20,-1))
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "Medium power source/monitor unit"
         self.models = ("B1511A", "B1511B")
-        self.input_ranges = [
-            InputRanges_V[x] for x in InputRanges_V.__members__
-            if InputRanges_V[x].value in (0, 5, 50, 200, 400, 1000)] + [
-            InputRanges_I[x] for x in InputRanges_I.__members__
-            if InputRanges_I[x].value in tuple([0] + list(range(8, 20)))]
-        self.measure_ranges = tuple([0,5,20,50, 200, 400, 1000,
-                                    -5, -20,-50, -200,-400,-1000,]+
-                                   list(range(8,20))+list(range(-8,-20,-1))
-                                     )
         self._search_max_voltage=100
         self._search_max_current=0.1
         self._search_min_voltage = 0
@@ -77,19 +68,16 @@ class MPSMU(GeneralSMU):
 
 
 class HCSMU(GeneralSMU):
+    ranges = RangeTable((0, 20, 200, 400, 1000, 2000), [0] + list(range(11, 21)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0,2,20, 200, 400,
+                            -5, -20,-200, -400,]+
+                           list(range(15,20))+list(range(-15,-20,-1))+[22,-22]
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "High current source/monitor unit"
         self.models = ("B1512A")
-        self.input_ranges = [
-            InputRanges_V[x] for x in InputRanges_V.__members__
-            if InputRanges_V[x].value in (0, 20, 200, 400, 1000, 2000)] + [
-            InputRanges_I[x] for x in InputRanges_I.__members__
-            if InputRanges_I[x].value in tuple([0] + list(range(11, 21)))]
-        self.measure_ranges = tuple([0,2,20, 200, 400,
-                                    -5, -20,-200, -400,]+
-                                    list(range(15,20))+list(range(-15,-20))+[22,-22]
-                                    )
         super().__init__(parent_device, slot)
         self._search_max_voltage=40
         self._search_max_current=1
@@ -98,19 +86,16 @@ class HCSMU(GeneralSMU):
 
 
 class HVSMU(GeneralSMU):
+    ranges = RangeTable((0, 2000, 5000, 15000, 30000), [0] + list(range(11, 19)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0,2000,5000, 15000, 30000,
+                            -2000, -5000, -15000, -30000,]+
+                           list(range(11,19))+list(range(-11,-19,-1))
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "High voltage source/Monitor unit"
         self.models = ("B1513A", "B1513B")
-        self.input_ranges = [
-            InputRanges_V[x] for x in InputRanges_V.__members__
-            if InputRanges_V[x].value in (0, 2000, 5000, 15000, 30000)] + [
-            InputRanges_I[x] for x in InputRanges_I.__members__
-            if InputRanges_I[x].value in tuple([0] + list(range(11, 19)))]
-        self.measure_ranges = tuple([0,2000,5000, 15000, 30000,
-                                    -2000, -5000, -15000, -30000,]+
-                                    list(range(11,19))+list(range(-11,-19,-1))
-                                    )
         super().__init__(parent_device, slot)
         self._search_max_voltage=3000
         self._search_max_current=8e-3
@@ -118,20 +103,16 @@ class HVSMU(GeneralSMU):
         self._search_min_current = 0
 
 class MCSMU(GeneralSMU):
+    ranges = RangeTable((0, 2, 200, 400,), [0] + list(range(15, 21)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0, 2,20,200,400,
+                            -2,-20,-200,-400]+
+                           list(range(15,20))+list(range(-15,-20,-1))
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "Medium current source/monitor unit"
         self.models = ("B1514A")
-        self.input_ranges = [
-            InputRanges_V[x] for x in InputRanges_V.__members__
-            if InputRanges_V[x].value in (0, 2, 200, 400,)] + [
-            InputRanges_I[x] for x in InputRanges_I.__members__
-            if InputRanges_I[x].value in tuple([0] + list(range(15, 21)))]
-        self.measure_ranges = tuple([0, 2,20,200,400,
-                                    -2,-20,-200,-400]+
-                                    list(range(15,20))+list(range(-15,-20))
-                                    )
-
         super().__init__(parent_device, slot)
         self._search_max_voltage=30
         self._search_max_current=0.1
@@ -139,22 +120,16 @@ class MCSMU(GeneralSMU):
         self._search_min_current = 0
 
 class HRSMU(GeneralSMU):
+    ranges = RangeTable((0, 5, 50, 200, 400, 1000), [0] + list(range(8, 20)))
+    input_ranges = ranges.input_ranges
+    measure_ranges = tuple([0, 5,20, 50,200,400,1000,
+                            -5, -20, -50, -200, -400, -1000,]+
+                           list(range(8,20))+list(range(-8,-20,-1))
+                           )
 
     def __init__(self, parent_device, slot):
         self.long_name = "High resolution source/monitor unit"
         self.models = ["B1517A"]
-        self.input_ranges = tuple([InputRanges_V[x]
-                                   for x in InputRanges_V.__members__
-                                   if InputRanges_V[x].value
-                                   in (0, 5, 50, 200, 400, 1000)] +
-                                  [InputRanges_I[x]
-                                   for x in InputRanges_I.__members__
-                                   if InputRanges_I[x].value in tuple(
-                                       [0] + list(range(8, 20)))])
-        self.measure_ranges = tuple([0, 5,20, 50,200,400,1000,
-                                    -5, -20, -50, -200, -400, -1000,]+
-                                   list(range(8,20))+list(range(-8,-20,-1))
-                                    )
         super().__init__(parent_device, slot)
         self._search_max_voltage=100
         self._search_max_current=0.1
@@ -176,6 +151,7 @@ class HVSPGU(SMU,SPGUSMU):
         self.long_name = "High Voltage SPGU (Semiconductor pulse generator unit)"
         self.models = ["B1525A"]
         self.load_impedance = {}
+        self.spgu_setups = {}
         self.busy = 0
         self.minV = -40
         self.maxV = 40
@@ -1,6 +1,14 @@
 from .enums import *
 from .force import *
 from .measurement import *
-from .setup import TestSetup, Channel
+from .setup import TestSetup, Channel, SetupKey
 from .tester import B1500
+from .compiler import CompiledPlan, PlanCache
+from .timing import Estimate
+from .programs import ProgramCache, ProgramVariable
+from .templates import Param, SetupTemplate
+from .asynctester import AsyncB1500
+from .worker import TesterWorker
+from .orchestrator import Orchestrator, TaggedResult
+from .server import InstrumentServer, InstrumentClient
 from .SMUs import *
@@ -0,0 +1,80 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from .loggers import exception_logger
+from .tester import B1500
+
+
+class AsyncB1500(object):
+    """ asyncio facade for a B1500. All blocking VISA I/O runs in a single
+    dedicated executor thread, so calls are executed in the order they were
+    awaited and never interleave on the bus. Cancelling run_test or measure
+    sends AB right away and tears the channels of the test down afterwards.
+
+    tester is either a B1500 or a VISA address, in which case the B1500 is
+    created with the given keyword arguments. Use init() instead of auto_init
+    to discover the tester without blocking the event loop"""
+
+    def __init__(self, tester, loop=None, **kwargs):
+        if not isinstance(tester, B1500):
+            kwargs["auto_init"] = False
+            tester = B1500(tester, **kwargs)
+        self.tester = tester
+        self._loop = loop
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _call(self, fn, *args, **kwargs):
+        loop = self._loop or asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def init(self):
+        return await self._call(self.tester.init)
+
+    async def run_test(self, test_tuple, **kwargs):
+        """ Runs B1500.run_test in the executor, see there for arguments"""
+        try:
+            return await self._call(self.tester.run_test, test_tuple, **kwargs)
+        except asyncio.CancelledError:
+            await self._abort(test_tuple)
+            raise
+
+    async def measure(self, test_tuple, force_wait=False, autoread=False):
+        """ Runs B1500.measure in the executor, the channels need to be set up"""
+        try:
+            return await self._call(self.tester.measure, test_tuple, force_wait, autoread)
+        except asyncio.CancelledError:
+            await self._abort(test_tuple)
+            raise
+
+    async def read(self, *args, **kwargs):
+        return await self._call(self.tester.read, *args, **kwargs)
+
+    async def query(self, msg, *args, **kwargs):
+        return await self._call(self.tester.query, msg, *args, **kwargs)
+
+    async def write(self, msg, *args, **kwargs):
+        return await self._call(self.tester.write, msg, *args, **kwargs)
+
+    async def _abort(self, test_tuple):
+        """ Sends AB from a separate thread, since the executor thread may be
+        blocked waiting for the tester, then queues the teardown behind the
+        cancelled call. Shielded, so the cleanup finishes even though the
+        calling task is being cancelled"""
+        loop = self._loop or asyncio.get_running_loop()
+        exception_logger.warn("Cancelled, aborting measurement and tearing down channels")
+        async def cleanup():
+            try:
+                await loop.run_in_executor(None, self.tester.abort)
+            finally:
+                await self._call(self.tester.teardown, test_tuple)
+        await asyncio.shield(cleanup())
+
+    async def close(self):
+        await self._call(self.tester.close)
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
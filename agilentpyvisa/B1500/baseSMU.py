@@ -1,10 +1,53 @@
 from .loggers import exception_logger,write_logger, query_logger
-import visa
+from .lazy import visa
 from .enums import *
 from .force import *
-from .helpers import format_command
+from .helpers import format_command, binary_current_ranges, binary_voltage_ranges
+from bisect import bisect_left
+
+
+class RangeTable(object):
+    """ The input ranges of a module model, given as range codes, with the
+    ranges sorted by full scale value for bisect lookups. Built once per
+    module class, codes without InputRanges member are left out"""
+
+    def __init__(self, voltage_codes, current_codes):
+        voltage_codes = [c for c in voltage_codes if c in InputRanges_V._value2member_map_]
+        current_codes = [c for c in current_codes if c in InputRanges_I._value2member_map_]
+        self.input_ranges = (tuple(InputRanges_V(c) for c in voltage_codes) +
+                             tuple(InputRanges_I(c) for c in current_codes))
+        self.input_set = frozenset(self.input_ranges)
+        voltages = sorted((c/10., c) for c in voltage_codes if c)
+        currents = sorted((binary_current_ranges[c], c) for c in current_codes if c)
+        self.__voltage_scales = [v for v, c in voltages]
+        self.__voltage_codes = [c for v, c in voltages]
+        self.__current_scales = [i for i, c in currents]
+        self.__current_codes = [c for i, c in currents]
+
+    @staticmethod
+    def __cover(scales, codes, enum, val1, val2, fixed):
+        val = abs(val1) if val2 is None else max(abs(val1), abs(val2))
+        # tolerate rounding, 1e-3 has to be covered by the 1 mA range
+        i = bisect_left(scales, val*(1-1e-9))
+        if i == len(scales):
+            return enum.full_auto
+        return enum(-codes[i] if fixed else codes[i])
+
+    def mincover_V(self, val1, val2=None, fixed=False):
+        return self.__cover(self.__voltage_scales, self.__voltage_codes,
+                            MeasureRanges_V, val1, val2, fixed)
+
+    def mincover_I(self, val1, val2=None, fixed=False):
+        return self.__cover(self.__current_scales, self.__current_codes,
+                            MeasureRanges_I, val1, val2, fixed)
+
 
 class SMU(object):
+    ranges = RangeTable((), ())
+    input_ranges = ranges.input_ranges
+    # (voltage, current) range codes of the binary output formats, None if
+    # the data of the module is not decoded
+    binary_ranges = None
 
     def __init__(self, parent_device, slot):
         self.parent = parent_device
@@ -35,62 +78,15 @@ class SMU(object):
 
     def get_mincover_V(self,  val1, val2=None, fixed=False):
         """ This returns the smallest voltage range covering the largest given
-        values. Only returns auto or limited, in order to be used both for measure and input ranges.
-        Takes into account the slots which will be used"""
-        val = val1
-        if val2:
-            val = max(abs(val), abs(val2))
-        if not fixed:
-            cov = [(k, v) for k, v in MeasureRanges_V.__members__.items(
-                ) if v >= 10*val and MeasureRanges_V[k] in self.input_ranges]
-        else:
-            cov = [
-                (k, v) for k, v in MeasureRanges_V.__members__.items()
-                if -1 * v >= 10 * val and
-                MeasureRanges_V[k] in self.input_ranges]
-        if cov:
-            if fixed:
-                mincov = max(cov, key=lambda x: x.__getitem__(1))
-                return range_map[maxcov]
-            else:
-                mincov = min(cov, key=lambda x: x.__getitem__(1))
-                return MeasureRanges_V[mincov[0]]
-        else:
-            return MeasureRanges_V.full_auto
+        values, limited or, with fixed, fixed ranging. Can be used both for
+        measure and input ranges, only ranges of this module are considered.
+        full_auto if none covers the values"""
+        return self.ranges.mincover_V(val1, val2, fixed)
 
     def get_mincover_I(self,  val1, val2=None, fixed=False):
-        """ This returns the smallest voltage range covering the largest given
-        values. Only returns auto or limited, in order to be used both for measure and input ranges.
-        Takes into account the slots which will be used"""
-        val = val1
-        if val2:
-            val = max(abs(val), abs(val2))
-        def valid(y):
-            covered = MeasureRanges_I[y].value <= 20
-            if fixed:
-                covered = covered and MeasureRanges_I[y].value < 0
-            else:
-                covered = covered and MeasureRanges_I[y].value > 0
-                return covered and MeasureRanges_I[y] in self.input_ranges
-        range_map = {round(1e-12*pow(10, i), 12): x for i, x in enumerate(
-            (y for y in MeasureRanges_I.__members__ if valid(y)))
-        }
-        range_map[
-            2] = MeasureRanges_I.A2_limited if not fixed else MeasureRanges_I.A2_fixed
-        range_map[
-            20] = MeasureRanges_I.A20_limited if not fixed else MeasureRanges_I.A20_fixed
-        range_map[
-            40] = MeasureRanges_I.A40_limited if not fixed else MeasureRanges_I.A40_fixed
-        cov = [x for x in range_map.keys() if x >= val]
-        if cov:
-            if fixed:
-                maxcov = max(cov)
-                return range_map[maxcov]
-            else:
-                mincov = min(cov)
-                return range_map[mincov]
-        else:
-            return MeasureRanges_I.full_auto
+        """ This returns the smallest current range covering the largest given
+        values, see get_mincover_V"""
+        return self.ranges.mincover_I(val1, val2, fixed)
 
     def __discover_channels(self):
         channels = []
@@ -0,0 +1,151 @@
+from collections import OrderedDict, namedtuple
+from .enums import MeasureModes, Format, OutputMode
+from .helpers import isSweep, isSpot
+from .programs import setup_variables
+from .setup import SetupKey
+from .state import InstrumentState
+from .timing import estimate_duration, sweep_steps, spgu_time
+
+# measure modes started by XE and read from the output buffer, see B1500.measure
+XE_MODES = (
+    MeasureModes.spot,
+    MeasureModes.staircase_sweep,
+    MeasureModes.sampling,
+    MeasureModes.multi_channel_sweep,
+    MeasureModes.CV_sweep_dc_bias,
+    MeasureModes.multichannel_pulsed_spot,
+    MeasureModes.multichannel_pulsed_sweep,
+    MeasureModes.pulsed_spot,
+    MeasureModes.pulsed_sweep,
+    MeasureModes.staircase_sweep_pulsed_bias,
+    MeasureModes.quasi_pulsed_spot,
+)
+
+
+class CompiledPlan(namedtuple("__CompiledPlan", [
+        "key", "setup", "execute", "teardown", "read", "measure_channels",
+        "spgu_channels", "format", "output_mode", "duration", "settings", "variables",
+        "elements", "spgu_runtimes"])):
+    """ A TestSetup rendered to the program lines the tester receives, see
+    B1500.compile. setup and teardown are tuples of ";" joined lines,
+    execute the command starting the test (XE, SRP or None). read is
+    "spot", "sweep" or None and says how the data is read, measure_channels
+    are the channels producing it. duration is the estimated run time in s,
+    settings the instrument state after the plan has run. variables are the
+    ProgramVariables of the setup, such plans only run as stored programs.
+    elements is the number of data elements a run leaves in the output
+    buffer, see output_elements. spgu_runtimes are the run times of the
+    pulse trains of spgu_channels, None for free run"""
+
+
+def plan_key(test_tuple):
+    """ Cache key of test_tuple, equal for setups rendering the same commands"""
+    return SetupKey(test_tuple)
+
+
+def join_lines(commands, max_length):
+    """ Joins commands with ";" into lines of at most max_length characters"""
+    lines, line, length = [], [], 0
+    for cmd in commands:
+        if line and length+len(cmd)+1 > max_length:
+            lines.append(";".join(line))
+            line, length = [], 0
+        line.append(cmd)
+        length += len(cmd)+1
+    if line:
+        lines.append(";".join(line))
+    return tuple(lines)
+
+
+def execution(test_tuple):
+    """ (execute, read, measure_channels, spgu_channels) of test_tuple,
+    deciding the measurement type like B1500.measure does"""
+    channels = test_tuple.channels
+    measure_channels = tuple(c.number for c in channels if c.measurement)
+    spgu_channels = tuple(c.number for c in channels if c.spgu)
+    xe = any(c.measurement and c.measurement.mode in XE_MODES for c in channels)
+    search = any(c.binarysearch or c.linearsearch for c in channels)
+    if [xe, bool(spgu_channels), search].count(True) > 1:
+        raise ValueError("Only one type of Measurement can be defined, please check your channel setups")
+    if xe:
+        read = "sweep" if isSweep(channels) else "spot" if isSpot(channels) else None
+        return "XE", read, measure_channels, spgu_channels
+    if spgu_channels:
+        return "SRP", None, measure_channels, spgu_channels
+    if search:
+        return "XE", None, measure_channels, spgu_channels
+    return None, None, measure_channels, spgu_channels
+
+
+def output_elements(test_tuple):
+    """ Number of data elements one run of test_tuple leaves in the output
+    buffer: a value per measured channel and point, in ASCII formats with
+    the time stamp run_test enables, and the source value per sweep step
+    unless output_mode is dataonly"""
+    measured = len([c for c in test_tuple.channels if c.measurement])
+    if not measured:
+        return 0
+    points = 1
+    sweeping = False
+    for c in test_tuple.channels:
+        sweep = c.staircase_sweep or c.pulsed_sweep
+        if sweep:
+            points = max(points, sweep_steps(sweep))
+            sweeping = True
+    binary = test_tuple.format in (Format.binary4, Format.binary4_crl, Format.binary8, Format.binary8_crl)
+    per_point = measured if binary else 2*measured
+    if sweeping and test_tuple.output_mode != OutputMode.dataonly:
+        per_point += 1
+    return points*per_point
+
+
+def build_plan(test_tuple, setup_commands, teardown_commands, max_length):
+    """ Builds the CompiledPlan of test_tuple from the captured commands"""
+    execute, read, measure_channels, spgu_channels = execution(test_tuple)
+    setup = join_lines(setup_commands, max_length)
+    teardown = join_lines(teardown_commands, max_length)
+    state = InstrumentState()
+    for line in setup+((execute,) if execute else ())+teardown:
+        state.apply(line)
+    return CompiledPlan(
+        key=plan_key(test_tuple), setup=setup, execute=execute, teardown=teardown,
+        read=read, measure_channels=measure_channels, spgu_channels=spgu_channels,
+        format=test_tuple.format, output_mode=test_tuple.output_mode,
+        duration=estimate_duration(test_tuple), settings=dict(state.settings),
+        variables=setup_variables(test_tuple),
+        elements=output_elements(test_tuple) if read else 0,
+        spgu_runtimes=tuple(spgu_time(c.spgu) for c in test_tuple.channels if c.spgu))
+
+
+class PlanCache(object):
+    """ LRU cache of CompiledPlans, keyed by plan_key of their TestSetup"""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__plans = OrderedDict()
+
+    def get(self, test_tuple, compile):
+        """ The plan of test_tuple, built by compile(test_tuple) on a miss"""
+        key = plan_key(test_tuple)
+        plan = self.__plans.get(key)
+        if plan is not None:
+            self.__plans.move_to_end(key)
+            self.hits += 1
+            return plan
+        self.misses += 1
+        plan = compile(test_tuple)
+        self.__plans[key] = plan
+        while len(self.__plans) > self.maxsize:
+            self.__plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        self.__plans.clear()
+
+    def __len__(self):
+        return len(self.__plans)
+
+    def __contains__(self, test_tuple):
+        return plan_key(test_tuple) in self.__plans
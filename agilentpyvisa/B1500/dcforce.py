@@ -20,7 +20,7 @@ class DCForceUnit(object):
                                     )
     def setup_dc_force(self, channel, force_setup):
         """ Sets up the channel configuration for forcing a DC force or current."""
-        if force_setup.input_range not in self.input_ranges:
+        if force_setup.input_range not in self.ranges.input_set:
             raise ValueError(
                 "Input range {} of channel {} not available in installed module {}".format(
                     repr(
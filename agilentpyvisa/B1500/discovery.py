@@ -0,0 +1,43 @@
+import json
+import os
+from .loggers import exception_logger
+
+# Cache of the hardware discovery of B1500.init: for every VISA address the
+# answers to the discovery queries (UNT? 0 and *LRN? per slot). A cached
+# discovery is used while the live UNT? 0 answer matches the cached one
+
+
+def load_discovery(path, address):
+    """ The cached discovery answers of address in the cache file path,
+    None if there are none or the file is unreadable"""
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f).get(address)
+    except (OSError, ValueError) as e:
+        exception_logger.warn("Ignoring unreadable discovery cache {}: {}".format(path, e))
+        return None
+
+
+def save_discovery(path, address, answers):
+    """ Stores the discovery answers of address in the cache file path,
+    keeping the entries of other addresses. answers=None removes the entry"""
+    path = os.path.expanduser(path)
+    cache = {}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    if answers is None:
+        cache.pop(address, None)
+    else:
+        cache[address] = answers
+    # write and rename, so concurrent readers never see half a file
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
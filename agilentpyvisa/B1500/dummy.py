@@ -1,8 +1,12 @@
 class DummyTester():
+    timeout = 2000
 
     def __init__(self, *args,**kwargs):
         pass
 
+    def close(self):
+        pass
+
     def query(*args, **kwargs):
         print(*[x for x in args if isinstance(x, str)])
         if kwargs:
@@ -11,6 +15,10 @@ class DummyTester():
             return ";".join(["B1517A,0"]*5)
         elif any(("LRN" in x for x in args if type(x)is str)):
             return "CL1;"
+        elif any(("*OPC?" in x for x in args if type(x)is str)):
+            return "1"
+        elif any(("*STB?" in x for x in args if type(x)is str)):
+            return "16"
         else:
             return "+0"
 
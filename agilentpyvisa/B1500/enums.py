@@ -100,6 +100,34 @@ class ParameterSettings(IntEnum):
     MultiChannelPulsedSweep = 106
     ParallelMeasurementMode = 110
 
+class ErrorCheck(IntEnum):
+    """ When the tester drains the ERRX? error queue, if default_check_err is set.
+    per_command checks after every command, which is sent on its own,
+    per_batch after every program line of commands joined by batch() and
+    per_test once at the end of run_test"""
+    never = 0
+    per_command = 1
+    per_batch = 2
+    per_test = 3
+
+class StatusByte(IntEnum):
+    """ Bits of the B1500 status byte, read by serial poll or *STB? and
+    enabled as service request sources with *SRE"""
+    data_ready = 1
+    wait = 2
+    interlock_open = 8
+    set_ready = 16
+    error = 32
+    request_service = 64
+
+class Priority(IntEnum):
+    """ Order in which a TesterWorker picks up queued jobs, lower first.
+    Jobs of equal priority run in submission order"""
+    abort = 0
+    high = 1
+    normal = 2
+    low = 3
+
 class Inputs(IntEnum):
     V = 0
     I = 1
@@ -1,6 +1,7 @@
 from collections import namedtuple
-from collections import Sequence
+from collections.abc import Sequence
 from .enums import *
+from .helpers import frozen
 
 
 class DCForce(
@@ -20,6 +21,8 @@ class DCForce(
     compliance - maximum response Voltage or Current. Relatively slow, so use external safeguards of testing delicate units
     polarity - whether the compliance limit has the same polarity as the forced value or not
     compliance_range - smallest InputRange_X Covering the compliance"""
+    __slots__ = ()
+
     def __new__(cls, input, value, compliance,input_range=InputRanges_I.full_auto,  polarity=Polarity.like_input, compliance_range=None):
         return super(DCForce, cls).__new__(cls,input,input_range, value, compliance, polarity,
                    compliance_range)
@@ -51,6 +54,8 @@ class StaircaseSweep(
     power_comp - ??? see 4-235 of manual
     auto_abort - whether or not we should abort the test on any irregularities
     """
+    __slots__ = ()
+
     def __new__(cls, input, input_range, start, stop, step, compliance,  sweepmode=SweepMode.linear_up_down, auto_abort=AutoAbort.enabled, power_comp=None, hold=0, delay=0):
         return super(StaircaseSweep, cls).__new__(cls,input, sweepmode, input_range, start, stop, step, compliance, power_comp, auto_abort, hold, delay)
 
@@ -73,6 +78,8 @@ class SPGU(namedtuple("__SPGU",[
     "pulse_leading",
     "pulse_trailing",
     ])):
+    __slots__ = ()
+
     def __new__(cls,
                 pulse_base,
                 pulse_peak,
@@ -80,13 +87,13 @@ class SPGU(namedtuple("__SPGU",[
                 levels=SPGULevels.Signal1_2_levels,
                 sources=SPGUSignals.Signal1,
                 pulse_period=None,
-                pulse_delay=[0],
-                pulse_leading=[2e-8],
-                pulse_trailing=[2e-8],
+                pulse_delay=(0,),
+                pulse_leading=(2e-8,),
+                pulse_trailing=(2e-8,),
                 wavemode=SPGUModes.Pulse,  # Pulses or Arbitrary Linear Wavve
                 output_mode=SPGUOutputModes.count, ## Free run, number of pulses or duration
                 condition=1,  ## Number of seconds to run or pulses to send
-                loadZ=[1e6],  # estimated impedance load of the DUT. Used internally by the SPGU to modify the supplied voltage (voltage divider with 50 Ohm)
+                loadZ=1e6,  # estimated impedance load of the DUT. Used internally by the SPGU to modify the supplied voltage (voltage divider with 50 Ohm)
                 switch_state=SPGUSwitch.disabled,
                 switch_normal=SPGUSwitchNormal.open, # switch normally open or closed
                 switch_delay=0,# time to delay pulse opening, independent of pulse_delay
@@ -116,16 +123,20 @@ class SPGU(namedtuple("__SPGU",[
                 raise ValueError("When specifying 3 level pulses, need to give pulse_base,pulse_peak,pulse_width,pulse_delay,pulse_lead,pulse_trail and sources as len 2 list or tuple")
 
         else:
-            pulse_peak=[pulse_peak,]
-            pulse_base=[pulse_base,]
-            pulse_width=[pulse_width,]
-            sources=[sources,]
+            pulse_peak=(pulse_peak,)
+            pulse_base=(pulse_base,)
+            pulse_width=(pulse_width,)
+            sources=(sources,)
             if not isinstance(pulse_delay,Sequence):
-                pulse_delay=[pulse_delay,]
+                pulse_delay=(pulse_delay,)
             if not isinstance(pulse_leading,Sequence):
-                pulse_leading=[pulse_leading,]
+                pulse_leading=(pulse_leading,)
             if not isinstance(pulse_trailing,Sequence):
-                pulse_trailing=[pulse_trailing,]
+                pulse_trailing=(pulse_trailing,)
+        # tuples keep the setup hashable, see SetupKey
+        pulse_base, pulse_peak, pulse_width, sources, pulse_delay, pulse_leading, pulse_trailing = (
+            frozen(x) for x in (pulse_base, pulse_peak, pulse_width, sources, pulse_delay, pulse_leading, pulse_trailing))
+        loadZ = frozen(loadZ)
         if pulse_period is None:
             pulse_period = max(pulse_width)+max(pulse_delay)+1e-8+max(pulse_trailing)/0.8
 
@@ -184,6 +195,8 @@ class PulsedSpot(namedtuple("__PulsedSpot", [
         hold =0, time to wait until pulse starts
         period= PulsePeriod.minimum, meaing the smalled time to fit both width and hold
         """
+    __slots__ = ()
+
     def __new__(cls, input, peak,width, compliance, hold=0, base=0,input_range=InputRanges_I.full_auto, period=PulsePeriod.minimum,):
         return super(PulsedSpot, cls).__new__(cls, input,input_range,base, peak,compliance,hold, width,  period)
 
@@ -220,6 +233,8 @@ class PulsedSweep(
     compliance - maximum response Voltage or Current. Relatively slow, so use external safeguards of testing delicate units
     auto_abort - whether or not we should abort the test on any irregularities
     """
+    __slots__ = ()
+
     def __new__(cls,input,start,stop,step,compliance, pulse_width, sweep_hold=0,weep_delay=0,pulse_hold=0,input_range=InputRanges_I.full_auto,base=0, pulse_period=PulsePeriod.minimum, auto_abort=AutoAbort.enabled,sweepmode=SweepMode.linear_up_down):
         return super(PulsedSweep, cls).__new__(cls,input,sweepmode,input_range,base,start,stop,step,compliance, auto_abort, sweep_hold,weep_delay,pulse_hold, pulse_width, pulse_period)
 
@@ -252,6 +267,8 @@ class BinarySearchSetup(
     the step measurement. max 65.535, resolution 0.0001 s
 
     """
+    __slots__ = ()
+
     def __new__(cls,input,start,stop,compliance,sync_compliance=None,sync_offset=0,sync_polarity=None, input_range=InputRanges_I.full_auto):
         if start and sync_polarity:
             raise ValueError("Source channel and synchronouschannel have to be the different")
@@ -291,6 +308,8 @@ class LinearSearchSetup(
     the step measurement. max 65.535, resolution 0.0001 s
 
     """
+    __slots__ = ()
+
     def __new__(cls,input,start,stop,compliance,sync_compliance=None,sync_offset=0,sync_polarity=None, input_range=InputRanges_I.full_auto):
         if start and sync_polarity:
             raise ValueError("Source channel and synchronouschannel have to be the different")
@@ -3,10 +3,9 @@ from .enums import MeasureRanges_V, MeasureModes, Format
 from logging import getLogger
 from .loggers import exception_logger,write_logger, query_logger
 from itertools import cycle, starmap, compress, chain
-import pandas as pd
-import numpy as np
+from .lazy import np, pd
 from .enums import OutputMode
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 
 def availableInputRanges(model):
@@ -41,6 +40,42 @@ def availableInputRanges(model):
 def format_command(cmd, *args):
     return "{} {}".format(cmd, ",".join(["{}".format(x) for x in args if x is not None]))
 
+class ErrorRecord(namedtuple("__ErrorRecord",["code","message","commands"])):
+    """ An error read from the ERRX? queue, with the commands sent since the
+    previous check. The tester can not tell which of them raised the error,
+    with ErrorCheck.per_command this is always exactly one command"""
+    def __new__(cls, errx_response, commands=()):
+        code, _, message = errx_response.strip().partition(",")
+        return super(ErrorRecord, cls).__new__(cls, int(code), message.strip('"'), tuple(commands))
+
+# Range codes of the binary output formats, in A and V, see the range
+# tables on pages 1-42 and 1-50 of the manual
+binary_current_ranges = dict([(n, 10.0**(n-20)) for n in range(8, 21)]+[(21, 2.), (22, 20.), (23, 40.)])
+binary_voltage_ranges = {8: 0.2, 9: 0.5, 10: 2., 11: 5., 12: 20., 13: 40., 14: 100.,
+                         15: 200., 16: 500., 17: 1500., 18: 3000.}
+# full scale counts of binary data, value = count*range/full_scale
+binary4_measure_scale = 50000
+binary4_source_scale = 20000
+binary8_scale = 1000000
+
+def binary_range_code(value, ranges):
+    """ Smallest range code of ranges covering value, the largest if none does"""
+    covering = [k for k, v in ranges.items() if v >= abs(value)]
+    if covering:
+        return min(covering, key=ranges.get)
+    return max(ranges, key=ranges.get)
+
+def frozen(value):
+    """ value with its lists turned into tuples, recursively, so setups holding it are hashable"""
+    if isinstance(value, list) or (isinstance(value, tuple) and not hasattr(value, "_fields")):
+        return tuple(frozen(x) for x in value)
+    return value
+
+
+def command_mnemonic(cmd):
+    """ Returns the mnemonic of a single command, e.g. "DV" for "DV 1,0,1" """
+    return cmd.strip().split(" ",1)[0].split(",",1)[0]
+
 
 
 def availableMeasureRanges(model):
@@ -106,10 +141,10 @@ def parse_ascii(test_format, output , num_measure, timestamp, outputmode, num_fo
     num_fields = num_measure if not timestamp else num_measure*2
     if outputmode in (OutputMode.with_primarysource, OutputMode.with_synchronoussource):
         num_fields += num_force
-    dtypes = np.float
+    dtypes = float
     if hasHeader(test_format):
         fields = getFields(num_fields, lines)
-        dtypes = {"names": fields, "formats": [np.float]*len(fields)}
+        dtypes = {"names": fields, "formats": [float]*len(fields)}
         lines = list(filter(lambda x: any([f in x for f in fields]), lines))
         sel_lists = (( 0 if x != i else 1 for x in range(num_fields)) for i in range(num_fields))
         field_iters = (compress(lines, cycle(sel_list)) for sel_list in sel_lists)
@@ -117,7 +152,7 @@ def parse_ascii(test_format, output , num_measure, timestamp, outputmode, num_fo
         filtered_arr = np.array(list(zip(*filtered)), dtype=dtypes)
     else:
         lines= (tuple([x.lower() for x in line.split(",")] for line in lines))
-        filtered_arr = np.fromiter(lines,dtype=np.float)
+        filtered_arr = np.fromiter(lines,dtype=float)
     return pd.DataFrame(filtered_arr)
 
 def parse_ascii_default_dict(test_format, output):
@@ -126,30 +161,68 @@ def parse_ascii_default_dict(test_format, output):
     lines=(chain.from_iterable(lines))
     data_dict = defaultdict(list)
     for l in lines:
-        data_dict[l[1:3]].append(np.float(l[3:].lower()))
+        data_dict[l[1:3]].append(float(l[3:].lower()))
     series_dict = dict([(k, pd.Series(v)) for k,v in data_dict.items()])
     return (pd.DataFrame(series_dict),series_dict)
 
 
-""" postpose binary parsing for now
-def parse_binary4(self,byte_data):
-    raise NotImplementedError
-    bitstream = getBits(byte_data)
-    for datum in group_bits(bitstream,8*4):
-        a = datum[0]   # 1/0 measurement data/other data
-        b = datum[1]   # parameter 1/0: SMU: current or capacitance/voltage,cmu:conductance or susceptance/resistance or reactance
-        c = datum[2:7]  # range Value, see table page 1-42
-        d = datum[7:24]  # data count. multiply with range_val from table import for data. for SMU: measurement_data = d*range_val/50e3, source-data=d*range_val/20e3
-        e = datum[24:27] # status source data_001=> first or intermediate sweep 010 last sweep for measurement data:see table on 1-46
-        f = datum[27:32] # channel number
-        datum_type = parse4_getType(a)
-        param = parse4_getParam(b)
-        channel_num = int(d,base=2)
-        unit = self.slots_installed.get(self.__channel_to_slot(channel)) # get the module using the channel number
-        drange = parse4_getRange(c, unit)
-        data = parse4_getData(d,drange,unit)
-        status = parse4_getStatus(e, datum_type)
+# fields of the decoded binary4 data, see parse_binary4
+binary4_dtype = [("measured", "?"), ("parameter", "u1"), ("range", "f8"),
+                 ("value", "f8"), ("status", "u1"), ("channel", "u1")]
+
+def range_table(ranges, size=32):
+    """ Array of the values of the range codes in ranges, indexed by code, NaN for unknown codes"""
+    table = np.full(size, np.nan)
+    for code, value in ranges.items():
+        table[code] = value
+    return table
+
+def binary4_tables(channel_ranges=None):
+    """ Array of range values indexed by [channel, parameter, range code] for
+    parse_binary4. channel_ranges maps channel (slot) numbers to the
+    (voltage ranges, current ranges) of their module, or None for modules
+    whose data is not decoded, like the CMU. Channels without tables decode to
+    NaN, without channel_ranges all channels use the SMU tables"""
+    if channel_ranges is None:
+        channel_ranges = dict.fromkeys(range(32), (binary_voltage_ranges, binary_current_ranges))
+    tables = np.full((32, 2, 32), np.nan)
+    for channel, ranges in channel_ranges.items():
+        if ranges is not None:
+            tables[channel] = [range_table(r) for r in ranges]
+    return tables
+
+def parse_binary4(byte_data, tables=None):
+    """ Decodes binary4 output (FMT 3 and 4) to a numpy array of binary4_dtype,
+    one element per 4 byte word, see page 1-42 of the manual:
+    A (bit 31) measured: measurement data, else source output data
+    B (bit 30) parameter: 1 current, 0 voltage
+    C (bits 25-29) range code, range is its value in the tables of the module
+    D (bits 8-24) data count, two's complement, value = count*range/50000 for
+      measurement data and count*range/20000 for source data
+    E (bits 5-7) status
+    F (bits 0-4) channel (slot) number
+    tables are the range tables per channel from binary4_tables, by default
+    the SMU tables for all channels. Range and value are NaN for channels
+    without tables, e.g. CMU data, whose B and C mean something else"""
+    if tables is None:
+        tables = binary4_tables()
+    if byte_data.endswith(b"\r\n") and len(byte_data) % 4 == 2:
+        byte_data = byte_data[:-2]
+    words = np.frombuffer(byte_data, dtype=">u4")
+    data = np.empty(len(words), dtype=binary4_dtype)
+    data["measured"] = words >> 31
+    data["parameter"] = (words >> 30) & 0x1
+    codes = (words >> 25) & 0x1F
+    count = ((words >> 8) & 0x1FFFF).astype(np.int32)
+    count[count >= 0x10000] -= 0x20000
+    data["status"] = (words >> 5) & 0x7
+    data["channel"] = words & 0x1F
+    data["range"] = tables[data["channel"], data["parameter"], codes]
+    data["value"] = count*data["range"]/np.where(data["measured"], binary4_measure_scale, binary4_source_scale)
+    return data
+
 
+""" postpose binary8 parsing for now
 class Binary4DataType(Enum):
     MeasurementData =1
     OtherData = 0
@@ -0,0 +1,27 @@
+import importlib
+
+# numpy, pandas and pyvisa take most of the import time of this package but
+# are only needed to parse data and to talk to a tester. They are imported
+# on first use, so command building and short lived processes start fast
+
+
+class LazyModule(object):
+    """ Stands in for the module name, which is imported on the first
+    attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return "<lazy module {}{}>".format(self._name, "" if self._module is None else " (loaded)")
+
+
+visa = LazyModule("visa")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
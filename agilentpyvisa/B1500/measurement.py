@@ -3,6 +3,8 @@ from .enums import *
 from .enums import MeasureSides,MeasureRanges_I,MeasureRanges_V, MeasureModes
 
 class MeasureStaircaseSweep(namedtuple("__MeasureStaircaseSweep",["target","range","side","mode"])):
+    __slots__ = ()
+
     def __new__(cls,target,range=MeasureRanges_I.full_auto,side=MeasureSides.compliance_side):
         # full_auto the same in I and V (=0)
         """ Specifies a StaircaseSweep measurement, see page 2-8 of the manual"""
@@ -10,12 +12,16 @@ class MeasureStaircaseSweep(namedtuple("__MeasureStaircaseSweep",["target","rang
         return super(MeasureStaircaseSweep, cls).__new__(cls,target,range,side,mode)
 
 class MeasureSpot(namedtuple("__MeasureSpot",["target","range","side","mode"])):
+    __slots__ = ()
+
     def __new__(cls, target,  range=MeasureRanges_I.full_auto, side=MeasureSides.compliance_side):
         # full_auto the same in I and V (=0)
         mode=MeasureModes.spot
         return super(MeasureSpot, cls).__new__(cls, target, range, side, mode)
 
 class MeasurePulsedSpot(namedtuple("__MeasurePulsedSpot",["target","range","side","mode"])):
+    __slots__ = ()
+
     def __new__(cls, target,  range=MeasureRanges_I.full_auto, side=MeasureSides.compliance_side):
         # full_auto the same in I and V (=0)
         mode=MeasureModes.pulsed_spot
@@ -33,6 +39,8 @@ class MeasureLinearSearch(namedtuple("__MeasureLinearSearch",["mode",
                                                               "measure_range",
                                                               "target_value",
                                                               ])):
+    __slots__ = ()
+
     def __new__(cls,target,target_value,condition,post=SearchPost.start,output_mode=SearchOutput.sense_and_search, auto_abort=AutoAbort.enabled,hold=0,delay=0,searchmode=SearchModes.limit,measure_range=MeasureRanges_I.full_auto,):
         # full_auto the same in I and V (=0)
         mode=MeasureModes.binary_search
@@ -55,6 +63,8 @@ class MeasureBinarySearch(namedtuple("__MeasureBinarySearch",["mode",
                                                               "measure_range",
                                                               "target_value",
                                                               ])):
+    __slots__ = ()
+
     def __new__(cls,target,target_value,condition,post=SearchPost.start,output_mode=SearchOutput.sense_and_search, control_mode=SearchControlMode.normal,auto_abort=AutoAbort.enabled,hold=0,delay=0,searchmode=SearchModes.limit,measure_range=MeasureRanges_I.full_auto,):
         # full_auto the same in I and V (=0)
         mode=MeasureModes.binary_search
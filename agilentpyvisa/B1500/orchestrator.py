@@ -0,0 +1,114 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, CancelledError
+from queue import Queue
+from threading import Thread
+from .loggers import exception_logger
+from .tester import B1500
+
+
+class TaggedResult(namedtuple("__TaggedResult", ["address", "slots", "test", "result", "error"])):
+    """ Result of a TestSetup run by an Orchestrator. address is the VISA
+    address of the tester that ran it, slots the mainframe slots its channels
+    occupy. error holds the exception if the run failed or was cancelled,
+    result is None then"""
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def setup_slots(test_tuple):
+    """ Sorted tuple of the mainframe slots used by the channels of test_tuple"""
+    return tuple(sorted(set(int(str(c.number)[0]) for c in test_tuple.channels)))
+
+
+class Orchestrator(object):
+    """ Runs TestSetups on several B1500 mainframes in parallel. Every tester
+    gets its own thread, which takes jobs from a shared queue, so work goes to
+    whichever tester is free next. Results of all testers are merged into a
+    single stream of TaggedResults, see results().
+
+    testers are B1500 instances or VISA addresses, the latter are created
+    with the given keyword arguments. All testers must be able to run all
+    submitted setups, i.e. have the same modules in the same slots."""
+
+    __stop = object()
+
+    def __init__(self, testers, start=True, **kwargs):
+        self.testers = OrderedDict()
+        for t in testers:
+            if not isinstance(t, B1500):
+                t = B1500(t, **kwargs)
+            self.testers[t.address] = t
+        self._jobs = Queue()
+        self._results = Queue()
+        self.__pending = 0
+        self.__threads = [Thread(target=self.__run, args=(t,), name="B1500-{}".format(a), daemon=True)
+                          for a, t in self.testers.items()]
+        if start:
+            self.start()
+
+    def start(self):
+        for t in self.__threads:
+            t.start()
+
+    def submit(self, test_tuple, **kwargs):
+        """ Queues test_tuple to run on the next free tester, kwargs are passed
+        on to run_test. Returns a Future resolving to the TaggedResult"""
+        future = Future()
+        self.__pending += 1
+        self._jobs.put((future, test_tuple, kwargs))
+        return future
+
+    def map(self, test_tuples, **kwargs):
+        """ Submits all test_tuples and yields their TaggedResults in
+        completion order"""
+        for t in test_tuples:
+            self.submit(t, **kwargs)
+        return self.results()
+
+    def results(self, timeout=None):
+        """ Yields TaggedResults as they complete, until all submitted jobs
+        are collected. Raises queue.Empty if no result arrives in timeout"""
+        while self.__pending:
+            result = self._results.get(timeout=timeout)
+            self.__pending -= 1
+            yield result
+
+    def stop(self, wait=True, close=True):
+        """ Stops all tester threads after the queued jobs are done, closing
+        the connections if close is set"""
+        for _ in self.__threads:
+            self._jobs.put(self.__stop)
+        if wait:
+            for t in self.__threads:
+                t.join()
+        if close:
+            for tester in self.testers.values():
+                tester.close()
+
+    def __run(self, tester):
+        while True:
+            job = self._jobs.get()
+            if job is self.__stop:
+                return
+            future, test_tuple, kwargs = job
+            result, error = None, None
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = tester.run_test(test_tuple, **kwargs)
+                except Exception as e:
+                    exception_logger.warn("Test failed on {}: {}".format(tester.address, e))
+                    error = e
+            else:
+                error = CancelledError()
+            tagged = TaggedResult(tester.address, setup_slots(test_tuple), test_tuple, result, error)
+            if not future.cancelled():
+                future.set_result(tagged)
+            self._results.put(tagged)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
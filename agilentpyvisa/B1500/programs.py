@@ -0,0 +1,133 @@
+from collections import OrderedDict
+
+
+class ProgramCache(object):
+    """ Bookkeeping for TestSetups which B1500 stores as internal programs
+    (ST ... END) and runs with DO, see B1500.auto_programs. A setup is
+    stored once it ran min_runs times. At most max_programs are kept, under
+    the program numbers from first_number on, which stay clear of the
+    numbers record_program uses. If all numbers are used, the least recently
+    run program is replaced.
+
+    Keys are the CompiledPlan keys of the setups, runs are counted for the
+    max_tracked most recently seen setups"""
+
+    def __init__(self, min_runs=3, max_programs=32, first_number=1000, max_tracked=1024):
+        if first_number < 1 or first_number+max_programs-1 > 2000:
+            raise ValueError("Program numbers must be between 1 and 2000")
+        self.min_runs = min_runs
+        self.max_programs = max_programs
+        self.first_number = first_number
+        self.max_tracked = max_tracked
+        self.runs = OrderedDict()
+        self.stored = OrderedDict()
+
+    def lookup(self, key):
+        """ Counts a run of key and returns its program number, None if it
+        is not stored"""
+        if key in self.stored:
+            self.stored.move_to_end(key)
+            return self.stored[key]
+        self.runs[key] = self.runs.pop(key, 0)+1
+        while len(self.runs) > self.max_tracked:
+            self.runs.popitem(last=False)
+        return None
+
+    def due(self, key):
+        """ Whether key ran often enough to be stored"""
+        return self.runs.get(key, 0) >= self.min_runs
+
+    def allocate(self, key):
+        """ Assigns a program number to key, taking the one of the least
+        recently run program if all are used"""
+        used = set(self.stored.values())
+        free = [n for n in range(self.first_number, self.first_number+self.max_programs) if n not in used]
+        if free:
+            number = free[0]
+        else:
+            number = self.stored.popitem(last=False)[1]
+        self.runs.pop(key, None)
+        self.stored[key] = number
+        return number
+
+    def discard(self, key):
+        """ Forgets key, e.g. because its program failed"""
+        self.stored.pop(key, None)
+        self.runs.pop(key, None)
+
+    def clear(self):
+        self.stored.clear()
+        self.runs.clear()
+
+    def __len__(self):
+        return len(self.stored)
+
+
+class ProgramVariable(float):
+    """ A setup value bound to the tester variable %Rn (%In if integer),
+    with n from 1 to 99, for setups stored as programs. In commands it
+    renders as the variable, its float value is used for validation and is
+    sent with VAR before the program runs (see B1500.run_test). It equals
+    the variables of the same number whatever their values, and its repr
+    leaves out the value, so setups differing only in the values of their
+    variables compile to the same plan and share one program"""
+
+    def __new__(cls, number, value=0., integer=False):
+        if not 1 <= number <= 99:
+            raise ValueError("Variable number must be between 1 and 99, got {}".format(number))
+        self = super(ProgramVariable, cls).__new__(cls, int(value) if integer else value)
+        self.number = number
+        self.integer = integer
+        return self
+
+    def __getnewargs__(self):
+        return (self.number, float(self), self.integer)
+
+    @property
+    def name(self):
+        return "%{}{}".format("I" if self.integer else "R", self.number)
+
+    def __format__(self, spec):
+        return self.name
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return "ProgramVariable({}{})".format(self.number, ", integer=True" if self.integer else "")
+
+    def __eq__(self, other):
+        # only variables compare equal, matching the hash of the name.
+        # NotImplemented would fall back to comparing as floats
+        return isinstance(other, ProgramVariable) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def bind(self, value):
+        """ The same variable with another value"""
+        return ProgramVariable(self.number, value, self.integer)
+
+    def command(self, value=None):
+        """ The VAR command setting the variable to value, by default its own"""
+        value = float(self) if value is None else value
+        if self.integer:
+            return "VAR 0,{},{:d}".format(self.number, int(value))
+        return "VAR 1,{},{!r}".format(self.number, float(value))
+
+
+def setup_variables(setup):
+    """ The ProgramVariables in setup, any setup tuple or list of them, in
+    order of appearance and each variable once"""
+    found = OrderedDict()
+    def walk(obj):
+        if isinstance(obj, ProgramVariable):
+            found.setdefault(obj.name, obj)
+        elif isinstance(obj, (tuple, list)):
+            for x in obj:
+                walk(x)
+    walk(setup)
+    return tuple(found.values())
@@ -0,0 +1,155 @@
+import base64
+import gzip
+import json
+import time
+from .lazy import visa
+from .loggers import exception_logger
+
+
+class ReplayError(ValueError):
+    """ Raised when the commands sent differ from the recorded session"""
+
+
+def _encode(value):
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, tuple):
+        # pyvisa write returns (count, StatusCode)
+        return [_encode(v) for v in value]
+    if hasattr(value, "value") and isinstance(value, int):
+        return int(value)
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and "b64" in value:
+        return base64.b64decode(value["b64"])
+    return value
+
+
+class RecordingResource(object):
+    """ Wraps a VISA resource and records every call with its arguments,
+    result and duration as gzipped JSON lines in path, to be replayed by
+    ReplayResource. Only the calls B1500 makes are exposed, so service
+    request events are not available and the tester polls the status byte"""
+
+    recorded = ("write", "query", "read", "read_raw", "read_stb", "clear")
+
+    def __init__(self, resource, path, resource_manager=None):
+        self._resource = resource
+        self._rm = resource_manager
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self.path = path
+
+    @property
+    def timeout(self):
+        return self._resource.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._resource.timeout = value
+
+    def __getattr__(self, name):
+        if name not in self.recorded:
+            raise AttributeError(name)
+        method = getattr(self._resource, name)
+        def call(*args, **kwargs):
+            entry = {"o": name, "a": list(args)}
+            if kwargs:
+                entry["k"] = kwargs
+            start = time.time()
+            try:
+                ret = method(*args, **kwargs)
+                entry["r"] = _encode(ret)
+                return ret
+            except visa.VisaIOError as e:
+                entry["e"] = e.error_code
+                raise
+            finally:
+                entry["t"] = round(time.time()-start, 6)
+                self._file.write(json.dumps(entry, separators=(",", ":"))+"\n")
+        return call
+
+    def close(self):
+        try:
+            self._resource.close()
+            if self._rm is not None:
+                self._rm.close()
+        finally:
+            self._file.close()
+
+
+class ReplayResource(object):
+    """ Fake instrument answering from a session recorded by
+    RecordingResource. Every call must match the next recorded one in
+    method, arguments and keyword arguments, otherwise ReplayError is
+    raised. Recorded VISA errors are raised again. With timing each call
+    takes as long as it did in the recording, otherwise replay runs at full
+    speed"""
+
+    def __init__(self, path, timing=False, strict=True):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self._entries = [json.loads(line) for line in f if line.strip()]
+        self.path = path
+        self.timing = timing
+        self.strict = strict
+        self.position = 0
+        self.timeout = 2000
+
+    @property
+    def finished(self):
+        return self.position >= len(self._entries)
+
+    def __next_entry(self, name, args, kwargs):
+        if self.finished:
+            raise ReplayError("Recording {} exhausted, got {}{}".format(self.path, name, args))
+        entry = self._entries[self.position]
+        expected = (entry["o"], entry["a"], entry.get("k", {}))
+        if self.strict and expected != (name, list(args), kwargs):
+            raise ReplayError("Call {} differs from the recording: expected {}{}, got {}{}".format(
+                self.position, entry["o"], tuple(entry["a"]), name, args))
+        self.position += 1
+        return entry
+
+    def __getattr__(self, name):
+        if name not in RecordingResource.recorded:
+            raise AttributeError(name)
+        def call(*args, **kwargs):
+            entry = self.__next_entry(name, args, kwargs)
+            if self.timing:
+                time.sleep(entry["t"])
+            if "e" in entry:
+                raise visa.VisaIOError(entry["e"])
+            ret = entry.get("r")
+            return tuple(ret) if isinstance(ret, list) else _decode(ret)
+        return call
+
+    def close(self):
+        if not self.finished:
+            exception_logger.info("Replay of {} closed at call {} of {}".format(
+                self.path, self.position, len(self._entries)))
+
+
+def recording_factory(path, resource_factory=None):
+    """ resource_factory for B1500 recording the session to path. The
+    resource is opened by resource_factory or, by default, by VISA"""
+    def open_resource(address):
+        rm = None
+        if resource_factory is not None:
+            resource = resource_factory(address)
+        else:
+            rm = visa.ResourceManager()
+            resource = rm.open_resource(address)
+        return RecordingResource(resource, path, rm)
+    return open_resource
+
+
+def replay_factory(path, timing=False, strict=True):
+    """ resource_factory for B1500 replaying the session in path. Reconnects
+    continue the same replay"""
+    replay = []
+    def open_resource(address):
+        if not replay:
+            replay.append(ReplayResource(path, timing, strict))
+        return replay[0]
+    return open_resource
@@ -0,0 +1,232 @@
+import os
+from collections import deque
+from enum import Enum
+from itertools import count
+from multiprocessing.connection import Listener, Client
+from threading import Thread, Condition
+from . import enums, force, measurement, setup
+from .loggers import exception_logger
+
+
+def _registry(*modules, base=tuple):
+    return {name: cls for m in modules for name, cls in vars(m).items()
+            if isinstance(cls, type) and issubclass(cls, base) and cls.__module__ == m.__name__}
+
+_SETUP_TYPES = _registry(force, measurement, setup)
+_ENUM_TYPES = _registry(enums, base=Enum)
+
+
+def encode_setup(obj):
+    """ Converts a TestSetup, Channel or any other setup tuple into plain
+    builtins that pickle safely. The setup classes cannot be pickled
+    directly, as their __new__ takes the fields in a different order"""
+    if type(obj).__name__ in _SETUP_TYPES:
+        return ("setup", type(obj).__name__, [encode_setup(x) for x in obj])
+    if isinstance(obj, Enum):
+        return ("enum", type(obj).__name__, obj.value)
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, [encode_setup(x) for x in obj])
+    return obj
+
+
+def decode_setup(obj):
+    """ Inverse of encode_setup"""
+    if not isinstance(obj, tuple):
+        return obj
+    if obj[0] == "setup":
+        # _make bypasses __new__, the fields were validated by the sender
+        return _SETUP_TYPES[obj[1]]._make(decode_setup(x) for x in obj[2])
+    if obj[0] == "enum":
+        return _ENUM_TYPES[obj[1]](obj[2])
+    values = [decode_setup(x) for x in obj[1]]
+    return tuple(values) if obj[0] == "tuple" else values
+
+
+class _ClientSession(object):
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.jobs = deque()
+
+
+class InstrumentServer(object):
+    """ Shares one B1500 between several client processes. Clients connect
+    with InstrumentClient over a local TCP or Unix domain socket (address is
+    a (host, port) tuple or a path) and need the servers authkey.
+
+    Jobs of different clients are served round robin. If the next job of
+    some client uses the same TestSetup as the one that just ran, it may
+    jump the line, so the tester skips reconfiguring its channels. At most
+    max_affinity jobs in a row are preferred like that, so no client starves."""
+
+    # operations clients may request, mapped to the B1500 methods
+    operations = {"run_test": "run_test", "query": "query", "write": "write",
+                  "read": "read", "check_err": "_check_err"}
+
+    def __init__(self, tester, address=("localhost", 0), authkey=None, max_affinity=4):
+        self.tester = tester
+        self.authkey = authkey or os.urandom(16)
+        self.max_affinity = max_affinity
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self.__clients = []
+        self.__cv = Condition()
+        self.__running = False
+        self.__last_setup = None
+        self.__affinity_run = 0
+        self.__names = count()
+        self.__threads = []
+
+    def start(self):
+        """ Starts accepting clients and serving jobs in background threads"""
+        self.__running = True
+        for target in (self.__accept, self.__serve):
+            t = Thread(target=target, daemon=True)
+            t.start()
+            self.__threads.append(t)
+        return self
+
+    def stop(self):
+        """ Stops serving after the running job, pending jobs are dropped"""
+        with self.__cv:
+            self.__running = False
+            self.__cv.notify_all()
+        try:
+            # wake up the blocking accept
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        for t in self.__threads:
+            t.join()
+        self._listener.close()
+        with self.__cv:
+            for c in self.__clients:
+                c.conn.close()
+            self.__clients = []
+
+    def __accept(self):
+        while self.__running:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if self.__running:
+                    exception_logger.warn("Rejected connection: {}".format(e))
+                continue
+            if not self.__running:
+                conn.close()
+                return
+            client = _ClientSession(conn, next(self.__names))
+            with self.__cv:
+                self.__clients.append(client)
+            Thread(target=self.__receive, args=(client,), daemon=True).start()
+
+    def __receive(self, client):
+        while self.__running:
+            try:
+                job = client.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.__cv:
+                client.jobs.append(job)
+                self.__cv.notify_all()
+        with self.__cv:
+            if client in self.__clients:
+                self.__clients.remove(client)
+
+    def _next_job(self):
+        """ Picks the next (client, job), call with the lock held"""
+        ready = [c for c in self.__clients if c.jobs]
+        if not ready:
+            return None, None
+        client = ready[0]
+        if self.__last_setup is not None and self.__affinity_run < self.max_affinity:
+            same = [c for c in ready if c.jobs[0][1] == "run_test" and c.jobs[0][2][0] == self.__last_setup]
+            if same and same[0] is not client:
+                client = same[0]
+                self.__affinity_run += 1
+            else:
+                self.__affinity_run = 0
+        else:
+            self.__affinity_run = 0
+        # round robin: the served client goes to the back of the line
+        self.__clients.remove(client)
+        self.__clients.append(client)
+        return client, client.jobs.popleft()
+
+    def __serve(self):
+        while True:
+            with self.__cv:
+                client, job = self._next_job()
+                while self.__running and job is None:
+                    self.__cv.wait()
+                    client, job = self._next_job()
+                if not self.__running:
+                    return
+            job_id, op, args, kwargs = job
+            try:
+                if op not in self.operations:
+                    raise ValueError("Unsupported operation {}".format(op))
+                if op == "run_test":
+                    self.__last_setup = args[0]
+                    args = (decode_setup(args[0]),) + tuple(args[1:])
+                reply = (job_id, True, getattr(self.tester, self.operations[op])(*args, **kwargs))
+            except Exception as e:
+                exception_logger.warn("Job {} of client {} failed: {}".format(op, client.name, e))
+                reply = (job_id, False, e)
+            try:
+                client.conn.send(reply)
+            except (OSError, EOFError):
+                exception_logger.warn("Client {} disconnected before receiving its result".format(client.name))
+            except Exception:
+                # unpicklable result or exception
+                client.conn.send((job_id, False, RuntimeError(repr(reply[2]))))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class InstrumentClient(object):
+    """ Connects to an InstrumentServer and exposes the shared testers
+    run_test, query, write, read and check_err. Calls block until the
+    server has run the job, errors raised on the server are reraised"""
+
+    def __init__(self, address, authkey):
+        self._conn = Client(address, authkey=authkey)
+        self.__ids = count()
+
+    def _request(self, op, *args, **kwargs):
+        job_id = next(self.__ids)
+        self._conn.send((job_id, op, args, kwargs))
+        reply_id, ok, value = self._conn.recv()
+        if reply_id != job_id:
+            raise RuntimeError("Got reply to job {}, expected {}".format(reply_id, job_id))
+        if not ok:
+            raise value
+        return value
+
+    def run_test(self, test_tuple, **kwargs):
+        return self._request("run_test", encode_setup(test_tuple), **kwargs)
+
+    def query(self, msg, *args, **kwargs):
+        return self._request("query", msg, *args, **kwargs)
+
+    def write(self, msg, *args, **kwargs):
+        return self._request("write", msg, *args, **kwargs)
+
+    def read(self, *args, **kwargs):
+        return self._request("read", *args, **kwargs)
+
+    def check_err(self):
+        return self._request("check_err")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
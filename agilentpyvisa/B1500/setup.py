@@ -1,5 +1,6 @@
 from .enums import (ADCMode, Format, Filter, OutputMode, SeriesResistance, ADCTypes,)
 from collections import namedtuple
+from .helpers import frozen
 
 
 class TestSetup(namedtuple('__TestSetup',
@@ -17,10 +18,13 @@ class TestSetup(namedtuple('__TestSetup',
                             "spgu_selector_setup",
                             ])):
 
-    def __new__(cls, channels=[], highspeed_adc_number=1, highspeed_adc_mode=ADCMode.auto,
-        adc_modes=[], format=Format.ascii12_with_header_crl,
-        output_mode=OutputMode.dataonly, filter=Filter.enabled,spgu_selector_setup=[(0,0) for i in range(4)]):
+    __slots__ = ()
+
+    def __new__(cls, channels=(), highspeed_adc_number=1, highspeed_adc_mode=ADCMode.auto,
+        adc_modes=(), format=Format.ascii12_with_header_crl,
+        output_mode=OutputMode.dataonly, filter=Filter.enabled,spgu_selector_setup=((0,0),)*4):
         # add default values
+        channels, adc_modes, spgu_selector_setup = frozen(channels), frozen(adc_modes), frozen(spgu_selector_setup)
         num_mes= len(set([c.measurement.mode for c in channels if c.measurement]))
         if any([x.spgu for x in channels]) and not spgu_selector_setup:
             raise ValueError("If you do want to use the spgu, you need to configure the SMUSPGU selector. supply a list of (port, state) tuples to spgu_selector_setup keyword")
@@ -46,6 +50,8 @@ class Channel(
                    "binarysearch",
                    "linearsearch",
                    ])):
+    __slots__ = ()
+
     def __new__(cls,number,  series_resistance=SeriesResistance.disabled, channel_adc=ADCTypes.highspeed,
                    dcforce=None, staircase_sweep=None, pulsed_sweep=None, pulsed_spot=None, spgu=None, quasipulse=None,
                    highspeed_spot=None, measurement=None,binarysearch=None,linearsearch=None ):
@@ -56,3 +62,28 @@ class Channel(
             raise ValueError("At most one force setup can be use per channel")
         return super(Channel, cls).__new__(cls, number, series_resistance, channel_adc,
                    dcforce, staircase_sweep, pulsed_sweep,  pulsed_spot, quasipulse, spgu, highspeed_spot, measurement,binarysearch,linearsearch )
+
+
+class SetupKey(object):
+    """ Key of a setup (any setup tuple) for caches and deduplication. The
+    hash of the setup is computed once, and compared before the setups, so
+    lookups do not walk the setup again"""
+    __slots__ = ("setup", "hash")
+
+    def __init__(self, setup):
+        self.setup = setup
+        self.hash = hash(setup)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        return isinstance(other, SetupKey) and self.hash == other.hash and self.setup == other.setup
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "SetupKey({!r})".format(self.setup)
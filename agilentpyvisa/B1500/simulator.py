@@ -0,0 +1,619 @@
+import math
+import struct
+import time
+from collections import deque
+from .enums import Format, MeasureModes, MeasureSides, SweepMode, StatusByte
+from .helpers import (binary_current_ranges, binary_voltage_ranges, binary_range_code,
+                      binary4_measure_scale, binary4_source_scale, binary8_scale, command_mnemonic)
+from .lazy import visa
+from .loggers import exception_logger
+
+
+# DUT models, connected between a channel and ground. current() and
+# voltage() give the response to a forced voltage or current
+
+class Resistor(object):
+    def __init__(self, resistance=1e3):
+        self.resistance = resistance
+
+    def current(self, voltage):
+        return voltage/self.resistance
+
+    def voltage(self, current):
+        return current*self.resistance
+
+
+class Diode(object):
+    """ Shockley diode, anode on the channel"""
+    def __init__(self, saturation_current=1e-12, ideality=1.5, temperature=300.):
+        self.saturation_current = saturation_current
+        self.ideality = ideality
+        self.temperature = temperature
+
+    @property
+    def _nVt(self):
+        return self.ideality*8.617333e-5*self.temperature
+
+    def current(self, voltage):
+        # clipped, the compliance limits the current anyway
+        return self.saturation_current*(math.exp(min(voltage/self._nVt, 200.))-1)
+
+    def voltage(self, current):
+        return self._nVt*math.log(max(current/self.saturation_current+1, 1e-300))
+
+
+class ReRAM(object):
+    """ Bipolar resistive switch with hysteresis. Switches to low_resistance
+    once the voltage reaches set_voltage and back to high_resistance at
+    reset_voltage. The state persists between measurements"""
+    def __init__(self, low_resistance=1e3, high_resistance=1e6, set_voltage=1.,
+                 reset_voltage=-1., low=False):
+        self.low_resistance = low_resistance
+        self.high_resistance = high_resistance
+        self.set_voltage = set_voltage
+        self.reset_voltage = reset_voltage
+        self.low = low
+
+    @property
+    def resistance(self):
+        return self.low_resistance if self.low else self.high_resistance
+
+    def __switch(self, voltage):
+        if voltage >= self.set_voltage:
+            self.low = True
+        elif voltage <= self.reset_voltage:
+            self.low = False
+
+    def current(self, voltage):
+        self.__switch(voltage)
+        return voltage/self.resistance
+
+    def voltage(self, current):
+        self.__switch(current*self.resistance)
+        return current*self.resistance
+
+
+class _ChannelState(object):
+    def __init__(self):
+        self.connected = False
+        self.input = "V"
+        self.value = 0.
+        self.compliance = 0.1
+        self.saved = None
+        self.side = MeasureSides.compliance_side
+        self.sweep = None
+        self.pulse = None
+
+
+def sweep_points(mode, start, stop, steps):
+    """ Source values of a staircase sweep, see WV"""
+    steps = max(int(steps), 1)
+    if mode in (SweepMode.log_up, SweepMode.log_up_down):
+        if start*stop <= 0:
+            raise ValueError("Log sweeps can not cross zero")
+        points = [start*(stop/start)**(i/max(steps-1, 1)) for i in range(steps)]
+    else:
+        points = [start+(stop-start)*i/max(steps-1, 1) for i in range(steps)]
+    if mode in (SweepMode.linear_up_down, SweepMode.log_up_down):
+        points += points[::-1]
+    return points
+
+
+class SimulatedB1500(object):
+    """ Simulated B1500 which can replace the pyvisa resource, see the
+    resource_factory argument of B1500 and factory(). It executes the
+    commands the library sends (";" joined program lines included), keeps
+    the channel state, and answers measurements with data of the DUT models
+    in duts, a dict of channel number to model. Channels without DUT are
+    open.
+
+    Output follows the FMT setting in ASCII, binary4 or binary8 formats,
+    timestamps are only sent in the ASCII formats. With the output modes
+    with source data every sweep step ends with the value of the sweep
+    source, of data type v or i. command_latency is added
+    to every command sent, point_latency to every measured point. The
+    tester reports being busy for that long after XE, reads and *OPC? block
+    until it is done, raising a VISA timeout if that exceeds timeout ms"""
+
+    errors = {100: "Undefined GPIB command.",
+              150: "Command parameter is not correct.",
+              200: "Output channel must be enabled."}
+    # accepted, but without effect on the simulation
+    ignored = ("AAD", "AIT", "AV", "AZ", "FL", "RI", "RV", "WT", "WM", "WSV",
+               "WSI", "PAD", "SSR", "SER", "ODSW", "SPUPD", "SIM", "SPM", "SPT",
+               "SPV", "IN", "LSM", "LGI", "LGV", "LSSV", "LSSI", "LSV", "LSI",
+               "LSTM", "BSM", "BGI", "BGV", "BSSV", "BSSI", "BSV", "BSI", "BST",
+               "CA", "TTC", "TTI", "TTV", "TTIV")
+
+    def __init__(self, address="SIM", modules=("B1517A",)*4, duts=None,
+                 command_latency=0., point_latency=0., timeout=2000):
+        self.address = address
+        self.modules = list(modules)
+        self.duts = dict(duts or {})
+        self.command_latency = command_latency
+        self.point_latency = point_latency
+        self.timeout = timeout
+        self.programs = {}
+        self.variables = {}
+        self.written = []
+        self.reset()
+
+    @classmethod
+    def factory(cls, **kwargs):
+        """ resource_factory for B1500. Reconnecting to an address returns the
+        same simulator, so its state survives like that of a real tester"""
+        instances = {}
+        def open_resource(address):
+            if address not in instances:
+                instances[address] = cls(address, **kwargs)
+            return instances[address]
+        return open_resource
+
+    def reset(self):
+        self.channels = dict((c, _ChannelState()) for c in self.installed_channels)
+        self._errors = deque()
+        self._buffer = []
+        self.format = Format.ascii12_with_header_crl
+        self.output_mode = 0
+        self.timestamp = False
+        self.measure_mode = None
+        self.measure_channels = ()
+        self.pulse_timing = (0., 1e-3, 0.)
+        self.spgu_period = 1e-6
+        self.spgu_run = (0, 0)
+        self.sre = 0
+        self.dio_mode = 0
+        self.selector = {}
+        self._t0 = time.time()
+        self._busy_until = 0.
+        self._spgu_until = 0.
+        self._recording = None
+
+    # modules with sub channels, numbered slot*100+1, slot*100+2, ...
+    sub_channels = {"B1525A": 2}
+
+    @property
+    def installed_channels(self):
+        channels = []
+        for i, m in enumerate(self.modules):
+            if m in self.sub_channels:
+                channels.extend((i+1)*100+c for c in range(1, self.sub_channels[m]+1))
+            elif m:
+                channels.append(i+1)
+        return channels
+
+    # pyvisa resource interface
+
+    def close(self):
+        pass
+
+    def write(self, message):
+        self.written.append(message)
+        self.__execute_line(message)
+        return len(message)
+
+    def query(self, message, delay=None):
+        self.written.append(message)
+        responses = self.__execute_line(message)
+        if delay:
+            time.sleep(delay)
+        return responses[-1] if responses else ""
+
+    def read(self):
+        self.__wait_idle()
+        data, self._buffer = self._buffer, []
+        return self.__encode_ascii(data)
+
+    def read_raw(self):
+        self.__wait_idle()
+        data, self._buffer = self._buffer, []
+        if self.format in (Format.binary8, Format.binary8_crl):
+            raw = b"".join(self.__encode_binary8(d) for d in data if d[1] != "T")
+        elif self.format in (Format.binary4, Format.binary4_crl):
+            raw = b"".join(self.__encode_binary4(d) for d in data if d[1] != "T")
+        else:
+            return self.__encode_ascii(data).encode("ascii")
+        if self.format in (Format.binary4_crl, Format.binary8_crl):
+            raw += b"\r\n"
+        return raw
+
+    def read_stb(self):
+        stb = 0 if self.busy else StatusByte.set_ready
+        if self._buffer:
+            stb |= StatusByte.data_ready
+        if self._errors:
+            stb |= StatusByte.error
+        return int(stb)
+
+    @property
+    def busy(self):
+        return time.time() < self._busy_until
+
+    def __wait_idle(self):
+        remaining = self._busy_until-time.time()
+        if remaining > self.timeout/1000.:
+            time.sleep(self.timeout/1000.)
+            raise visa.VisaIOError(visa.constants.VI_ERROR_TMO)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    # command execution
+
+    def __execute_line(self, line):
+        responses = []
+        for cmd in [c.strip() for c in line.split(";") if c.strip()]:
+            if self.command_latency:
+                time.sleep(self.command_latency)
+            ret = self.__execute(cmd)
+            if ret is not None:
+                responses.append(str(ret))
+        return responses
+
+    def __error(self, code):
+        self._errors.append(code)
+
+    def __execute(self, cmd):
+        mnemonic = command_mnemonic(cmd)
+        args = [a.strip() for a in cmd[len(mnemonic):].split(",") if a.strip()]
+        if self._recording is not None and mnemonic != "END":
+            self.programs[self._recording].append(cmd)
+            return None
+        if mnemonic in self.ignored:
+            return None
+        handler = self.__handlers.get(mnemonic)
+        if handler is None:
+            exception_logger.info("Simulator does not know {}".format(cmd))
+            self.__error(100)
+            return None
+        try:
+            return handler(self, *[self.__substitute(a) for a in args])
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            exception_logger.info("Simulator rejected {}: {}".format(cmd, e))
+            self.__error(150)
+            return None
+
+    def __substitute(self, arg):
+        """ Value of the program variable arg (%In or %Rn), arg otherwise"""
+        if arg[:2] == "%I":
+            return str(int(self.variables[(0, int(arg[2:]))]))
+        if arg[:2] == "%R":
+            return repr(self.variables[(1, int(arg[2:]))])
+        return arg
+
+    def __channel(self, ch):
+        ch = int(ch)
+        if ch not in self.channels:
+            raise KeyError(ch)
+        return self.channels[ch]
+
+    def __channels_arg(self, args):
+        return [int(c) for c in args] if args else list(self.channels)
+
+    # handlers, named after the command mnemonics
+
+    def _rst(self):
+        self.reset()
+
+    def _errx(self, *args):
+        if not self._errors:
+            return '+0,"No Error."'
+        code = self._errors.popleft()
+        return '+{},"{}"'.format(code, self.errors.get(code, "Error."))
+
+    def _err(self, *args):
+        codes = [self._errors.popleft() for _ in range(min(4, len(self._errors)))]
+        return ",".join(str(c) for c in codes+[0]*(4-len(codes)))
+
+    def _opc(self):
+        self.__wait_idle()
+        return "1"
+
+    def _stb(self):
+        return str(self.read_stb())
+
+    def _sre(self, mask=0):
+        self.sre = int(mask)
+
+    def _sre_query(self):
+        return str(self.sre)
+
+    def _unt(self, *args):
+        return ";".join("{},0".format(m) if m else "0,0" for m in self.modules+[None]*(10-len(self.modules)))
+
+    def _lrn(self, parameter=0):
+        parameter = int(parameter)
+        channels = [c for c in sorted(self.channels) if self.__slot(c) == parameter]
+        if channels:
+            return "".join("{}{};".format("CN" if self.channels[c].connected else "CL", c) for c in channels)
+        return "0"
+
+    def _cn(self, *args):
+        for c in self.__channels_arg(args):
+            self.__channel(c).connected = True
+
+    def _cl(self, *args):
+        for c in self.__channels_arg(args):
+            state = self.__channel(c)
+            state.connected, state.value, state.saved = False, 0., None
+
+    def _dz(self, *args):
+        for c in self.__channels_arg(args):
+            state = self.__channel(c)
+            state.saved = (state.input, state.value, state.compliance)
+            state.input, state.value = "V", 0.
+
+    def _rz(self, *args):
+        for c in self.__channels_arg(args):
+            state = self.__channel(c)
+            if state.saved:
+                state.input, state.value, state.compliance = state.saved
+
+    def __force(self, kind, ch, rng, value, compliance=None, *args):
+        state = self.__channel(ch)
+        if not state.connected:
+            self.__error(200)
+            return
+        state.input, state.value = kind, float(value)
+        if compliance is not None:
+            state.compliance = abs(float(compliance))
+
+    def _dv(self, *args):
+        self.__force("V", *args)
+
+    def _di(self, *args):
+        self.__force("I", *args)
+
+    def __sweep(self, kind, ch, mode, rng, start, stop, steps, compliance, *args):
+        state = self.__channel(ch)
+        state.input, state.compliance = kind, abs(float(compliance))
+        state.sweep = sweep_points(int(mode), float(start), float(stop), float(steps))
+
+    def _wv(self, *args):
+        self.__sweep("V", *args)
+
+    def _wi(self, *args):
+        self.__sweep("I", *args)
+
+    def __pulse(self, kind, ch, rng, base, peak, compliance):
+        state = self.__channel(ch)
+        state.input, state.compliance = kind, abs(float(compliance))
+        state.pulse = (float(base), float(peak))
+
+    def _pv(self, *args):
+        self.__pulse("V", *args)
+
+    def _pi(self, *args):
+        self.__pulse("I", *args)
+
+    def __pulsed_sweep(self, kind, ch, mode, rng, base, start, stop, steps, compliance, *args):
+        state = self.__channel(ch)
+        state.input, state.compliance = kind, abs(float(compliance))
+        state.pulse = (float(base), float(stop))
+        state.sweep = sweep_points(int(mode), float(start), float(stop), float(steps))
+
+    def _pwv(self, *args):
+        self.__pulsed_sweep("V", *args)
+
+    def _pwi(self, *args):
+        self.__pulsed_sweep("I", *args)
+
+    def _pt(self, hold, width, period=0, *args):
+        self.pulse_timing = (float(hold), float(width), float(period))
+
+    def _cmm(self, ch, side):
+        self.__channel(ch).side = MeasureSides(int(side))
+
+    def _mm(self, mode, *channels):
+        self.measure_mode = MeasureModes(int(mode))
+        self.measure_channels = tuple(int(c) for c in channels)
+
+    def _fmt(self, format, output_mode=0):
+        self.format, self.output_mode = Format(int(format)), int(output_mode)
+
+    def _tsc(self, state):
+        self.timestamp = bool(int(state))
+
+    def _tsr(self, *args):
+        self._t0 = time.time()
+
+    def _bc(self):
+        self._buffer = []
+
+    def _nub(self):
+        self.__wait_idle()
+        return str(len(self._buffer))
+
+    def _ab(self):
+        self._busy_until = self._spgu_until = 0.
+
+    def _ermod(self, mode, *args):
+        self.dio_mode = int(mode)
+
+    def _ermod_query(self):
+        return str(self.dio_mode)
+
+    def _erssp(self, port, state):
+        self.selector[int(port)] = int(state)
+
+    def _erssp_query(self, port):
+        return str(self.selector.get(int(port), 0))
+
+    def _zero(self, *args):
+        return "0"
+
+    def _spper(self, period):
+        self.spgu_period = float(period)
+
+    def _sprm(self, mode, condition=0):
+        self.spgu_run = (int(mode), float(condition))
+
+    def _srp(self):
+        mode, condition = self.spgu_run
+        if mode == 1:
+            duration = condition*self.spgu_period
+        elif mode == 2:
+            duration = condition
+        else:
+            duration = float("inf")
+        self._spgu_until = time.time()+duration
+
+    def _spp(self):
+        self._spgu_until = 0.
+
+    def _spst(self):
+        return "1" if time.time() < self._spgu_until else "0"
+
+    def _corrser(self, *args):
+        return "+5.000000E+01"
+
+    def _st(self, number):
+        self._recording = int(number)
+        self.programs[self._recording] = []
+
+    def _end(self):
+        self._recording = None
+
+    def _do(self, *numbers):
+        for n in numbers:
+            for cmd in self.programs[int(n)]:
+                self.__execute(cmd)
+
+    def _scr(self, number=None):
+        if number is None:
+            self.programs.clear()
+        else:
+            self.programs.pop(int(number), None)
+
+    def _lst(self, number=None):
+        if number is None:
+            return ",".join(str(n) for n in sorted(self.programs)) or "0"
+        return ";".join(self.programs[int(number)])
+
+    def _var(self, type, number, value):
+        self.variables[(int(type), int(number))] = float(value)
+
+    def _xe(self):
+        mode = self.measure_mode
+        if mode is None:
+            self.__error(150)
+            return
+        channels = self.measure_channels or [c for c, s in self.channels.items() if s.connected][:1]
+        sweeping = [c for c, s in self.channels.items() if s.connected and s.sweep]
+        if mode in (MeasureModes.staircase_sweep, MeasureModes.pulsed_sweep,
+                    MeasureModes.multi_channel_sweep, MeasureModes.staircase_sweep_pulsed_bias) and sweeping:
+            steps = range(len(self.channels[sweeping[0]].sweep))
+        else:
+            steps = [None]
+        pulsed = mode in (MeasureModes.pulsed_spot, MeasureModes.pulsed_sweep,
+                          MeasureModes.staircase_sweep_pulsed_bias)
+        data = []
+        for step in steps:
+            for c in channels:
+                state = self.__channel(c)
+                value = state.value
+                if step is not None and state.sweep:
+                    value = state.sweep[step]
+                elif pulsed and state.pulse:
+                    value = state.pulse[1]
+                if self.timestamp:
+                    data.append((c, "T", time.time()-self._t0, "N"))
+                data.append((c,)+self.__respond(c, state, value))
+            if step is not None and self.output_mode:
+                # the source value of the step follows its measured data
+                source = self.channels[sweeping[0]]
+                data.append((sweeping[0], source.input.lower(), source.sweep[step], "N"))
+        self._buffer.extend(data)
+        self._busy_until = time.time()+self.point_latency*len(steps)*len(channels)
+
+    def __respond(self, channel, state, value):
+        """ (kind, value, status) measured on channel when forcing value"""
+        dut = self.duts.get(channel)
+        status = "N"
+        if not state.connected:
+            v = i = 0.
+        elif state.input == "V":
+            v = value
+            i = dut.current(v) if dut else 0.
+            if abs(i) > state.compliance:
+                i, status = math.copysign(state.compliance, i), "C"
+        else:
+            i = value
+            v = dut.voltage(i) if dut else math.copysign(state.compliance, i or 1.)
+            if abs(v) > state.compliance or not dut:
+                v, status = math.copysign(state.compliance, v), "C"
+        side = state.side
+        if side == MeasureSides.compliance_side:
+            kind = "I" if state.input == "V" else "V"
+        elif side == MeasureSides.force_side:
+            kind = state.input
+        else:
+            kind = "V" if side == MeasureSides.voltage_side else "I"
+        return kind, (i if kind == "I" else v), status
+
+    # output encoding
+
+    def __encode_ascii(self, data):
+        fmt = self.format
+        header = fmt in (Format.ascii12_with_header_crl, Format.ascii12_with_header_comma,
+                         Format.ascii13_with_header_crl, Format.ascii13_with_header_comma,
+                         Format.ascii13_with_header_crl_flex, Format.ascii13_with_header_comma_flex)
+        number = "{:+.5E}" if fmt in (Format.ascii12_with_header_crl, Format.ascii12_no_header_crl,
+                                      Format.ascii12_with_header_comma) else "{:+.6E}"
+        terminator = "," if "comma" in repr(fmt) else "\r\n"
+        fields = []
+        for channel, kind, value, status in data:
+            field = number.format(value)
+            if header:
+                field = "{}{}{}{}".format(status, self.channel_letter(channel), kind, field)
+            fields.append(field)
+        if not fields:
+            return ""
+        return ",".join(fields)+terminator
+
+    @staticmethod
+    def channel_letter(channel):
+        """ Channel letter of the ASCII data header, A for channel 1 or 101,
+        lower case for the second sub channel (e.g. a for 102)"""
+        slot, sub = (channel//100, channel % 100) if channel > 100 else (channel, 1)
+        letter = chr(ord("A")+slot-1)
+        return letter.lower() if sub > 1 else letter
+
+    @staticmethod
+    def __binary_fields(kind, value):
+        """ (measured, parameter, range code, range) of a datum, source data
+        has a lower case kind"""
+        ranges = binary_current_ranges if kind.upper() == "I" else binary_voltage_ranges
+        code = binary_range_code(value, ranges)
+        return int(kind.isupper()), (1 if kind.upper() == "I" else 0), code, ranges[code]
+
+    def __encode_binary4(self, datum):
+        channel, kind, value, status = datum
+        a, b, c, rng = self.__binary_fields(kind, value)
+        d = int(round(value*(binary4_measure_scale if a else binary4_source_scale)/rng))
+        d = max(-2**16, min(2**16-1, d)) & 0x1FFFF
+        word = (a << 31) | (b << 30) | (c << 25) | (d << 8) | ((status != "N") << 5) | (self.__slot(channel) & 0x1F)
+        return struct.pack(">I", word)
+
+    def __encode_binary8(self, datum):
+        channel, kind, value, status = datum
+        a, b, c, rng = self.__binary_fields(kind, value)
+        d = int(round(value*binary8_scale/rng)) & 0xFFFFFFFF
+        word = (a << 63) | (b << 56) | (c << 48) | (d << 16) | ((status != "N") << 8) | (self.__slot(channel) & 0x1F)
+        return struct.pack(">Q", word)
+
+    @staticmethod
+    def __slot(channel):
+        return channel//100 if channel > 100 else channel
+
+    __handlers = {
+        "*RST": _rst, "ERRX?": _errx, "ERR?": _err, "*OPC?": _opc, "*STB?": _stb,
+        "*SRE": _sre, "*SRE?": _sre_query, "UNT?": _unt, "*LRN?": _lrn,
+        "CN": _cn, "CL": _cl, "DZ": _dz, "RZ": _rz, "DV": _dv, "DI": _di,
+        "WV": _wv, "WI": _wi, "PV": _pv, "PI": _pi, "PWV": _pwv, "PWI": _pwi,
+        "PT": _pt, "CMM": _cmm, "MM": _mm, "FMT": _fmt, "TSC": _tsc, "TSR": _tsr,
+        "BC": _bc, "NUB?": _nub, "AB": _ab, "ERMOD": _ermod, "ERMOD?": _ermod_query,
+        "ERSSP": _erssp, "ERSSP?": _erssp_query, "DIAG?": _zero, "*TST?": _zero,
+        "*CAL?": _zero, "SPPER": _spper, "SPRM": _sprm, "SRP": _srp, "SPP": _spp,
+        "SPST?": _spst, "CORRSER?": _corrser, "ST": _st, "END": _end, "DO": _do,
+        "SCR": _scr, "LST?": _lst, "VAR": _var, "XE": _xe,
+    }
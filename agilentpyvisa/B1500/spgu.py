@@ -1,8 +1,12 @@
 from logging import getLogger
+from concurrent.futures import Future
+from threading import Thread
+import time
 from .loggers import exception_logger,write_logger, query_logger
 from .enums import *
 from .force import *
 from .helpers import format_command
+from .timing import spgu_time
 
 class SPGUSMU(object):
     def set_apply(self, channel):
@@ -121,20 +125,41 @@ class SPGUSMU(object):
 
     def start_pulses(self):
         """Starts SPGU output"""
+        self.parent._spgu_started = time.time()
         return self.parent.write("SRP")
     def stop_pulses(self):
         """Stops SPGU output"""
         return self.parent.write("SPP")
 
-    def wait_spgu(self):
-        """ Queries SPGU and blocks until it has finished pulsing"""
-        self.busy = 1
-        while self.busy == 1:
-            self.busy = self.parent.query("SPST?")
-        return self.busy
+    def expected_runtime(self, channel=None):
+        """ Returns the time in s the pulse output of the setup on channel (or
+        the longest of all channels set up) takes, based on output_mode and
+        condition, 0 without setup. Setups are dropped when their channel is
+        torn down. Returns None for free run, which only stops with SPP"""
+        if channel:
+            setups = [self.spgu_setups[channel]] if channel in self.spgu_setups else []
+        else:
+            setups = list(self.spgu_setups.values())
+        runtimes = [spgu_time(setup) for setup in setups]
+        if None in runtimes:
+            return None
+        return max(runtimes) if runtimes else 0
+
+    def wait_spgu(self, timeout=None, poll_interval=1e-3, max_poll_interval=0.1):
+        """ Blocks until the SPGU has finished pulsing. Sleeps through most of
+        the expected runtime, then polls SPST? with growing intervals. Raises
+        TimeoutError if still busy after timeout s, by default twice the
+        expected runtime plus one second after the pulses were started"""
+        return wait_spgus([self], timeout, poll_interval, max_poll_interval)
+
+    def spgu_future(self, **kwargs):
+        """ Returns a concurrent.futures.Future which completes when the SPGU
+        has finished pulsing, see wait_spgu. Use asyncio.wrap_future to await it"""
+        return spgu_future([self], **kwargs)
 
     def setup_spgu(self, channel, spgu_setup):
         """ Creates the specified spgu setup for the given channel. For more detials about the setup look at the SPGU IntEnum"""
+        self.spgu_setups[channel] = spgu_setup
         self.set_wavemode(spgu_setup.wavemode)
         self.set_output_mode(spgu_setup.output_mode, spgu_setup.condition)
         self.set_pulse_switch(
@@ -168,3 +193,52 @@ class SPGUSMU(object):
         else:
             self.set_loadimpedance(channel, spgu_setup.loadZ)  # SER
         self.set_apply(channel)  # SPUPD
+
+
+def wait_spgus(units, timeout=None, poll_interval=1e-3, max_poll_interval=0.1, runtimes=None):
+    """ Waits until all SPGU units have finished pulsing. All SPGUs are
+    started together by SRP and SPST? reports on all of them, so we wait for
+    the longest expected runtime and then poll once for all units. runtimes
+    are those of the pulse trains started, by default the expected_runtime
+    of the units. Polls with spgu_status of the tester, which is safe from
+    other threads"""
+    if not units:
+        return 0
+    parent = units[0].parent
+    if runtimes is None:
+        runtimes = [u.expected_runtime() for u in units]
+    if any(r is None for r in runtimes):
+        raise ValueError("SPGU is in free run mode and never finishes, stop it with stop_pulses")
+    expected = max(runtimes or [0])
+    started = getattr(parent, "_spgu_started", None) or time.time()
+    if timeout is None:
+        timeout = 2*expected+1
+    deadline = started+timeout
+    # sleep through the bulk of the pulse train, leave the rest to polling
+    remaining = started+expected-max_poll_interval-time.time()
+    if remaining > 0:
+        time.sleep(remaining)
+    while True:
+        busy = parent.spgu_status()
+        for u in units:
+            u.busy = busy
+        if not busy:
+            return busy
+        if time.time() >= deadline:
+            raise TimeoutError("SPGU still busy {} s after start, expected {} s".format(timeout, expected))
+        time.sleep(min(poll_interval, max(0, deadline-time.time())))
+        poll_interval = min(2*poll_interval, max_poll_interval)
+
+def spgu_future(units, **kwargs):
+    """ Runs wait_spgus for units in a background thread and returns a
+    concurrent.futures.Future for its result"""
+    future = Future()
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(wait_spgus(units, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    Thread(target=run, daemon=True).start()
+    return future
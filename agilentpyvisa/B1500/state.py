@@ -0,0 +1,117 @@
+from .helpers import command_mnemonic
+
+
+def _global(group):
+    return lambda args: (group,)
+
+def _per_channel(group):
+    return lambda args: (group, args[0]) if args else None
+
+def _per_source(group):
+    return lambda args: (group, args[0], args[1]) if len(args) > 1 else None
+
+
+class InstrumentState(object):
+    """ Shadow copy of the tester settings, built from the commands sent to
+    it. Every setting command has a key, made of its setting group and,
+    for channel settings, the channel (e.g. DV and DI on channel 1 both set
+    ("force", "1")). A command equal to the one last sent for its key is
+    redundant, so applying a setup only sends the commands that differ.
+
+    Commands without key (XE, queries, ...) are never redundant. Commands
+    with unknown effect on the settings clear the model, as does any error
+    reported by the tester, so the next setup is sent in full"""
+
+    keys = {
+        "FMT": _global("FMT"), "TSC": _global("TSC"), "AV": _global("AV"),
+        "PAD": _global("PAD"), "WM": _global("WM"), "WT": _global("WT"),
+        "PT": _global("PT"), "MM": _global("MM"), "ERMOD": _global("ERMOD"),
+        "SPPER": _global("SPPER"), "SPRM": _global("SPRM"), "SIM": _global("SIM"),
+        "AIT": _per_channel("AIT"), "ERSSP": _per_channel("ERSSP"),
+        "FL": lambda args: ("FL",)+tuple(args[1:]),
+        "CN": lambda args: ("CN", args[0]) if len(args) == 1 else None,
+        "DV": _per_channel("force"), "DI": _per_channel("force"),
+        "WV": _per_channel("sweep"), "WI": _per_channel("sweep"),
+        "PV": _per_channel("pulse"), "PI": _per_channel("pulse"),
+        "PWV": _per_channel("pulsed_sweep"), "PWI": _per_channel("pulsed_sweep"),
+        "RI": _per_channel("RI"), "RV": _per_channel("RV"), "CMM": _per_channel("CMM"),
+        "AAD": _per_channel("AAD"), "SSR": _per_channel("SSR"),
+        "SPM": _per_channel("SPM"), "SER": _per_channel("SER"), "ODSW": _per_channel("ODSW"),
+        "SPV": _per_source("SPV"), "SPT": _per_source("SPT"), "VAR": _per_source("VAR"),
+    }
+    # groups holding channel settings, which CL resets
+    channel_groups = ("CN", "force", "sweep", "pulse", "pulsed_sweep", "RI", "RV",
+                      "CMM", "AAD", "SSR", "SPM", "SER", "ODSW", "SPV", "SPT")
+    # commands resetting or running unknown settings
+    clearing = ("*RST", "DO", "RCV", "*TST?", "DIAG?")
+
+    def __init__(self):
+        self.settings = {}
+        self.__zeroed = {}
+
+    @staticmethod
+    def split(msg):
+        """ Splits a program line into (mnemonic, args, normalized command) tuples"""
+        commands = []
+        for cmd in msg.split(";"):
+            cmd = cmd.strip()
+            if not cmd:
+                continue
+            mnemonic = command_mnemonic(cmd)
+            args = tuple(a.strip() for a in cmd[len(mnemonic):].split(",") if a.strip())
+            commands.append((mnemonic, args, "{} {}".format(mnemonic, ",".join(args)).strip()))
+        return commands
+
+    def key(self, mnemonic, args):
+        keyfunc = self.keys.get(mnemonic)
+        return keyfunc(args) if keyfunc else None
+
+    def redundant(self, msg):
+        """ Whether all commands in msg match the known state"""
+        commands = self.split(msg)
+        if not commands:
+            return False
+        for mnemonic, args, cmd in commands:
+            key = self.key(mnemonic, args)
+            if key is None or self.settings.get(key) != cmd:
+                return False
+        return True
+
+    def apply(self, msg):
+        """ Updates the model with the commands in msg, which were sent"""
+        for mnemonic, args, cmd in self.split(msg):
+            key = self.key(mnemonic, args)
+            if key is not None:
+                self.settings[key] = cmd
+            elif mnemonic in self.clearing:
+                self.clear()
+            elif mnemonic == "CL":
+                self.forget_channels(*args)
+            elif mnemonic == "DZ":
+                # DZ saves the output settings for RZ, then forces 0 V
+                for k in self.__channel_keys(args, ("force",)):
+                    self.__zeroed[k] = self.settings.pop(k)
+            elif mnemonic == "RZ":
+                for k in [k for k in self.__zeroed if not args or k[1] in args]:
+                    self.settings[k] = self.__zeroed.pop(k)
+
+    def __channel_keys(self, channels, groups):
+        return [k for k in self.settings
+                if k[0] in groups and (not channels or k[1] in channels)]
+
+    def forget_channels(self, *channels):
+        """ Drops the settings of channels, all channels if none are given"""
+        channels = tuple(str(c) for c in channels)
+        for k in self.__channel_keys(channels, self.channel_groups):
+            del self.settings[k]
+        for k in [k for k in self.__zeroed if not channels or k[1] in channels]:
+            del self.__zeroed[k]
+
+    def get(self, mnemonic, *args):
+        """ Last command sent for the setting of mnemonic and the identifying
+        args (e.g. get("DV", 1)), None if unknown"""
+        return self.settings.get(self.key(mnemonic, tuple(str(a) for a in args)))
+
+    def clear(self):
+        self.settings.clear()
+        self.__zeroed.clear()
@@ -0,0 +1,225 @@
+from collections import OrderedDict
+from functools import partial
+from .lazy import np
+
+# TestSetups with placeholders (Param) for some values, expanded into one
+# setup per point of a parameter grid or random sample. The template is
+# validated once by the namedtuple constructors, the points of a scan are
+# checked together with numpy (see checks) and their setups are built
+# lazily, replacing only the tuples on the way to the placeholders
+
+
+class Param(float):
+    """ Placeholder for the setup value name in a SetupTemplate. It is a
+    float of value default, so the setup constructors validate the template
+    with it. Values derived from it when the setup is built (e.g. the
+    pulse_period of an SPGU given without one) keep the value derived from
+    the default, give them explicitly if they need to follow the scan"""
+
+    def __new__(cls, name, default=0.):
+        self = super(Param, cls).__new__(cls, default)
+        self.name = name
+        return self
+
+    def __getnewargs__(self):
+        return (self.name, float(self))
+
+    def __repr__(self):
+        return "Param({!r}, {!r})".format(self.name, float(self))
+
+
+def _lo(x):
+    return x.min(axis=0)
+
+def _hi(x):
+    return x.max(axis=0)
+
+def _spgu_checks(get):
+    period = _hi(get("pulse_period"))
+    return [
+        ((period >= 2e-8) & (period <= 10), "Pulse period should be between 2e-8 s and 10 s"),
+        ((_hi(abs(get("pulse_base"))) <= 40) & (_hi(abs(get("pulse_peak"))) <= 40),
+         "Voltage must stay between -40 V and 40 V"),
+        ((_lo(get("switch_delay")) >= 0) & (_hi(get("switch_delay")) <= period-1e-7),
+         "switch delay must be between 0 and pulse_period-1e-7 s"),
+        ((_lo(get("pulse_width")) >= 1e-8) & (_hi(get("pulse_width")) <= period-1e-8),
+         "pulse width must be between 1e-8 and pulse_period-1e-8 s"),
+        ((_lo(get("pulse_delay")) >= 0) & (_hi(get("pulse_delay")) <= period-2e-8),
+         "pulse delay must be between 0 and pulse_period-2e-8 s"),
+        ((_lo(get("pulse_leading")) >= 8e-9) & (_hi(get("pulse_leading")) <= 0.4) &
+         (_lo(get("pulse_trailing")) >= 8e-9) & (_hi(get("pulse_trailing")) <= 0.4),
+         "Pulse lead/trail must be in the rango 8e-9 to 0.4"),
+    ]
+
+def _search_measure_checks(get):
+    return [
+        ((_lo(get("hold")) >= 0) & (_hi(get("hold")) <= 655.35), "hold must be between 0 and 655.35 s"),
+        ((_lo(get("delay")) >= 0) & (_hi(get("delay")) <= 65.535), "delay must be between 0 and 65.535 s"),
+    ]
+
+def _search_setup_checks(get):
+    return [
+        ((get("start") != get("stop")).all(axis=0), "start must be != stop"),
+        ((get("compliance") != 0).all(axis=0), "Compliance must be !=0"),
+    ]
+
+# the checks of the setup constructors, vectorized. Every function gets
+# get(field), the values of field over all points as array of shape
+# (elements, points), and returns (valid mask, message) pairs
+checks = {
+    "SPGU": _spgu_checks,
+    "MeasureLinearSearch": _search_measure_checks,
+    "MeasureBinarySearch": _search_measure_checks,
+    "BinarySearchSetup": _search_setup_checks,
+    "LinearSearchSetup": _search_setup_checks,
+}
+
+
+def _is_record(obj):
+    return isinstance(obj, tuple) and hasattr(obj, "_fields")
+
+
+def _builder(obj, trie):
+    """ Function of the Param values building obj with the Params at the
+    leaves of trie, a nested dict of indices, replaced by their values.
+    Every tuple on the way is rebuilt, the others are shared"""
+    if not isinstance(trie, dict):
+        return lambda values: values[trie]
+    children = [(i, _builder(obj[i], sub)) for i, sub in trie.items()]
+    items = list(obj)
+    if _is_record(obj):
+        # like _make and _replace, skipping the validation of __new__
+        make = partial(tuple.__new__, type(obj))
+    else:
+        make = type(obj)
+    def build(values):
+        new = items[:]
+        for i, child in children:
+            new[i] = child(values)
+        return make(new)
+    return build
+
+
+class SetupTemplate(object):
+    """ A TestSetup (or any setup tuple) holding Params, expanded into
+    setups with values for them. Params not given a value keep their
+    default. grid and random validate all points at once and return a
+    generator building the setups on demand"""
+
+    def __init__(self, setup):
+        self.setup = setup
+        self.params = OrderedDict()
+        self.records = OrderedDict()
+        self.__walk(setup, ())
+        if not self.params:
+            raise ValueError("Template has no Params")
+
+    def __walk(self, obj, path):
+        if isinstance(obj, Param):
+            self.params.setdefault(obj.name, []).append(path)
+            # the nearest record holds the value in one of its fields
+            for depth in range(len(path)-1, -1, -1):
+                record = self.__node(path[:depth])
+                if _is_record(record):
+                    self.records[path[:depth]] = record
+                    break
+        elif isinstance(obj, (tuple, list)):
+            for i, x in enumerate(obj):
+                self.__walk(x, path+(i,))
+
+    def __node(self, path):
+        node = self.setup
+        for i in path:
+            node = node[i]
+        return node
+
+    def fill(self, **values):
+        """ The setup with the Params set to values"""
+        self.__check_names(values)
+        values = dict((n, float(values[n]) if n in values else self.__default(n)) for n in self.params)
+        return _builder(self.setup, self.__trie(self.params))(values)
+
+    def __trie(self, names):
+        trie = {}
+        for name in names:
+            for path in self.params[name]:
+                node = trie
+                for i in path[:-1]:
+                    node = node.setdefault(i, {})
+                node[path[-1]] = name
+        return trie
+
+    def grid(self, **axes):
+        """ Setups for all combinations of the values in axes, a sequence
+        of values per Param name, varying the last axis fastest"""
+        self.__check_names(axes)
+        names = list(axes)
+        values = [np.asarray(axes[n], dtype=float) for n in names]
+        mesh = np.meshgrid(*values, indexing="ij") if names else []
+        columns = OrderedDict((n, m.ravel()) for n, m in zip(names, mesh))
+        self.validate(columns)
+        return self.__expand(columns)
+
+    def random(self, n, seed=None, **ranges):
+        """ n setups with random values, drawn uniformly from the (low,
+        high) ranges per Param name, or by a function (random_state, n)
+        returning n values"""
+        self.__check_names(ranges)
+        state = np.random.RandomState(seed)
+        columns = OrderedDict()
+        for name, spec in ranges.items():
+            if callable(spec):
+                columns[name] = np.asarray(spec(state, n), dtype=float)
+            else:
+                columns[name] = state.uniform(spec[0], spec[1], n)
+        self.validate(columns)
+        return self.__expand(columns)
+
+    def validate(self, columns):
+        """ Checks the points given as arrays of values per Param name like
+        the setup constructors do, raises ValueError naming the first
+        invalid point"""
+        points = max([len(c) for c in columns.values()] or [1])
+        for record in self.records.values():
+            check = checks.get(type(record).__name__)
+            if check is None:
+                continue
+            def get(field, record=record):
+                return self.__field_values(record, field, columns, points)
+            for valid, message in check(get):
+                valid = np.broadcast_to(valid, (points,))
+                if not valid.all():
+                    index = int(np.argmin(valid))
+                    point = {n: float(c[index]) for n, c in columns.items()}
+                    raise ValueError("{} at point {} {}".format(message, index, point))
+
+    def __field_values(self, record, field, columns, points):
+        """ Values of field of record per point, shape (elements, points)"""
+        value = getattr(record, field)
+        elements = value if isinstance(value, (list, tuple)) else [value]
+        rows = []
+        for x in elements:
+            if isinstance(x, Param) and x.name in columns:
+                rows.append(columns[x.name])
+            else:
+                rows.append(np.full(points, float(x)))
+        return np.vstack(rows) if rows else np.zeros((1, points))
+
+    def __expand(self, columns):
+        names = list(columns)
+        # Params not scanned are filled in once
+        base = self.setup
+        rest = [n for n in self.params if n not in columns]
+        if rest:
+            base = _builder(base, self.__trie(rest))({n: self.__default(n) for n in rest})
+        build = _builder(base, self.__trie(names))
+        for row in zip(*[columns[n].tolist() for n in names]):
+            yield build(dict(zip(names, row)))
+
+    def __default(self, name):
+        return float(self.__node(self.params[name][0]))
+
+    def __check_names(self, values):
+        unknown = set(values)-set(self.params)
+        if unknown:
+            raise ValueError("Template has no Params {}".format(sorted(unknown)))
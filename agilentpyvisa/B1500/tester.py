@@ -1,10 +1,11 @@
 # vim: set fileencoding: utf-8 -*-
 # -*- coding: utf-8 -*-
-import visa
+import time
+import re
 from itertools import cycle, starmap, compress
-import pandas as pd
-import numpy as np
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import RLock
 from .force import *
 from .force import (
                     DCForce,
@@ -21,81 +22,331 @@ from .measurement import (
 from .setup import *
 from .helpers import *
 from .SMUs import *
+from .spgu import wait_spgus, spgu_future
+from .timing import estimate_duration, estimate_plan, spgu_time, timeout_ms, default_command_latency
+from .state import InstrumentState
+from .compiler import PlanCache, build_plan
+from .programs import setup_variables
+from .discovery import load_discovery, save_discovery
 from .dummy import DummyTester
 from .loggers import exception_logger,write_logger, query_logger
+from .lazy import visa, pd
 
 
 
 
 class B1500():
-    def __init__(self, tester, auto_init=True, default_check_err=True):
+    def __init__(self, tester, auto_init=True, default_check_err=True, persistent=True, error_check=ErrorCheck.per_command, resource_factory=None, discovery_cache=None, init_reset=True):
         self.__test_addr = tester
         self._device=None
+        self.__io_lock=RLock()
+        self.resource_factory=resource_factory
+        self.discovery_cache=discovery_cache
+        self.__discovery=None
+        self.__rm=None
+        self.__keep_open=False
+        self.__sessions=0
+        self.persistent=persistent
+        self.keep_connected=False
+        self.__connected=OrderedDict()
         self.tests = OrderedDict()
-        self.__last_channel_setups={}
-        self.__last_channel_measurements={}
+        self.state=InstrumentState()
+        self.plans=PlanCache()
+        self.auto_programs=None
+        self.__capture=None
         self.slots_installed={}
         self._DIO_control_mode={}
         self.sub_channels = []
-        self.__filter_all = None
-        self.__ADC={}
         self.__TSC = None
         self.__channels={}
+        self.__binary4_tables=None
         self._recording = False
-        self.__HIGHSPEED_ADC={"number":None,"mode":None}
         self.default_check_err=default_check_err
+        self.error_check=error_check
+        self._journal=deque(maxlen=256)
+        self.last_errors=[]
+        self.use_srq=True
+        self.completion_timeout=None
+        self.timeout_margin=2.
+        self.min_timeout=2.
+        self.command_latency=default_command_latency
+        self.__busy_until=0.
+        self.__srq_mask=None
+        self.__srq_armed=False
+        self._spgu_started=None
         self.programs={}
         self.__format = None
         self.__outputMode = None
         self.last_program=None
+        self.max_line_length=256
+        self.__batch_depth=0
+        self.__pending=[]
+        self.__pending_length=0
+        self.__barriers=("XE","*RST","AB","DO","RCV","ST","END","SCR","DIAG?",
+                         "*TST?","*CAL?","CA","TSR","SRP","SPP","BC",)
+        # commands triggering measurements or outputs, or editing programs
+        self.__unrepeatable=self.__barriers+("TI","TTI","TV","TTV","TIV","TTIV","TC","TTC","VAR",)
         self.__no_store=("*RST","DIAG?","*TST?","CA","AB","RCV","WZ?","ST","END",
                          "SCR","VAR","LST?","CORRSER?","SER?","SIM?","SPM?",
                          "SPPER?","ERMOD?","ERSSP?","ERRX?","ERR?","EMG?",
                          "*LRN?","*OPC?","UNT?","WNU?","*SRE?","*STB?",)
         if auto_init:
-            self.init()
+            self.init(reset=init_reset)
+
+    @property
+    def address(self):
+        """ VISA address of the tester"""
+        return self.__test_addr
 
     def close(self):
-        if self._device:
-            self._device.close()
+        """ Closes the VISA resource and the resource manager. Safe to call
+        repeatedly, only the first call after an open has any effect"""
+        self.__keep_open = False
+        if self.__pending:
+            exception_logger.warn("Closing connection, discarding unsent commands:\n{}".format("\n".join(self.__pending)))
+            self.__pending, self.__pending_length = [], 0
+        try:
+            if self._device is not None:
+                self._device.close()
+        finally:
             self._device=None
-            self.__keep_open = False
-        if self.__rm:
-            self.__rm.close()
-            self.__rm=None
+            try:
+                if self.__rm is not None:
+                    self.__rm.close()
+            finally:
+                self.__rm=None
 
     def __del__(self):
-        self.close()
+        try:
+            self.close()
+        except Exception as e:
+            exception_logger.warn("Could not close connection on cleanup: {}".format(e))
 
-    def init(self):
+    def init(self, reset=True, rediscover=False):
         """ Resets the connected tester, then checks all installed modules,
         querying their types and the available subchannels. It also
         stores the available input and measure_ranges in the slots_installed dict,
         with the slot number as key. sub channels is a list containing
-        all available channels"""
-        self.open()
-        self._reset()
-        self.slots_installed = self.__discover_slots()
-        self.sub_channels = []
-        for s,mod in self.slots_installed.items():
-            self.sub_channels.extend(mod.channels)
-        self.__channels = {i:self.slots_installed[self.__channel_to_slot(i)] for i in self.sub_channels}
-        self.enable_SMUSPGU()
-        self._check_err()
-        self.close()
+        all available channels.
+        If discovery_cache is a file path, the discovery is stored there
+        and reused as long as the tester reports the same modules, which
+        costs a single UNT? query. rediscover ignores the cached one. Without
+        reset the tester keeps its settings, e.g. when reconnecting to a
+        tester this script set up before"""
+        with self.session():
+            if reset:
+                self._reset()
+            self.state.clear()
+            self.slots_installed = self.__discover_slots(rediscover)
+            self.sub_channels = []
+            for s,mod in self.slots_installed.items():
+                self.sub_channels.extend(mod.channels)
+            self.__channels = {i:self.slots_installed[self.__channel_to_slot(i)] for i in self.sub_channels}
+            self.__binary4_tables = binary4_tables(dict((s, getattr(mod, "binary_ranges", None))
+                                                        for s,mod in self.slots_installed.items()))
+            self.enable_SMUSPGU()
+            self._drain_errors()
 
     def open(self, keep_open=False):
-        if not self._device:
+        """ Opens the connection to the tester if it is not open yet. With
+        keep_open the connection stays up until close is called, regardless
+        of the persistent setting. If a resource_factory is set, it is called
+        with the address instead of opening a VISA resource, e.g. to use a
+        SimulatedB1500"""
+        if keep_open:
+            self.__keep_open = True
+        if self._device is None and self.resource_factory is not None:
+            self._device = self.resource_factory(self.__test_addr)
+        elif self._device is None:
             try:
                 self.__rm = visa.ResourceManager()
                 self._device = self.__rm.open_resource(self.__test_addr)
-                self.__keep_open =True
-            except OSError as e:
-                exception_logger.warn("Could not find VISA driver, setting _device to std_out")
-                self.__rm.close()
-                self._device.close()
+            except (OSError, ValueError) as e:
+                # pyvisa raises ValueError if it finds no VISA library
+                exception_logger.warn("Could not open {} ({}: {}), setting _device to std_out".format(
+                    self.__test_addr, type(e).__name__, e))
+                if self.__rm is not None:
+                    self.__rm.close()
                 self.__rm = None
                 self._device = DummyTester()
+        return self._device
+
+    def reconnect(self):
+        """ Drops the current connection and opens a new one, keeping the
+        keep_open state"""
+        keep_open = self.__keep_open
+        exception_logger.warn("Reconnecting to {}".format(self.__test_addr))
+        try:
+            self.close()
+        except Exception as e:
+            exception_logger.warn("Error while closing broken connection: {}".format(e))
+        return self.open(keep_open)
+
+    @contextmanager
+    def session(self):
+        """ Keeps the connection open for the duration of the with block,
+        also for non persistent testers. Sessions can be nested, the
+        connection is released when the outermost one exits"""
+        self.__sessions += 1
+        try:
+            self.open()
+            yield self
+        finally:
+            self.__sessions -= 1
+            self._release()
+
+    @contextmanager
+    def connected(self):
+        """ Keeps the channels of the tests run inside the with block
+        connected. Between tests the channels are only forced to zero (DZ),
+        so the next test skips the CL/CN and selector churn and only sends
+        the settings that changed. All kept channels are torn down when the
+        block exits. A failing test still zeroes all channels right away"""
+        old_keep = self.keep_connected
+        self.keep_connected = True
+        try:
+            with self.session():
+                yield self
+        finally:
+            self.keep_connected = old_keep
+            if not old_keep:
+                self.release_channels()
+
+    def release_channels(self):
+        """ Tears down all channels kept connected by keep_connected"""
+        kept, self.__connected = list(self.__connected.values()), OrderedDict()
+        if kept:
+            with self.batch():
+                for test_tuple in kept:
+                    self.teardown(test_tuple)
+
+    def _release(self):
+        """ Closes the connection after a call, unless it is persistent or
+        kept open by open(keep_open=True) or an active session"""
+        if not (self.persistent or self.__keep_open or self.__sessions):
+            self.close()
+
+    @contextmanager
+    def batch(self):
+        """ Collects all commands written inside the with block and sends them
+        as program lines of ";" joined commands, each at most max_line_length
+        long. Pending commands are flushed before queries, reads and barrier
+        commands (e.g. XE, DO, *RST) and when the outermost batch exits.
+        If the block raises, the unsent commands are dropped. Lines are only
+        joined with the per_batch and per_test error_check policies, with
+        per_command every command is sent and checked on its own"""
+        self.__batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            if self.__pending:
+                exception_logger.warn("Dropping unsent commands after exception:\n{}".format("\n".join(self.__pending)))
+                self.__pending, self.__pending_length = [], 0
+                # the dropped commands were already applied to the state model
+                self.state.clear()
+            raise
+        finally:
+            self.__batch_depth -= 1
+        if not self.__batch_depth:
+            self.flush()
+
+    def flush(self, check_error=None):
+        """ Sends the commands collected by batch() as a single program line,
+        draining the error queue afterwards according to check_error or the
+        error_check policy"""
+        if not self.__pending:
+            return None
+        commands = self.__pending
+        self.__pending, self.__pending_length = [], 0
+        line = ";".join(commands)
+        try:
+            self._journal.append(tuple(commands))
+            try:
+                retval = self._io("write", line)
+            except BaseException:
+                self.state.clear()
+                raise
+            write_logger.info("{} ({} commands)\n".format(retval, len(commands)))
+            if self.__check_due(check_error, ErrorCheck.per_command, ErrorCheck.per_batch):
+                self._drain_errors()
+        finally:
+            self._release()
+        return retval
+
+    def __queue_command(self, msg):
+        """ Adds msg to the pending program line, flushing first if the line
+        would exceed max_line_length"""
+        if self.__pending and self.__pending_length+len(msg)+1 > self.max_line_length:
+            self.flush()
+        self.__pending.append(msg)
+        self.__pending_length += len(msg)+1
+
+    def __joins_lines(self):
+        """ Whether written commands are collected into program lines: inside
+        a batch, unless the error_check policy is per_command, which sends
+        and checks every command on its own"""
+        return bool(self.__batch_depth) and self.error_check in (ErrorCheck.per_batch, ErrorCheck.per_test)
+
+    def __is_barrier(self, msg):
+        return "?" in msg or command_mnemonic(msg) in self.__barriers
+
+    def __check_due(self, check_error, *policies):
+        """ Whether the error queue should be drained now. An explicit
+        check_error always wins, otherwise the error_check policy decides"""
+        if check_error is not None:
+            return check_error
+        return bool(self.default_check_err) and self.error_check in policies
+
+    def _drain_errors(self):
+        """ Reads the whole ERRX? queue and maps the errors to the commands
+        journaled since the last drain. Returns a list of ErrorRecords, which
+        is also kept in last_errors"""
+        commands = tuple(c for line in self._journal for c in line)
+        self._journal.clear()
+        errors = []
+        ret = self._check_err()
+        while ret and ret[:2]!='+0':
+            record = ErrorRecord(ret, commands)
+            exception_logger.warn("Error {} ({}), caused by {}".format(
+                record.code, record.message,
+                commands[0] if len(commands)==1 else "one of:\n{}".format("\n".join(commands))))
+            errors.append(record)
+            ret = self._check_err()
+        if errors:
+            # we do not know which settings failed to apply
+            self.state.clear()
+        self.last_errors = errors
+        return errors
+
+    def _io(self, method, *args, retry=True, **kwargs):
+        """ Calls method on the device, opening it first if necessary. If the
+        VISA session broke (any I/O error except a timeout) we reconnect and,
+        with retry, send the call once more if that is safe (see
+        __repeatable). Otherwise the error is raised after reconnecting, the
+        tester may have received the call already. Calls from different
+        threads are serialized, so a query gets its own reply"""
+        with self.__io_lock:
+            self.open()
+            try:
+                return getattr(self._device, method)(*args, **kwargs)
+            except visa.VisaIOError as e:
+                if e.error_code == visa.constants.VI_ERROR_TMO:
+                    raise
+                exception_logger.warn("VISA I/O error during {}: {}".format(method, e))
+                self.reconnect()
+                if not retry or not self.__repeatable(method, args):
+                    raise
+                return getattr(self._device, method)(*args, **kwargs)
+
+    def __repeatable(self, method, args):
+        """ Whether the call can be sent twice without effect: messages
+        which neither start anything nor edit programs"""
+        if method not in ("write", "query") or not args:
+            return True
+        if self._recording:
+            # the line would be stored in the program twice
+            return False
+        return not any(command_mnemonic(c) in self.__unrepeatable for c in str(args[0]).split(";"))
 
     def diagnostics(self, item):
         """ from the manual:
@@ -110,72 +361,103 @@ class B1500():
             """
         return self.query(format_command("DIAG?", item))
 
-    def query(self, msg, delay=None,check_error=False):
+    def query(self, msg, delay=None,check_error=None):
         """ Writes the msg to the Tester, reads output buffer after delay and
-        logs both to the query logger.Optionally checks for errors afterwards"""
+        logs both to the query logger. Checks for errors afterwards if
+        check_error is set or, if it is None, the error_check policy says so"""
+        if self.__capture is not None:
+            raise ValueError("Can not compile setups which query the tester, sent {}".format(msg))
         query_logger.info(msg)
         retval=[]
         if self._recording and any([x in msg for x in self.__no_store]):
             self.programs[self.last_program]["config_nostore"].append(msg)
             exception_logger.warn("Skipped query '{}' since not allowed while recording".format(msg))
         else:
-            self.open()
             try:
-                retval = self._device.query(msg, delay=delay)
+                self.flush()
+                self._journal.append((msg,))
+                self.state.apply(msg)
+                device = self.open()
+                old_timeout = device.timeout
+                if time.time() < self.__busy_until:
+                    # the tester answers once the running measurement is done
+                    device.timeout = max(old_timeout, self._timeout_ms())
+                try:
+                    retval = self._io("query", msg, delay=delay)
+                finally:
+                    device.timeout = old_timeout
                 query_logger.info(str(retval)+"\n")
-                err =self._check_err()
-                if err[:2]!="+0":
-                    exception_logger.warn(err)
-                    exception_logger.warn(msg)
+                if self.__check_due(check_error, ErrorCheck.per_command, ErrorCheck.per_batch):
+                    self._drain_errors()
             finally:
-                if  not self.__keep_open:
-                    self.close()
+                self._release()
         return retval
 
-    def write(self, msg, check_error=False):
+    def write(self, msg, check_error=None, force=False):
         """ Writes the msg to the Tester and logs it in the write
-        logger.Optionally checks for errors afterwards"""
+        logger. Checks for errors afterwards if check_error is set or, if it
+        is None, the error_check policy says so. Settings that match the
+        shadow state (see state.py) are not sent again, unless force is set"""
+        if self.__capture is not None:
+            # compiling a plan, see compile
+            self.__capture.append(msg)
+            return None
         write_logger.info(msg)
+        retval=None
         try:
             if self._recording and any([x in msg for x in self.__no_store]):
                 self.programs[self.last_program]["config_nostore"].append(msg)
                 exception_logger.warn("Skipped query '{}' since not allowed while recording".format(msg))
+            elif not force and not self._recording and self.state.redundant(msg):
+                exception_logger.info("'{}' matches the current state, not sending".format(msg))
+                return retval
+            elif self.__joins_lines() and not self.__is_barrier(msg):
+                # errors are checked once the line is flushed
+                if not self._recording:
+                    self.state.apply(msg)
+                self.__queue_command(msg)
+                return retval
             else:
-                self.open()
-                retval = self._device.write(msg)
+                self.flush()
+                self._journal.append((msg,))
+                try:
+                    retval = self._io("write", msg)
+                except BaseException:
+                    self.state.clear()
+                    raise
+                if not self._recording:
+                    self.state.apply(msg)
             write_logger.info(str(retval)+"\n")
-            if check_error or self.default_check_err:
-                err =self._check_err()
-                if err[:2]!="+0":
-                    exception_logger.warn(err)
-                    exception_logger.warn(msg)
+            if self.__check_due(check_error, ErrorCheck.per_command, ErrorCheck.per_batch):
+                self._drain_errors()
         finally:
-            if  not self.__keep_open:
-                self.close()
+            self._release()
         return retval
 
-    def read(self, check_error=False, timeout="default" ):
+    def read(self, check_error=False, timeout=None):
         """ Reads out the current output buffer and logs it to the query logger
-        optionally checking for errors"""
+        optionally checking for errors. timeout is in ms, by default derived
+        from the estimated duration of the running measurement"""
         retval=None
+        self.flush()
         self.open()
         old_timeout = self._device.timeout
-        if timeout != "default":
-            self._device.timeout
+        self._device.timeout = timeout if timeout is not None else self._timeout_ms()
         try:
             if "ascii" in repr(self.__format):
-                retval = self._device.read()
-            elif "binary4" in reps(self.__format):
-                retval = self._device.read_raw()
-            elif "binary8" in reps(self.__format):
-                retval = self._device.read_raw()
+                retval = self._io("read", retry=False)
+            elif "binary4" in repr(self.__format):
+                retval = self._io("read_raw", retry=False)
+            elif "binary8" in repr(self.__format):
+                retval = self._io("read_raw", retry=False)
             else:
                 raise ValueError("Unkown format {0}".format(self.__format))
             if check_error:
                 exception_logger.info(self._check_err())
         finally:
-            if  not self.__keep_open:
-                self.close()
+            if self._device is not None:
+                self._device.timeout = old_timeout
+            self._release()
         return retval
 
     def measure(self, test_tuple, force_wait=False, autoread=False):
@@ -206,11 +488,12 @@ class B1500():
             raise ValueError("Only one type of Measurement can be defined, please check your channel setups")
         # Measurements triggered by XE, read via NUB
         if XE_measurement:
+            if force_wait:
+                self._arm_completion()
+            self._expect(test_tuple)
             exc = self.write("XE")
             if force_wait:
-                ready = 0
-                while ready == 0:
-                    ready = self._operations_completed()
+                self.wait_for_completion()
             if autoread:
                 if isSweep(channels):
                     data = self._read_sweep(channels)
@@ -218,11 +501,13 @@ class B1500():
                     data = self._read_spot()
         # SPGU measurements
         elif SPGU:
-            for x in spgu_channels:
-                self.__channels[x].start_pulses()
+            # SRP starts all SPGU modules at once
+            self._expect(test_tuple)
+            self.__channels[spgu_channels[0]].start_pulses()
             if force_wait:
-                self.__channels[x].wait_spgu()
+                self.wait_spgus(spgu_channels, runtimes=[spgu_time(c.spgu) for c in channels if c.spgu])
         elif search:
+            self._expect(test_tuple)
             self.write("XE")
         parsed_data = self.__parse_output(test_tuple.format, data, num_meas, self.__TSC) if data else data
         return (exc,parsed_data)
@@ -230,7 +515,13 @@ class B1500():
     def check_settings(self, parameter):
         """ Queries the tester for the specified parameter
         (see enums.py or tabcomplete for available parameters)"""
-        ret = self.query("*LRN? {}".format(parameter))
+        query = "*LRN? {}".format(parameter)
+        if self.__discovery is not None and query in self.__discovery:
+            # answered from the discovery cache, see init
+            return self.__discovery[query]
+        ret = self.query(query)
+        if self.__discovery is not None:
+            self.__discovery[query] = ret
         return ret
 
 
@@ -286,23 +577,68 @@ class B1500():
             compliance, input_range, power_comp,
             measure_range)
 
-    def run_test(self, test_tuple, force_wait=False, auto_read=False, default_errcheck=None, force_new_setup=False):
+    def run_test(self, test_tuple, force_wait=False, auto_read=False, default_errcheck=None, force_new_setup=False, teardown=None):
         """ Takes in a test tuple specifying channel setups and global parameters,
         setups up parameters, channels and measurements accordingly and then performs the specified test,
-        returning gathered data if auto_read was specified. Allways
-        cleans up any opened channels after being run (forces zero and disconnect)"""
-        self.open(keep_open=True)
+        returning gathered data if auto_read was specified. Cleans up any
+        opened channels after being run (forces zero and disconnect), unless
+        keep_connected is set (see connected()), in which case they are only
+        forced to zero. teardown=True/False overrides this for one test.
+        If the test fails, all channels are forced to zero and torn down.
+        Setup and teardown commands are sent in batches (see batch()).
+        If auto_programs is a ProgramCache (see programs.py), setups which
+        ran often enough are stored as tester programs and run with DO.
+        Setups with ProgramVariables are always run like that, their values
+        are sent with VAR"""
+        if teardown is None:
+            teardown = not self.keep_connected
+        if self.auto_programs is not None and teardown and not (force_new_setup or self._recording):
+            ret = self.__run_stored(test_tuple, force_wait, auto_read, default_errcheck)
+            if ret is not None:
+                return ret
+        elif setup_variables(test_tuple):
+            raise ValueError("Setups with ProgramVariables run as stored programs, which needs auto_programs and a teardown")
+        self.__sessions += 1
+        self.open()
         old_default=self.default_check_err
         if default_errcheck is not None:
             self.default_check_err=default_errcheck
-        self.set_format(test_tuple.format, test_tuple.output_mode, force_new_setup)
-        self.set_filter_all(test_tuple.filter, force_new_setup)
-        self._enable_timestamp(True, force_new_setup)
-        self._set_adc_global(
-            adc_modes=test_tuple.adc_modes,
-            highspeed_adc_number=test_tuple.highspeed_adc_number,
-            highspeed_adc_mode=test_tuple.highspeed_adc_mode, force_new_setup=force_new_setup)
+        if force_new_setup:
+            self.state.clear()
         try:
+            self._configure(test_tuple, force_new_setup)
+            # resets timestamp, executes and optionally waits for answer,
+            # returns data with elapsed
+            ret = self.measure(test_tuple, force_wait,auto_read)
+        except BaseException:
+            self._emergency_zero()
+            teardown = True
+            raise
+        finally:
+            self.__connected.pop(self.__connection_key(test_tuple), None)
+            if teardown:
+                self.teardown(test_tuple)
+            else:
+                self.teardown(test_tuple, disconnect=False)
+                self.__connected[self.__connection_key(test_tuple)] = test_tuple
+            if self.__check_due(None, ErrorCheck.per_test):
+                self._drain_errors()
+            self.default_check_err=old_default
+            self.__sessions -= 1
+            self._release()
+        return ret
+
+    def _configure(self, test_tuple, force_new_setup=False):
+        """ Sends the global, channel and measurement settings of test_tuple
+        in one batch"""
+        with self.batch():
+            self.set_format(test_tuple.format, test_tuple.output_mode, force_new_setup)
+            self.set_filter_all(test_tuple.filter, force_new_setup)
+            self._enable_timestamp(True, force_new_setup)
+            self._set_adc_global(
+                adc_modes=test_tuple.adc_modes,
+                highspeed_adc_number=test_tuple.highspeed_adc_number,
+                highspeed_adc_mode=test_tuple.highspeed_adc_mode, force_new_setup=force_new_setup)
             measurechannels = [c for c in test_tuple.channels if c.measurement]
             measurements = [c.measurement for c in measurechannels]
             if len(set([m.mode for m in measurements]))>1:
@@ -326,20 +662,185 @@ class B1500():
                 self.setup_channel(channel, force_new_setup)
                 if channel.measurement:
                     self._setup_measurement(channel.number, channel.measurement, force_new_setup)
-                # resets timestamp, executes and optionally waits for answer,
-                # returns data with elapsed
-            ret = self.measure(test_tuple, force_wait,auto_read)
+
+    def compile(self, test_tuple):
+        """ Renders test_tuple to a CompiledPlan (see compiler.py) of
+        prerendered program lines. Plans are cached in plans, an LRU cache
+        keyed by the setup, so repeated setups are rendered once"""
+        return self.plans.get(test_tuple, self.__compile)
+
+    def __compile(self, test_tuple):
+        setup, teardown = [], []
+        # capturing must not change what the tester was last told
+        old = (self.__format, self.__outputMode, self.__TSC)
+        spgus = [self.__channels[c.number] for c in test_tuple.channels if c.spgu and c.number in self.__channels]
+        old_spgu = [(u, dict(u.spgu_setups)) for u in spgus]
+        try:
+            self.__capture = setup
+            self._configure(test_tuple)
+            self.__capture = teardown
+            self.teardown(test_tuple)
+        finally:
+            self.__capture = None
+            self.__format, self.__outputMode, self.__TSC = old
+            for unit, setups in old_spgu:
+                unit.spgu_setups = setups
+        return build_plan(test_tuple, setup, teardown, self.max_line_length)
+
+    def estimate(self, test_tuple, runs=1):
+        """ Estimate (see timing.py) of running test_tuple runs times: the
+        instrument time of the setup plus command_latency per command.
+        Nothing is sent to the tester"""
+        return estimate_plan(self.compile(test_tuple), self.command_latency, runs)
+
+    def calibrate_latency(self, samples=10):
+        """ Sets command_latency to the median round trip time of *OPC? on
+        the idle tester and returns it"""
+        times = []
+        with self.session():
+            self.flush()
+            for _ in range(samples):
+                start = time.time()
+                self._io("query", "*OPC?")
+                times.append(time.time()-start)
+        times.sort()
+        self.command_latency = times[len(times)//2]
+        return self.command_latency
+
+    def run_plan(self, plan, force_wait=False, auto_read=False, program=None, variables=None):
+        """ Runs a CompiledPlan like run_test runs its TestSetup, but sends
+        the prerendered lines as they are, without validation, formatting
+        or filtering by the state model. The channels are always torn down.
+        If the plan is stored as program number program (see store_program),
+        only DO is sent, preceded by VAR for those of variables (by default
+        the plans ProgramVariables) whose value changed. Returns (None, data)
+        like run_test"""
+        if plan.variables and program is None:
+            raise ValueError("Plans with ProgramVariables only run as stored programs")
+        updates = [v.command() for v in (plan.variables if variables is None else variables)]
+        updates = [c for c in updates if not self.state.redundant(c)]
+        self.__sessions += 1
+        self.open()
+        data = None
+        settings = plan.settings
+        self.__format, self.__outputMode = plan.format, plan.output_mode
+        if program is not None:
+            # the program holds setup, execution and teardown
+            setup, execute, teardown = (), ";".join(updates+["DO {}".format(program)]), ()
+        else:
+            setup, execute, teardown = plan.setup, plan.execute, plan.teardown
+        try:
+            self.flush()
+            for line in setup:
+                self.__send_line(line)
+            if setup and self.__check_due(None, ErrorCheck.per_command, ErrorCheck.per_batch):
+                self._drain_errors()
+            if execute:
+                if force_wait and not plan.spgu_channels:
+                    self._arm_completion()
+                self.__busy_until = time.time()+(plan.duration or 0)
+                if plan.spgu_channels:
+                    self._spgu_started = time.time()
+                self.__send_line(execute)
+                if force_wait:
+                    if plan.spgu_channels:
+                        self.wait_spgus(plan.spgu_channels, runtimes=plan.spgu_runtimes)
+                    else:
+                        self.wait_for_completion()
+                if auto_read and plan.read == "sweep":
+                    data = self._read_sweep(plan.measure_channels)
+                elif auto_read and plan.read == "spot":
+                    data = self._read_spot()
+        except BaseException:
+            self._emergency_zero()
+            settings = {}
+            raise
+        finally:
+            try:
+                for line in teardown:
+                    self.__send_line(line)
+                # the plan sent all its settings, so its state is known
+                self.state.clear()
+                if settings:
+                    self.state.settings.update(settings)
+                    for update in updates:
+                        self.state.apply(update)
+                if self.__check_due(None, ErrorCheck.per_command, ErrorCheck.per_batch, ErrorCheck.per_test):
+                    if self._drain_errors() and program is not None and self.auto_programs is not None:
+                        self.auto_programs.discard(plan.key)
+            finally:
+                self.__sessions -= 1
+                self._release()
+        parsed_data = self.__parse_output(plan.format, data, len(plan.measure_channels), self.__TSC) if data else data
+        return (None, parsed_data)
+
+    def __run_stored(self, test_tuple, force_wait, auto_read, default_errcheck):
+        """ Runs test_tuple as stored program, storing it if it ran often
+        enough. Returns None if it is not stored, run_test runs it then"""
+        plan = self.compile(test_tuple)
+        number = self.auto_programs.lookup(plan.key)
+        if number is None:
+            if plan.variables and not self.storable(plan):
+                raise ValueError("Setup with ProgramVariables can not be stored as program")
+            if not (plan.variables or self.auto_programs.due(plan.key)) or not self.storable(plan):
+                return None
+            number = self.auto_programs.allocate(plan.key)
+            if not self.store_program(plan, number):
+                self.auto_programs.discard(plan.key)
+                if plan.variables:
+                    raise ValueError("Storing setup with ProgramVariables as program {} failed".format(number))
+                return None
+        self.__connected.pop(self.__connection_key(test_tuple), None)
+        old_default=self.default_check_err
+        if default_errcheck is not None:
+            self.default_check_err=default_errcheck
+        try:
+            return self.run_plan(plan, force_wait, auto_read, program=number,
+                                 variables=setup_variables(test_tuple) if plan.variables else ())
         finally:
-            if len(measurements)>1:
-                self.set_parallel_measurements(False)
-            for channel in test_tuple.channels:
-                self._teardown_channel(channel)
-            if test_tuple.spgu_selector_setup:
-                for p,s in test_tuple.spgu_selector_setup:
-                    self.set_SMUSPGU_selector(p, SMU_SPGU_state.open_relay)
             self.default_check_err=old_default
-            self.close()
-        return ret
+
+    def set_variable(self, variable, value=None):
+        """ Sets the tester variable of the ProgramVariable variable to
+        value, by default its own, for programs recorded by hand"""
+        return self.write(variable.command(value))
+
+    def storable(self, plan):
+        """ Whether all commands of plan may be stored in a program"""
+        lines = plan.setup+((plan.execute,) if plan.execute else ())+plan.teardown
+        return not any(command_mnemonic(c) in self.__no_store
+                       for line in lines for c in line.split(";"))
+
+    def store_program(self, plan, number):
+        """ Stores plan as program number (ST ... END), replacing the
+        program of that number. Checks with LST? that the tester has it and
+        returns whether storing worked"""
+        lines = plan.setup+((plan.execute,) if plan.execute else ())+plan.teardown
+        with self.session():
+            self.flush()
+            try:
+                self.__send_line("SCR {}".format(number))
+                self.__send_line("ST {}".format(number))
+                for line in lines:
+                    self.__send_line(line)
+            finally:
+                self.__send_line("END")
+            errors = self._drain_errors()
+            stored = str(self.query("LST?", check_error=False)).strip().split(",")
+        if errors or str(number) not in stored:
+            exception_logger.warn("Storing program {} failed, running the setup directly".format(number))
+            self.__send_line("SCR {}".format(number))
+            return False
+        return True
+
+    def __send_line(self, line):
+        write_logger.info(line)
+        self._journal.append((line,))
+        try:
+            return self._io("write", line)
+        except BaseException:
+            self.state.clear()
+            raise
 
     def _Pulsed_Spot(self, target, input_channel, ground_channel, base, pulse, width,compliance,input_range=None,measure_range=MeasureRanges_V.full_auto, hold=0 ):
         if target == Targets.V:
@@ -464,26 +965,146 @@ class B1500():
     # methods ideally used indirectly, but might want to be used for finegrained
     # control or for convenvience
 
-    def _operations_completed(self):
-        """ Queries tester for pending operations. Timeout needs to be set to
-        infinite, since tester will only respond after finishing current
-        operation"""
+    def _operations_completed(self, timeout=None):
+        """ Queries tester for pending operations. The tester only responds
+        after finishing the current operation, so the VISA timeout is raised
+        to timeout seconds (see _timeout for the default) for this query.
+        Raises TimeoutError if the tester does not answer in time"""
+        timeout = self._timeout(timeout)
+        self.open()
         old_timeout = self._device.timeout
-        self._device.timeout = None
-        ready = int(self.query("*OPC?").strip())
-        self._device.timeout = old_timeout
+        self._device.timeout = int(timeout*1000)
+        try:
+            ready = int(self.query("*OPC?").strip())
+        except visa.VisaIOError as e:
+            if e.error_code == visa.constants.VI_ERROR_TMO:
+                raise TimeoutError("Operations not completed within {} s".format(timeout))
+            raise
+        finally:
+            if self._device is not None:
+                self._device.timeout = old_timeout
         return ready
 
+    def wait_for_completion(self, timeout=None, mask=StatusByte.set_ready,
+                            poll_interval=1e-3, max_poll_interval=0.25):
+        """ Blocks until the status byte has any of the bits in mask set,
+        without blocking the tester with *OPC?. Waits for service requests
+        via the VISA event API if the resource supports them, otherwise polls
+        the status byte with exponentially growing intervals. Raises
+        TimeoutError after timeout seconds (see _timeout for the default)"""
+        timeout = self._timeout(timeout)
+        deadline = time.time()+timeout
+        self._arm_completion(mask)
+        try:
+            while True:
+                stb = self._status_byte()
+                if stb & mask:
+                    return stb
+                remaining = deadline-time.time()
+                if remaining <= 0:
+                    raise TimeoutError("Tester did not complete within {} s, status byte {}".format(timeout, stb))
+                if self.__srq_armed:
+                    self.__wait_srq(remaining)
+                else:
+                    time.sleep(min(poll_interval, remaining))
+                    poll_interval = min(2*poll_interval, max_poll_interval)
+        finally:
+            self.__disarm_completion()
+
+    def wait_spgus(self, channels, timeout=None, as_future=False, runtimes=None):
+        """ Waits until the SPGUs of all given channels have finished pulsing,
+        see SPGUSMU.wait_spgu. runtimes are those of the pulse trains started,
+        by default the expected_runtime of the setups of channels. With
+        as_future returns a concurrent.futures.Future instead of blocking"""
+        units = list(OrderedDict.fromkeys(self.__channels[c] for c in channels))
+        if runtimes is None:
+            runtimes = [self.__channels[c].expected_runtime(c) for c in channels]
+        if as_future:
+            return spgu_future(units, timeout=timeout, runtimes=runtimes)
+        return wait_spgus(units, timeout, runtimes=runtimes)
+
+    def spgu_status(self):
+        """ SPST? of the SPGUs, 1 while pulsing. Sent directly, bypassing
+        batching and error checks, so it can be polled from another thread"""
+        query_logger.info("SPST?")
+        return int(str(self._io("query", "SPST?")).strip())
+
+    def _expect(self, test_tuple):
+        """ Notes that test_tuple is about to be started, so the timeouts of
+        the following blocking calls can be derived from its estimated duration"""
+        duration = estimate_duration(test_tuple)
+        self.__busy_until = time.time()+(duration or 0)
+
+    def _timeout(self, timeout=None):
+        """ Timeout in s for a blocking call: timeout if given, else
+        completion_timeout if set, else the estimated remaining time of the
+        running measurement times timeout_margin, at least min_timeout"""
+        if timeout is not None:
+            return timeout
+        if self.completion_timeout is not None:
+            return self.completion_timeout
+        remaining = max(0., self.__busy_until-time.time())
+        return timeout_ms(remaining, self.timeout_margin, self.min_timeout)/1000.
+
+    def _timeout_ms(self):
+        return int(self._timeout()*1000)
+
+    def poll_completion(self, mask=StatusByte.set_ready):
+        """ Non blocking check whether the status byte has any bit of mask set"""
+        return bool(self._status_byte() & mask)
+
+    def _status_byte(self):
+        """ Reads the status byte by serial poll if the resource supports it,
+        otherwise with *STB?"""
+        self.flush()
+        if hasattr(self.open(), "read_stb"):
+            return int(self._io("read_stb"))
+        return int(self.query("*STB?", check_error=False).strip())
+
+    def _arm_completion(self, mask=StatusByte.set_ready):
+        """ Enables mask as service request source and, if the VISA resource
+        supports events, starts queueing service requests so that a request
+        raised before wait_for_completion is not lost"""
+        if self.__srq_mask != mask:
+            self.write(format_command("*SRE", int(mask)))
+            self.__srq_mask = mask
+        if self.use_srq and not self.__srq_armed:
+            try:
+                self.open().enable_event(visa.constants.EventType.service_request,
+                                         visa.constants.EventMechanism.queue)
+                self.__srq_armed = True
+            except (AttributeError, NotImplementedError, visa.VisaIOError) as e:
+                exception_logger.info("Service requests not available ({}), polling the status byte instead".format(e))
+                self.use_srq = False
+
+    def __disarm_completion(self):
+        if self.__srq_armed:
+            self.__srq_armed = False
+            try:
+                self._device.disable_event(visa.constants.EventType.service_request,
+                                           visa.constants.EventMechanism.queue)
+                self._device.discard_events(visa.constants.EventType.service_request,
+                                            visa.constants.EventMechanism.queue)
+            except (AttributeError, visa.VisaIOError) as e:
+                exception_logger.warn("Could not disable service request events: {}".format(e))
+
+    def __wait_srq(self, remaining):
+        """ Waits up to remaining seconds for a service request. A VISA
+        timeout is not an error here, the caller checks its deadline"""
+        try:
+            self._device.wait_on_event(visa.constants.EventType.service_request,
+                                       max(1, int(remaining*1000)))
+        except visa.VisaIOError as e:
+            if e.error_code != visa.constants.VI_ERROR_TMO:
+                raise
+
     def _enable_timestamp(self, state, force_new_setup=False):
         """ Enable Timestamp during measurements"""
-        if self.__TSC==state and not force_new_setup:
-            exception_logger.info("No change for timestamp, not sending")
+        self.__TSC=state
+        if state:
+            return self.write("TSC {}".format(1), force=force_new_setup)
         else:
-            self.__TSC=state
-            if state:
-                return self.write("TSC {}".format(1))
-            else:
-                return self.write("TSC {}".format(0))
+            return self.write("TSC {}".format(0), force=force_new_setup)
 
     def _reset_timestamp(self):
         """ Clears Timestamp counter, if 100us resolution call this at least
@@ -567,46 +1188,38 @@ to annotate error codes will come in a future release")
         """ Configures channel with any parameters which can be set before
         the acutal measurement or without any measurement at all"""
         unit = self.__channels[channel.number]
+        if force_new_setup:
+            self.state.forget_channels(channel.number)
+        # settings unchanged since the last setup are filtered by write, see state.py
         unit.connect(channel.number)
-        if  self.__last_channel_setups.get(unit)==channel and not force_new_setup:
-            # restore voltage settings to channel
-            unit.restore(channel.number)
-            exception_logger.warn("Channel configuration for channel {} has not changed, using old setup".format(channel.number))
+        if not channel.spgu:
+            unit.set_series_resistance(channel.series_resistance,channel.number)
+            unit.set_selected_ADC(channel.number, channel.channel_adc)
+        if channel.dcforce is not None:
+            unit.setup_dc_force(channel.number, channel.dcforce)
+        elif channel.staircase_sweep is not None:
+            unit.setup_staircase_sweep(channel.number, channel.staircase_sweep)
+        elif channel.pulsed_sweep is not None:
+            unit.setup_pulsed_sweep(channel.number, channel.pulsed_sweep)
+        elif channel.pulsed_spot is not None:
+            unit.setup_pulsed_spot(channel.number, channel.pulsed_spot)
+        elif channel.quasipulse is not None:
+            raise NotImplementedError("Quasipulse measurements not yet implemented")
+        elif channel.highspeed_spot is not None:
+            raise NotImplementedError("HighSpeedSpot measurements not yet implemented")
+        elif channel.spgu is not None:
+            unit.setup_spgu(channel.number, channel.spgu)
+        elif channel.binarysearch is not None:
+            unit.setup_binarysearch_force(channel.binarysearch,channel=channel.number)
+        elif channel.linearsearch is not None:
+            unit.setup_linearsearch_force(channel.linearsearch,channel=channel.number)
         else:
-            self.__last_channel_setups[unit]=channel
-            if not channel.spgu:
-                unit.set_series_resistance(channel.series_resistance,channel.number)
-                unit.set_selected_ADC(channel.number, channel.channel_adc)
-            if channel.dcforce is not None:
-                unit.setup_dc_force(channel.number, channel.dcforce)
-            elif channel.staircase_sweep is not None:
-                unit.setup_staircase_sweep(channel.number, channel.staircase_sweep)
-            elif channel.pulsed_sweep is not None:
-                unit.setup_pulsed_sweep(channel.number, channel.pulsed_sweep)
-            elif channel.pulsed_spot is not None:
-                unit.setup_pulsed_spot(channel.number, channel.pulsed_spot)
-            elif channel.quasipulse is not None:
-                raise NotImplementedError("Quasipulse measurements not yet implemented")
-            elif channel.highspeed_spot is not None:
-                raise NotImplementedError("HighSpeedSpot measurements not yet implemented")
-            elif channel.spgu is not None:
-                unit.setup_spgu(channel.number, channel.spgu)
-            elif channel.binarysearch is not None:
-                unit.setup_binarysearch_force(channel.binarysearch,channel=channel.number)
-            elif channel.linearsearch is not None:
-                unit.setup_linearsearch_force(channel.linearsearch,channel=channel.number)
-            else:
-                raise ValueError(
-                    "At least one setup should be in the channel, maybe you forgot to force ground to 0?")
-            errors = []
-            ret = self._check_err()
-            if ret[:2]=='+0':
-                return ret
-            else:
-                while ret[:2]!='+0':
-                    errors.append(ret)
-                    ret=self._check_err()
-                return errors
+            raise ValueError(
+                "At least one setup should be in the channel, maybe you forgot to force ground to 0?")
+        if self.__batch_depth or not self.__check_due(None, ErrorCheck.per_command):
+            # errors are checked when the batch is flushed or by the policy
+            return None
+        return self._drain_errors()
     def set_measure_mode(self,mode,*channels):
         """ Defines which measurement to perform on the channel. Not used for all measurements,
         check enums.py  or MeasureModes for a full list of measurements. Not in SMUs because for parallel measurements, need to set all channels at once"""
@@ -655,58 +1268,45 @@ to annotate error codes will come in a future release")
 
     def set_filter_all(self, filter_state, force_new_setup=False):
         """ Sets the spike and overshoot filter on the SMU output."""
-        if self.__filter_all==filter_state and not force_new_setup:
-            exception_logger.info("No change in filter, not sending command")
-        else:
-            self.__filter_all=filter_state
-            return self.write("FL {}".format(filter_state))
+        return self.write("FL {}".format(filter_state), force=force_new_setup)
     # individual commands (grouped only for input/target types, i.e. V/I
 
 
     def _set_adc_global(
         self,
-        adc_modes=[], # list of (adctype,admode) tuples, maximum 3, see enums.py
+        adc_modes=[], # list of (adctype,admode[,N]) tuples, maximum 3, see enums.py
         highspeed_adc_number=None,
      highspeed_adc_mode=None, force_new_setup=False):
         """ Set the configration for the different ADC types, switching between
         manual and auto modes for all ADCs and specifying samples/integration time
         for the highspeed ADC"""
         if adc_modes:
-            return [self.set_adc(adctype, adcmode,force_new_setup) for adctype,adcmode in adc_modes]
+            return [self.set_adc(*mode, force_new_setup=force_new_setup) for mode in adc_modes]
         else:
             if highspeed_adc_number is None or highspeed_adc_mode is None:
                 raise ValueError(
                     "Either give complete adc mapping or specify highspeed ADC")
             self.set_highspeed_ADC(highspeed_adc_number, highspeed_adc_mode,force_new_setup)
 
-    def set_adc(self, adc, mode, force_new_setup=False):
+    def set_adc(self, adc, mode, number=None, force_new_setup=False):
         """ Set the configration for the different ADC types, switching between
-        manual and auto modes for all ADC
+        manual and auto modes for all ADC, optionally with the number of
+        samples or integration time (N of AIT)
         """
-        if not self.__ADC.get(adc)==mode or force_new_setup:
-            self.__ADC[adc]=mode
-            self.write(format_command("AIT",adc,mode))
-        else:
-            exception_logger.info("No change for adc {}, not sending AIT".format(adc))
+        return self.write(format_command("AIT",adc,mode,number), force=force_new_setup)
 
     def set_highspeed_ADC(self, number, mode, force_new_setup=False):
-        if (not (self.__HIGHSPEED_ADC["number"]== number and self.__HIGHSPEED_ADC["mode"]==mode)) or force_new_setup:
-            return self.write(
-                "AV {}, {}".format(
-                    number,
-                    mode))
-        else:
-            exception_logger.info("AV parameters not changed, no write")
+        return self.write(
+            "AV {}, {}".format(
+                number,
+                mode), force=force_new_setup)
 
     def set_format(self, format, output_mode, force_new_setup=False):
         """ Specifies output mode and format to use for testing. Check
         Formats enum for more details"""
-        if not (self.__format == format and self.__outputMode == output_mode) or force_new_setup :
-            self.__format = format
-            self.__outputMode = output_mode
-            self.write("FMT {},{}".format(format, output_mode))
-        else:
-            exception_logger.info("FMT parameters not changed, no write")
+        self.__format = format
+        self.__outputMode = output_mode
+        return self.write("FMT {},{}".format(format, output_mode), force=force_new_setup)
 
     def _check_modules(self, mainframe=False):
         """ Queries for installed modules and optionally mainframes connected"""
@@ -714,19 +1314,24 @@ to annotate error codes will come in a future release")
             return self.query("UNT? 1")
         else:
             return self.query("UNT? 0")
-    def record_program(self,program_name):
+    def record_program(self,program_name, elements=None):
+        """ Starts recording the following commands as program program_name.
+        elements is the number of data elements a run of the program leaves
+        in the output buffer, run_programs needs it to read its data"""
         if self._recording:
             raise ValueError("Already recording")
-        id = self.programs[self.last_program]["id"]+1 if self.last_program else 1
+        id = self.programs[self.last_program]["index"]+1 if self.last_program else 1
         self.write("ST {}".format(id))
         self._recording = True
         self.programs[program_name]={}
         self.programs[program_name]["index"]= id
         self.programs[program_name]["steps"]=[]
         self.programs[program_name]["config_nostore"]=[]
+        self.programs[program_name]["elements"]=elements
         self.last_program=program_name
     def stop_recording(self):
         self._recording = False
+        self.write("END")
         exception_logger.info("Recorded program {} with index {} and the following steps".format(self.last_program,self.programs[self.last_program]["index"]))
         exception_logger.info("\n".join(self.programs[self.last_program]["steps"]))
         exception_logger.info("as well as the following captured steps(check these manually before exeting the program, or execute the self.nostore_execute if you are sure all them are idempotent")
@@ -741,39 +1346,163 @@ to annotate error codes will come in a future release")
         """ Runs the specified programs, in order of the ids given"""
         if self._recording:
             raise ValueError("still recording")
-        if any([not i in [x["index"] for x in self.programs]]):
+        stored = [x["index"] for x in self.programs.values()]
+        if self.auto_programs is not None:
+            stored.extend(self.auto_programs.stored.values())
+        if any([not i in stored for i in ids]):
             raise ValueError("One of your specified ids not in the buffer")
         if len(ids)>8:
             raise ValueError("You can only specify 8 programs at once")
         self.write(format_command("DO",*ids))
 
+    def run_programs(self, items, auto_read=True):
+        """ Runs a sequence of programs with as few DO commands as possible.
+        items are names of recorded programs (see record_program) or
+        TestSetups, which are stored as programs via auto_programs first.
+        Up to 8 consecutive items share one DO, their data is read at once
+        and split per item by its number of data elements. Returns a list
+        with the data of every item, None for items without data or recorded
+        without elements"""
+        if self._recording:
+            raise ValueError("still recording")
+        items = list(items)
+        results = []
+        size = 8
+        if self.auto_programs is not None:
+            size = min(size, self.auto_programs.max_programs)
+        with self.session():
+            while items:
+                group = []
+                while items and len(group) < size:
+                    job = self.__program_job(items[0])
+                    if group and not self.__fits_group(group, job):
+                        break
+                    group.append(job)
+                    items.pop(0)
+                results.extend(self.__run_program_group(group, auto_read))
+        return results
+
+    def __program_job(self, item):
+        """ (number, elements, plan, variables) of a run_programs item"""
+        if not isinstance(item, TestSetup):
+            program = self.programs[item]
+            return (program["index"], program.get("elements"), None, ())
+        if self.auto_programs is None:
+            raise ValueError("Running TestSetups as programs needs auto_programs")
+        plan = self.compile(item)
+        number = self.auto_programs.lookup(plan.key)
+        if number is None:
+            if not self.storable(plan):
+                raise ValueError("Setup can not be stored as program")
+            number = self.auto_programs.allocate(plan.key)
+            if not self.store_program(plan, number):
+                self.auto_programs.discard(plan.key)
+                raise ValueError("Storing setup as program {} failed".format(number))
+        return (number, plan.elements, plan, setup_variables(item) if plan.variables else ())
+
+    def __fits_group(self, group, job):
+        """ Whether job can share a DO with group: all data must have the
+        same format, and a variable can have only one value"""
+        formats = set(j[2].format for j in group+[job] if j[2] is not None)
+        if len(formats) > 1:
+            return False
+        values = {}
+        for v in [v for j in group+[job] for v in j[3]]:
+            if values.setdefault(v.name, float(v)) != float(v):
+                return False
+        return True
+
+    def __run_program_group(self, group, auto_read):
+        plans = [j[2] for j in group if j[2] is not None]
+        updates = list(OrderedDict.fromkeys(v.command() for j in group for v in j[3]))
+        updates = [c for c in updates if not self.state.redundant(c)]
+        if plans:
+            self.__format, self.__outputMode = plans[0].format, plans[0].output_mode
+        self.flush()
+        self.__busy_until = time.time()+sum(p.duration or 0 for p in plans)
+        try:
+            self.__send_line(";".join(updates+[format_command("DO", *[j[0] for j in group])]))
+        finally:
+            # DO leaves the settings of its last program, if we know them
+            self.state.clear()
+            if group[-1][2] is not None:
+                self.state.settings.update(group[-1][2].settings)
+                for update in updates:
+                    self.state.apply(update)
+        if self.__check_due(None, ErrorCheck.per_command, ErrorCheck.per_batch, ErrorCheck.per_test):
+            if self._drain_errors() and self.auto_programs is not None:
+                for p in plans:
+                    self.auto_programs.discard(p.key)
+        counts = [j[1] or 0 for j in group]
+        if not auto_read or not sum(counts):
+            return [None]*len(group)
+        chunks = self.__read_elements(counts)
+        return [self.__parse_output(self.__format, c, None, self.__TSC) if c else None
+                for c in chunks]
+
+    def __read_elements(self, counts):
+        """ Reads sum(counts) data elements from the output buffer, with
+        as few reads as the terminators allow, and splits them into chunks
+        of counts elements"""
+        total = sum(counts)
+        binary = self.__format in (Format.binary4, Format.binary4_crl, Format.binary8, Format.binary8_crl)
+        if binary:
+            size = 4 if self.__format in (Format.binary4, Format.binary4_crl) else 8
+            raw = b""
+            while len(raw) < total*size:
+                data = self.read()
+                if not data:
+                    raise ValueError("Expected {} bytes of data, got {}".format(total*size, len(raw)))
+                if self.__format in (Format.binary4_crl, Format.binary8_crl) and data.endswith(b"\r\n"):
+                    data = data[:-2]
+                raw += data
+            bounds = [size*sum(counts[:i]) for i in range(len(counts)+1)]
+            return [raw[a:b] for a, b in zip(bounds, bounds[1:])]
+        elements = []
+        while len(elements) < total:
+            read = [e for e in re.split(r"[,\r\n]+", self.read()) if e]
+            if not read:
+                raise ValueError("Expected {} data elements, got {}".format(total, len(elements)))
+            elements.extend(read)
+        bounds = [sum(counts[:i]) for i in range(len(counts)+1)]
+        return [",".join(elements[a:b]) for a, b in zip(bounds, bounds[1:])]
+
 
     def _reset(self):
         """ Reset Tester"""
         query = "*RST"
+        if self.auto_programs is not None:
+            # programs are stored again when due
+            self.auto_programs.clear()
         return self.write(query)
 
-    def _check_err(self, all=False, timeout=20000):
-        """ check for single error, or all errors in stack"""
+    def _check_err(self, all=False, timeout=None):
+        """ check for single error, or all errors in stack. The tester answers
+        once all previous commands are done, so the timeout (in ms) defaults
+        to one derived from the running measurement"""
         query = "ERRX?"
         if not self._recording:
-
+            self.flush()
+            self.open()
             old_timeout = self._device.timeout
-            self._device.timeout=timeout
-            ret = self._device.query(query)
-            self._device.timeout=old_timeout
-            if all:
-                results = []
-                while ret[:2]!='+0':
-                    exception_logger.warn(ret)
-                    results.append(ret)
-                    ret = self._device.query(query)
-                return results
+            self._device.timeout=timeout if timeout is not None else self._timeout_ms()
+            try:
+                ret = self._io("query", query)
+                if all:
+                    results = []
+                    while ret[:2]!='+0':
+                        exception_logger.warn(ret)
+                        results.append(ret)
+                        ret = self._io("query", query)
+                    return results
+            finally:
+                if self._device is not None:
+                    self._device.timeout=old_timeout
             if ret[:2]!='+0':
                 exception_logger.warn(ret)
             return ret
         else:
-            exception.warn("Skipped query \"{}\" since it is not allowed while recording".format(query))
+            exception_logger.warn("Skipped query \"{}\" since it is not allowed while recording".format(query))
 
     def _zero_channel(self, channel):
         """ Force Channel voltage to zero, saving previous parameters"""
@@ -793,23 +1522,80 @@ to annotate error codes will come in a future release")
             raise ValueError("Invalid Channel value")
         return self.slots_installed[int(str(channel)[0])].slot
 
+    def teardown(self, test_tuple, disconnect=True):
+        """ Undoes the setup of test_tuple: disables parallel measurements,
+        forces all its channels to zero, disconnects them and opens the
+        SMU/SPGU selector relays. Without disconnect the channels are only
+        forced to zero and stay connected, as do the selector relays"""
+        with self.batch():
+            if len([c for c in test_tuple.channels if c.measurement])>1:
+                self.set_parallel_measurements(False)
+            if not disconnect:
+                if test_tuple.channels:
+                    self._zero_channel(",".join(str(c.number) for c in test_tuple.channels))
+                return
+            for channel in test_tuple.channels:
+                self._teardown_channel(channel)
+            if test_tuple.spgu_selector_setup:
+                for p,s in test_tuple.spgu_selector_setup:
+                    self.set_SMUSPGU_selector(p, SMU_SPGU_state.open_relay)
+
+    @staticmethod
+    def __connection_key(test_tuple):
+        return (tuple(c.number for c in test_tuple.channels),
+                tuple(test_tuple.spgu_selector_setup or ()))
+
+    def _emergency_zero(self):
+        """ Forces all channels to zero with DZ, sent directly, bypassing
+        batching and error checks. Used when a test fails"""
+        try:
+            write_logger.info("DZ")
+            self._io("write", "DZ")
+            self.state.apply("DZ")
+        except Exception as e:
+            exception_logger.warn("Emergency DZ failed: {}".format(e))
+
+    def abort(self):
+        """ Aborts running measurements and SPGU output with AB. Sent
+        directly, bypassing batching and error checks, so it can be called
+        from another thread while the tester is busy"""
+        write_logger.info("AB")
+        return self._io("write", "AB")
+
     def _teardown_channel(self, channel):
         """ Force Channel to zero and then disconnect """
         if channel.number not in self.sub_channels:
             exception_logger.warn("No channel {} installed, only have \n{}\n, proceeding with teardown but call check_err and verify your setup".format(channel, self.sub_channels))
         self._zero_channel(channel.number)
         self._close_channel(channel.number)
+        if channel.spgu and channel.number in self.__channels:
+            self.__channels[channel.number].spgu_setups.pop(channel.number, None)
 
     # methods only used in discovery,intended to be used only by via public calls,
     # not directly
 
-    def __discover_slots(self):
+    def __discover_slots(self, rediscover=False):
         """ Queries installed modules, then checks their type and their available ranges"""
         slots = {}
         ret = self._check_modules()
-        for i,x in enumerate(ret.strip().split(";")):
-            if x!="0,0":
-                slots[i+1]=self.__getModule(x.split(",")[0], i+1)
+        cached = None
+        if self.discovery_cache and not rediscover:
+            cached = load_discovery(self.discovery_cache, self.__test_addr)
+            if cached and cached.get("UNT? 0") != ret:
+                exception_logger.info("Installed modules changed, discovering them again")
+                cached = None
+        self.__discovery = dict(cached) if cached else {"UNT? 0": ret}
+        try:
+            for i,x in enumerate(ret.strip().split(";")):
+                if x!="0,0":
+                    slots[i+1]=self.__getModule(x.split(",")[0], i+1)
+            if self.discovery_cache and not cached:
+                try:
+                    save_discovery(self.discovery_cache, self.__test_addr, self.__discovery)
+                except OSError as e:
+                    exception_logger.warn("Could not write discovery cache {}: {}".format(self.discovery_cache, e))
+        finally:
+            self.__discovery = None
         return slots
 
     def _read_spot(self):
@@ -827,9 +1613,11 @@ to annotate error codes will come in a future release")
     def __parse_output(self, test_format, output, num_measurements, timestamp):
         try:
             if test_format in (Format.binary4, Format.binary4_crl):
-                return parse_binary4(output)
-            elif test_format in (Format.binary8, Format.binary8,):
-                return parse_binary8(output)
+                data = parse_binary4(output, self.__binary4_tables)
+                return (pd.DataFrame(data), data, output)
+            elif test_format in (Format.binary8, Format.binary8_crl):
+                # binary8 is not decoded yet
+                return output
             else:
                 frame,series_dict= parse_ascii_default_dict(test_format, output)
                 return (frame,series_dict,output)
@@ -0,0 +1,118 @@
+from collections import namedtuple
+from .enums import ADCMode, ADCTypes, SPGUOutputModes, SweepMode
+
+# Estimates of how long the tester needs for a TestSetup, used to derive VISA
+# timeouts which are tight for short measurements and still safe for long
+# sweeps. The estimates are pessimistic, callers add a margin (see timeout_ms)
+
+# upper bounds of the time per sample of the high speed ADC and per
+# averaged measurement of the high resolution ADC (1 PLC at 50 Hz)
+highspeed_sample_time = 1e-4
+highresolution_time = 2e-2
+# auto mode of AV multiplies the number with the initial number of samples
+highspeed_auto_samples = 10
+# time to settle the source and range before every measured point
+point_overhead = 1e-3
+# host time per command sent, until B1500.calibrate_latency measured it
+default_command_latency = 5e-3
+
+
+def adc_time(test_tuple, channel=None):
+    """ Time of one measurement of channel, on the ADC selected by its
+    channel_adc. Without channel, the slowest ADC test_tuple configures.
+    The averaging number of the high resolution ADC is the N of its
+    (ADCTypes.highresolution, mode, N) entry in adc_modes, 1 if not given"""
+    modes = dict((m[0], tuple(m[1:])) for m in test_tuple.adc_modes or ())
+    number = test_tuple.highspeed_adc_number or 1
+    samples = number*highspeed_auto_samples if test_tuple.highspeed_adc_mode == ADCMode.auto else number
+    hs = samples*highspeed_sample_time
+    hr_mode = modes.get(ADCTypes.highresolution, ())
+    hr = (hr_mode[1] if len(hr_mode) > 1 and hr_mode[1] else 1)*highresolution_time
+    if channel is not None:
+        return hr if channel.channel_adc == ADCTypes.highresolution else hs
+    if ADCTypes.highresolution in modes:
+        return max(hs, hr)
+    return hs
+
+
+def sweep_steps(sweep):
+    """ Number of points of a staircase or pulsed sweep"""
+    steps = max(int(sweep.step or 1), 1)
+    if sweep.sweepmode in (SweepMode.linear_up_down, SweepMode.log_up_down):
+        steps *= 2
+    return steps
+
+
+def pulse_period(width, period, hold=0):
+    """ Pulse period in s, estimating the minimum and conservative periods
+    the tester picks itself"""
+    if period is not None and period > 0:
+        return period
+    return 2*width+hold+5e-3
+
+
+def spgu_time(spgu):
+    """ Run time of an SPGU setup, None for free run. The waits for the
+    SPGU (see SPGUSMU.expected_runtime) use it as well"""
+    if spgu.output_mode == SPGUOutputModes.count:
+        return (spgu.pulse_period or 0)*spgu.condition
+    elif spgu.output_mode == SPGUOutputModes.duration:
+        return spgu.condition
+    return None
+
+
+def estimate_duration(test_tuple):
+    """ Estimated time in s from XE (or SRP) until the tester has finished
+    test_tuple. Returns None if it can not finish on its own (SPGU free run)"""
+    measured = [c for c in test_tuple.channels if c.measurement]
+    per_point = sum(adc_time(test_tuple, c)+point_overhead for c in measured)
+    if not measured:
+        per_point = adc_time(test_tuple)+point_overhead
+    total = 0.
+    points = 1
+    for c in test_tuple.channels:
+        if c.staircase_sweep:
+            s = c.staircase_sweep
+            points = max(points, sweep_steps(s))
+            total = max(total, s.hold+sweep_steps(s)*(s.delay+per_point))
+        elif c.pulsed_sweep:
+            s = c.pulsed_sweep
+            period = pulse_period(s.pulse_width, s.pulse_period, s.pulse_hold)
+            points = max(points, sweep_steps(s))
+            total = max(total, s.sweep_hold+sweep_steps(s)*(s.sweep_delay+period+per_point))
+        elif c.pulsed_spot:
+            s = c.pulsed_spot
+            total = max(total, s.hold+pulse_period(s.width, s.period)+per_point)
+        elif c.spgu:
+            runtime = spgu_time(c.spgu)
+            if runtime is None:
+                return None
+            total = max(total, runtime)
+    return max(total, points*per_point)
+
+
+def timeout_ms(duration, margin=2., minimum=2.):
+    """ VISA timeout in ms for a call expected to take duration s, at least
+    minimum s"""
+    return int(1000*max(minimum, (duration or 0)*margin+minimum))
+
+
+class Estimate(namedtuple("__Estimate", ["instrument", "host", "commands"])):
+    """ Expected run time of a plan: instrument is the time in s the tester
+    needs (None for SPGU free run), host the time in s spent sending the
+    commands, commands their number"""
+
+    @property
+    def total(self):
+        if self.instrument is None:
+            return None
+        return self.instrument+self.host
+
+
+def estimate_plan(plan, latency=default_command_latency, runs=1):
+    """ Estimate of running the CompiledPlan plan runs times. Every line is
+    one command, plus a read if the plan returns data and the final error
+    query. Stored programs send fewer lines, so this is an upper bound"""
+    commands = len(plan.setup)+len(plan.teardown)+bool(plan.execute)+bool(plan.read)+1
+    instrument = None if plan.duration is None else runs*plan.duration
+    return Estimate(instrument, runs*commands*latency, runs*commands)
@@ -0,0 +1,111 @@
+from concurrent.futures import Future
+from itertools import count
+from queue import PriorityQueue
+from threading import Thread
+from .enums import Priority
+from .loggers import exception_logger
+
+
+class TesterWorker(object):
+    """ Serializes all traffic to a shared B1500 through a single owner
+    thread. Jobs are queued with a Priority and return a
+    concurrent.futures.Future, so analysis threads, GUIs and schedulers can
+    submit to the same tester without interleaving commands on the bus or
+    racing on its cached setup state.
+
+    Once a worker is running, the tester should only be used through it.
+    abort() is the one exception, it sends AB from the calling thread."""
+
+    __stop = object()
+
+    def __init__(self, tester, start=True, name="B1500-worker"):
+        self.tester = tester
+        self._queue = PriorityQueue()
+        self.__sequence = count()
+        self.__thread = Thread(target=self.__run, name=name, daemon=True)
+        if start:
+            self.start()
+
+    def start(self):
+        self.__thread.start()
+
+    @property
+    def running(self):
+        return self.__thread.is_alive()
+
+    def submit(self, fn, *args, priority=Priority.normal, **kwargs):
+        """ Queues fn(*args, **kwargs) and returns a Future for its result.
+        fn is a callable or the name of a B1500 method"""
+        if isinstance(fn, str):
+            fn = getattr(self.tester, fn)
+        future = Future()
+        self._queue.put((priority, next(self.__sequence), future, fn, args, kwargs))
+        return future
+
+    def run_test(self, test_tuple, priority=Priority.normal, **kwargs):
+        return self.submit(self.tester.run_test, test_tuple, priority=priority, **kwargs)
+
+    def measure(self, test_tuple, force_wait=False, autoread=False, priority=Priority.normal):
+        return self.submit(self.tester.measure, test_tuple, force_wait, autoread, priority=priority)
+
+    def query(self, msg, *args, priority=Priority.normal, **kwargs):
+        return self.submit(self.tester.query, msg, *args, priority=priority, **kwargs)
+
+    def write(self, msg, *args, priority=Priority.normal, **kwargs):
+        return self.submit(self.tester.write, msg, *args, priority=priority, **kwargs)
+
+    def read(self, *args, priority=Priority.normal, **kwargs):
+        return self.submit(self.tester.read, *args, priority=priority, **kwargs)
+
+    def abort(self, test_tuple=None, cancel_pending=False):
+        """ Sends AB right away from the calling thread, ending whatever the
+        worker is blocked on. If test_tuple is given, its teardown is queued
+        ahead of all other jobs and the returned Future tracks it.
+        cancel_pending drops all jobs that did not start yet"""
+        self.tester.abort()
+        if cancel_pending:
+            self.cancel_pending()
+        if test_tuple is not None:
+            return self.submit(self.tester.teardown, test_tuple, priority=Priority.abort)
+
+    def cancel_pending(self):
+        """ Cancels all queued jobs that did not start yet, returns their number"""
+        kept, cancelled = [], 0
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            self._queue.task_done()
+            if job[2] is None:
+                kept.append(job)
+            elif job[2].cancel():
+                cancelled += 1
+        for job in kept:
+            self._queue.put(job)
+        return cancelled
+
+    def stop(self, wait=True, timeout=None):
+        """ Stops the worker after all jobs queued so far have run"""
+        self._queue.put((float("inf"), next(self.__sequence), None, self.__stop, (), {}))
+        if wait and self.running:
+            self.__thread.join(timeout)
+
+    def __run(self):
+        while True:
+            priority, _, future, fn, args, kwargs = self._queue.get()
+            try:
+                if fn is self.__stop:
+                    return
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    exception_logger.warn("Job {} failed: {}".format(getattr(fn, "__name__", fn), e))
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -3,21 +3,14 @@ import itertools
 import functools
 import collections
 
-# math library
-import numpy as np
-
-# data analysis librarz
-import pandas as pd
-#plotting library
-import matplotlib.pyplot as plt
-
 # for foldernames, timing etc
 import sys
 from datetime import datetime
 import time
 
-# show all resources available via VISA
-import visa
+# math, data analysis and plotting libraries, imported when first used
+from ..B1500.lazy import LazyModule, visa, np, pd
+plt = LazyModule("matplotlib.pyplot")
 
 if not "tester_id" in globals():
     tester_id='GPIB1::17::INSTR'
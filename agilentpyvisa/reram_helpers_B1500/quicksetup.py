@@ -3,28 +3,25 @@ import itertools
 import functools
 import collections
 
-# math library
-import numpy as np
-
-# data analysis librarz
-import pandas as pd
-#plotting library
-import matplotlib.pyplot as plt
-
 # for foldernames, timing etc
 import sys
 from datetime import datetime
 import time
 
-# show all resources available via VISA
-import visa
-rm = visa.ResourceManager()
-print(rm.list_resources())
-rm.close()
-
 # import the actual library for the Tester
 from ..B1500 import *
 
+# math, data analysis and plotting libraries, imported when first used
+from ..B1500.lazy import LazyModule, visa, np, pd
+plt = LazyModule("matplotlib.pyplot")
+
+
+def print_resources():
+    """ Prints all resources available via VISA"""
+    rm = visa.ResourceManager()
+    print(rm.list_resources())
+    rm.close()
+
 # hide all internal logging. Set this to logging.INFO to see the commands being sent 
 import logging
 exception_logger.setLevel(logging.INFO)
@@ -208,21 +205,45 @@ class pattern_checkR(collections.namedtuple('_checkR', checkr_members)):
 
 def handle_pattern(p,CURRENT_SAMPLE,print_check=False):
     global SPGU_SELECTOR
+    setup=pattern_setup(p)
     if isinstance(p,pattern_pulse):
         if not SPGU_SELECTOR=='SPGU':
             SPGU_SELECTOR='SPGU'
             b15.set_SMUSPGU_selector(SMU_SPGU_port.Module_1_Output_1,SMU_SPGU_state.connect_relay_SPGU)
-        pulse(p.voltage, p.width, slope=p.slope, gate=p.gate, gate_voltage=p.gateVoltage,loadZ=1e6,count=p.count )
+        run_pulse(setup)
         return p
     elif isinstance(p, pattern_checkR):
-        R=checkR(CURRENT_SAMPLE)
+        R=checkR(CURRENT_SAMPLE,setup=setup)
         if print_check:
             print(R)
         return R
 
+def pattern_setup(p):
+    """ The TestSetup handle_pattern runs for the pattern p"""
+    if isinstance(p,pattern_pulse):
+        return pulse_setup(p.voltage, p.width, p.slope, gate=p.gate, gate_voltage=p.gateVoltage,count=p.count)
+    elif isinstance(p, pattern_checkR):
+        return checkR_setup()
+
+def estimate_patterns(job_patterns):
+    """ Estimated time in s consume_patterns takes for job_patterns, see B1500.estimate"""
+    estimates={}
+    total=0.
+    for p in job_patterns:
+        if p not in estimates:
+            estimates[p]=b15.estimate(pattern_setup(p)).total or 0.
+        total+=estimates[p]
+    return total
+
 def consume_patterns(CURRENT_SAMPLE,job_patterns,time_est_every=100,print_check=False):
     resp=[]
-    est=None
+    est=estimate_patterns(job_patterns)
+    print('estimated end',
+          time.strftime('%H:%M:%S', time.localtime(time.time()+est)),
+          " estimated duration:",
+          est,
+          "seconds"
+         )
     beginning=time.time()
     start=time.time()
     end=len(job_patterns)
@@ -465,15 +486,18 @@ def add_energy(datum):
     datum['cumulative_energy']=(datum['ET'].diff().fillna(0)*datum['EI']*datum['EV']).cumsum()
     return datum
 
-def sweep(stop, steps, compliance=300e-6,start=0,mrange=MeasureRanges_I.full_auto,
-          gate=1.85, plot=True, up='b',down='r', ground=SMU2, stats=True):
-    """ Create and immediately perform a sweep, optionally plot the data and/or show statistics"""
+def sweep_setup(stop, steps, compliance=300e-6,start=0,mrange=MeasureRanges_I.full_auto,
+                gate=1.85, ground=SMU2):
+    """ The TestSetup of a sweep"""
+    return get_Vsweep(start=start,stop=stop,steps=steps, compliance=compliance,
+                      measure_range=mrange,gate_voltage=gate, ground=ground)[0]
+
+def run_sweep(setup, plot=True, up='b',down='r', stats=True):
+    """ Perform the sweep setup, optionally plot the data and/or show statistics"""
     b15.set_SMUSPGU_selector(SMU_SPGU_port.Module_1_Output_1,SMU_SPGU_state.connect_relay_SMU)
     global SPGU_SELECTOR
     SPGU_SELECTOR='SMU'
-    set_setup,set, _ ,ground_channel,gate_channel=get_Vsweep(start=start,stop=stop,steps=steps, compliance=compliance,
-                                                                     measure_range=mrange,gate_voltage=gate, ground=ground)
-    ret,out =b15.run_test(set_setup, force_wait=True, auto_read=True,force_new_setup=True)
+    ret,out =b15.run_test(setup, force_wait=True, auto_read=True,force_new_setup=True)
     out,series_dict,raw =out
     out=add_energy(out)
     out=add_resistance(out)
@@ -483,34 +507,61 @@ def sweep(stop, steps, compliance=300e-6,start=0,mrange=MeasureRanges_I.full_aut
         print(out.describe())
     return out
 
+def sweep(stop, steps, compliance=300e-6,start=0,mrange=MeasureRanges_I.full_auto,
+          gate=1.85, plot=True, up='b',down='r', ground=SMU2, stats=True):
+    """ Create and immediately perform a sweep, optionally plot the data and/or show statistics"""
+    setup=sweep_setup(stop, steps, compliance=compliance, start=start, mrange=mrange, gate=gate, ground=ground)
+    return run_sweep(setup, plot=plot, up=up, down=down, stats=stats)
+
+
+def pulse_setup(p_v, width, slope, gate=SMU3, gate_voltage=1.85,ground=SMU2,loadZ=1e6,count=1):
+    """ The TestSetup of a pulse"""
+    return get_pulse(0,p_v,width,
+                     lead_part=slope,trail_part=slope,gate=gate,gate_voltage=gate_voltage,
+                     ground=ground,loadZ=loadZ,count=count
+                    )[0]
 
-def pulse(p_v, width, slope, gate=SMU3, gate_voltage=1.85,ground=SMU2,loadZ=1e6,count=1):
-    reset_pulse_setup, reset_pulse,_,_,_= get_pulse(0,p_v,width,
-                                                    lead_part=slope,trail_part=slope,gate=gate,gate_voltage=gate_voltage,
-                                                    ground=ground,loadZ=loadZ,count=count
-                                                   )
+def run_pulse(setup):
+    """ Perform the pulse setup"""
     global SPGU_SELECTOR
     SPGU_SELECTOR='SPGU'
     b15.set_SMUSPGU_selector(SMU_SPGU_port.Module_1_Output_1,SMU_SPGU_state.connect_relay_SPGU)
-    b15.run_test(reset_pulse_setup,force_wait=True,force_new_setup=True)
+    b15.run_test(setup,force_wait=True,force_new_setup=True)
+
+def pulse(p_v, width, slope, **kwargs):
+    """ Create and immediately perform a pulse, see pulse_setup for the arguments"""
+    run_pulse(pulse_setup(p_v, width, slope, **kwargs))
 
     
     
 # some more concrete cases, with the defaults we use initially
-def read(CURRENT_SAMPLE,start=200e-6,stop=250e-6, steps=51,mrange=MeasureRanges_I.uA100_limited,
-         gate=1.85, plot=True, print_R=True, stats=True):
+def read_setup(start=200e-6,stop=250e-6, steps=51,mrange=MeasureRanges_I.uA100_limited, gate=1.85):
+    """ The TestSetup of a read"""
+    return sweep_setup(stop, steps, start=start, mrange=mrange, gate=gate)
+
+def read(CURRENT_SAMPLE, plot=True, print_R=True, stats=True, setup=None, **kwargs):
     """
-    A quick sweep to estimate the current Resistance of the DUT
+    A quick sweep to estimate the current Resistance of the DUT,
+    setup defaults to read_setup(**kwargs)
     """
-    out = sweep(start=start,stop=stop,steps=steps,mrange=mrange,gate=gate,plot=plot,stats=stats)
+    if setup is None:
+        setup=read_setup(**kwargs)
+    out = run_sweep(setup,plot=plot,stats=stats)
     out.to_csv("{}_read_{}.csv".format(mytimestamp(), CURRENT_SAMPLE))
     return out
 
-def checkR(CURRENT_SAMPLE, start=200e-6,stop=350e-6, steps=51,mrange=MeasureRanges_I.uA100_limited,  gate=1.85):
+def checkR_setup(stop=350e-6, **kwargs):
+    """ The TestSetup of checkR, a read up to stop"""
+    return read_setup(stop=stop, **kwargs)
+
+def checkR(CURRENT_SAMPLE, setup=None, **kwargs):
     """
-    Perform a read and calculate the mean, throw everything else away
+    Perform a read and calculate the mean, throw everything else away,
+    setup defaults to checkR_setup(**kwargs)
     """
-    out= read(CURRENT_SAMPLE,start=start,stop=stop, steps=steps,mrange=mrange,gate=gate, plot=False,stats=False)
+    if setup is None:
+        setup=checkR_setup(**kwargs)
+    out= read(CURRENT_SAMPLE,setup=setup, plot=False,stats=False)
     R= get_R(out)
     return R
 
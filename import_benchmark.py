@@ -0,0 +1,46 @@
+""" Measures the import time of agilentpyvisa modules, each in a fresh
+interpreter, and shows which of the heavy dependencies they load.
+
+    python import_benchmark.py [module ...] [-n repetitions]
+"""
+import argparse
+import subprocess
+import sys
+
+heavy = ("visa", "pyvisa", "numpy", "pandas", "matplotlib")
+
+probe = """
+import sys, time
+start = time.perf_counter()
+import {module}
+took = time.perf_counter()-start
+print(took)
+print(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def measure(module, repetitions=5):
+    """ Best import time of module in s and the heavy modules it loaded"""
+    times, loaded = [], ""
+    for _ in range(repetitions):
+        out = subprocess.check_output(
+            [sys.executable, "-c", probe.format(module=module, heavy=heavy)],
+            universal_newlines=True).splitlines()
+        times.append(float(out[0]))
+        loaded = out[1] if len(out) > 1 else ""
+    return min(times), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*",
+                        default=["agilentpyvisa.B1500", "agilentpyvisa.B1500.helpers"])
+    parser.add_argument("-n", "--repetitions", type=int, default=5)
+    args = parser.parse_args()
+    for module in args.modules:
+        took, loaded = measure(module, args.repetitions)
+        print("{:40s} {:8.1f} ms  loads: {}".format(module, took*1000, loaded or "-"))
+
+
+if __name__ == "__main__":
+    main()
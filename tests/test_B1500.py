@@ -4,6 +4,7 @@ import agilentpyvisa
 import visa
 import ipdb
 import types
+import time
 
 #import logging
 #logging.basicConfig(level=logging.INFO)
@@ -80,3 +81,606 @@ def test_SPGU(tester):
     print("SPGU_V")
     tester.SPGU(5,0,1,1)
 
+
+def batch_joins_commands_test(tester):
+    sent = []
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester._device.write = sent.append
+    tester.default_check_err = False
+    tester.error_check = ErrorCheck.per_batch
+    with tester.batch():
+        tester.write("CN 1")
+        tester.write("DV 1,0,1,0.1")
+        assert sent == []
+        tester.write("XE")
+    assert sent == ["CN 1;DV 1,0,1,0.1", "XE"]
+    # per_command sends and checks every command on its own
+    tester.error_check = ErrorCheck.per_command
+    del sent[:]
+    with tester.batch():
+        tester.write("CN 2")
+        tester.write("DV 2,0,1,0.1")
+    assert sent == ["CN 2", "DV 2,0,1,0.1"]
+
+def batch_respects_line_length_test(tester):
+    sent = []
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester._device.write = sent.append
+    tester.default_check_err = False
+    tester.error_check = ErrorCheck.per_batch
+    tester.max_line_length = 10
+    with tester.batch():
+        for i in range(3):
+            tester.write("CN {}".format(i))
+    assert sent == ["CN 0;CN 1", "CN 2"]
+
+def errors_attributed_to_batch_test(tester):
+    sent = []
+    errors = ['+150,"Command parameter is not correct."', '+0,"No Error."']
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester._device.write = sent.append
+    tester._device.query = lambda *args, **kwargs: errors.pop(0)
+    tester.error_check = ErrorCheck.per_batch
+    with tester.batch():
+        tester.write("CN 1")
+        tester.write("DV 1,0,100,0.1")
+    assert sent == ["CN 1;DV 1,0,100,0.1"]
+    assert len(tester.last_errors) == 1
+    assert tester.last_errors[0].code == 150
+    assert tester.last_errors[0].commands == ("CN 1", "DV 1,0,100,0.1")
+    errors[:] = ['+0,"No Error."', '+150,"Command parameter is not correct."', '+0,"No Error."']
+    tester.error_check = ErrorCheck.per_command
+    with tester.batch():
+        tester.write("CN 1")
+        tester.write("DV 1,0,100,0.1")
+    assert tester.last_errors[0].commands == ("DV 1,0,100,0.1",)
+
+def wait_for_completion_times_out_test(tester):
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester._device.read_stb = lambda: 0
+    tester.default_check_err = False
+    with pytest.raises(TimeoutError):
+        tester.wait_for_completion(timeout=0.05)
+    tester._device.read_stb = lambda: StatusByte.set_ready
+    assert tester.wait_for_completion(timeout=0.05) & StatusByte.set_ready
+
+def spgu_wait_uses_expected_runtime_test(tester):
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester.default_check_err = False
+    spgu = HVSPGU(tester, 1)
+    spgu.spgu_setups[101] = SPGU(0, 1, 1e-4, pulse_period=1e-3, condition=20)
+    assert abs(spgu.expected_runtime() - 20e-3) < 1e-9
+    spgu.start_pulses()
+    assert spgu.wait_spgu() == 0
+    # the wait follows the pulse trains started, not every setup of the unit
+    spgu.spgu_setups[102] = SPGU(0, 1, 1e-4, pulse_period=1e-1, condition=30)
+    assert spgu.expected_runtime(101) == pytest.approx(20e-3) and spgu.expected_runtime(201) == 0
+    spgu.start_pulses()
+    start = time.time()
+    assert agilentpyvisa.B1500.spgu.wait_spgus([spgu], runtimes=[20e-3]) == 0
+    assert time.time()-start < 1
+    del spgu.spgu_setups[102]
+    tester._device.query = lambda *args, **kwargs: "1"
+    spgu.start_pulses()
+    with pytest.raises(TimeoutError):
+        spgu.spgu_future(timeout=0.05).result()
+
+def spgu_future_polls_through_the_session_lock_test(tester):
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    tester.default_check_err = False
+    busy = []
+    def query(msg, **kwargs):
+        # a second caller while a query is on the wire would mix up replies
+        assert not busy
+        busy.append(msg)
+        time.sleep(1e-3)
+        busy.pop()
+        return "0"
+    tester._device.query = query
+    spgu = HVSPGU(tester, 1)
+    spgu.spgu_setups[101] = SPGU(0, 1, 1e-4, pulse_period=1e-3, condition=20)
+    spgu.start_pulses()
+    future = spgu.spgu_future(poll_interval=1e-4, max_poll_interval=1e-4)
+    while not future.done():
+        tester._io("query", "*OPC?")
+    assert future.result() == 0
+
+def async_cancel_aborts_test(tester):
+    import asyncio
+    sent = []
+    device = agilentpyvisa.B1500.dummy.DummyTester()
+    device.write = sent.append
+    device.query = lambda msg, **kwargs: "16" if "AB" in sent else "0"
+    tester._device = device
+    tester.default_check_err = False
+    tester.completion_timeout = 5
+    test = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))],
+                     spgu_selector_setup=[])
+    async def run():
+        atester = AsyncB1500(tester)
+        task = asyncio.ensure_future(atester.measure(test, force_wait=True))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await atester.close()
+    asyncio.run(run())
+    assert "XE" in sent
+    assert "AB" in sent
+    assert sent[-2:] == ["DZ 1", "CL 1"]
+
+def worker_priorities_test(tester):
+    import threading
+    order = []
+    release = threading.Event()
+    with TesterWorker(tester) as worker:
+        blocker = worker.submit(release.wait, 5)
+        time.sleep(0.05)
+        jobs = [worker.submit(order.append, "low", priority=Priority.low),
+                worker.submit(order.append, "normal"),
+                worker.submit(order.append, "abort", priority=Priority.abort)]
+        release.set()
+        for job in jobs:
+            job.result(timeout=5)
+        failing = worker.submit(int, "x")
+        with pytest.raises(ValueError):
+            failing.result(timeout=5)
+    assert blocker.result() is True
+    assert order == ["abort", "normal", "low"]
+
+def orchestrator_tags_results_test():
+    testers = []
+    for address in ("GPIB0::17::INSTR", "GPIB1::17::INSTR"):
+        t = B1500(address, auto_init=False)
+        t._device = agilentpyvisa.B1500.dummy.DummyTester()
+        t.run_test = lambda test, t=t: (time.sleep(0.01), t.address)[1]
+        testers.append(t)
+    tests = [TestSetup(channels=[Channel(number=n, dcforce=DCForce(Inputs.V, 1, 0.1))])
+             for n in (101, 201, 301, 401)]
+    with Orchestrator(testers) as orchestrator:
+        results = list(orchestrator.map(tests))
+    assert len(results) == 4
+    assert {r.slots for r in results} == {(1,), (2,), (3,), (4,)}
+    assert all(r.ok and r.result == r.address for r in results)
+    assert {r.address for r in results} == {t.address for t in testers}
+
+def server_shares_tester_test(tester):
+    from agilentpyvisa.B1500.server import encode_setup, decode_setup
+    test = TestSetup(channels=[Channel(number=101, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))])
+    assert decode_setup(encode_setup(test)) == test
+    tester._device = agilentpyvisa.B1500.dummy.DummyTester()
+    received = []
+    tester.run_test = lambda test_tuple, **kwargs: received.append(test_tuple) or len(received)
+    with InstrumentServer(tester) as server:
+        with InstrumentClient(server.address, server.authkey) as a, \
+                InstrumentClient(server.address, server.authkey) as b:
+            assert a.run_test(test) == 1
+            assert received == [test]
+            assert b.query("*OPC?") == "1"
+            with pytest.raises(ValueError):
+                b._request("close")
+
+def simulator_measures_dut_test():
+    import struct
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor, ReRAM
+    factory = SimulatedB1500.factory(duts={1: Resistor(1e3), 2: ReRAM()})
+    b = B1500("SIM", resource_factory=factory)
+    assert b.sub_channels == [1, 2, 3, 4]
+    spot = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))],
+                     spgu_selector_setup=[])
+    # parsed output is (frame, series, raw), the raw output if parsing fails
+    raw = lambda data: data[-1] if isinstance(data, tuple) else data
+    exc, data = b.run_test(spot, force_wait=True, auto_read=True)
+    assert "NAI+1.00000E-03" in raw(data)
+    sweep = TestSetup(channels=[Channel(number=2,
+        staircase_sweep=StaircaseSweep(Inputs.V, InputRanges_V.full_auto, 0.5, 1.5, 3, 1e-2),
+        measurement=MeasureStaircaseSweep(Targets.I))], spgu_selector_setup=[])
+    exc, data = b.run_test(sweep, force_wait=True, auto_read=True)
+    currents = [float(x[3:]) for x in raw(data).strip().split(",") if x[2] == "I"]
+    # switches to the low resistance state at 1 V and stays there
+    assert currents[0] == pytest.approx(0.5e-6)
+    assert currents[-1] == pytest.approx(0.5e-3)
+    sim = factory("SIM")
+    sim.write("FMT 4;CN 1;DV 1,0,1,0.1;MM 1,1;TSC 0;XE")
+    word, = struct.unpack(">I", sim.read_raw())
+    assert word >> 31 == 1 and (word >> 30) & 1 == 1
+    assert (word >> 25) & 0x1F == 17  # 1 mA range
+    assert (word >> 8) & 0x1FFFF == 50000
+    assert word & 0x1F == 1
+
+def record_and_replay_test(tmpdir):
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    from agilentpyvisa.B1500.replay import recording_factory, replay_factory, ReplayError
+    path = str(tmpdir.join("session.jsonl.gz"))
+    test = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))],
+                     spgu_selector_setup=[])
+    recorded = B1500("SIM", resource_factory=recording_factory(
+        path, SimulatedB1500.factory(duts={1: Resistor(1e3)})))
+    expected = recorded.run_test(test, force_wait=True, auto_read=True)
+    recorded.close()
+    replayed = B1500("SIM", resource_factory=replay_factory(path))
+    assert str(replayed.run_test(test, force_wait=True, auto_read=True)) == str(expected)
+    assert replayed._device.finished
+    diverging = B1500("SIM", auto_init=False, resource_factory=replay_factory(path))
+    with pytest.raises(ReplayError):
+        diverging.write("CN 2")
+
+def adaptive_timeouts_test(tester):
+    from agilentpyvisa.B1500.timing import estimate_duration
+    spot = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))])
+    sweep = TestSetup(channels=[Channel(number=1,
+        staircase_sweep=StaircaseSweep(Inputs.V, InputRanges_V.full_auto, 0, 1, 50000, 1e-2, delay=1e-3),
+        measurement=MeasureStaircaseSweep(Targets.I))])
+    assert estimate_duration(spot) < 0.1
+    assert estimate_duration(sweep) > 100000*1e-3
+    tester._expect(spot)
+    assert tester._timeout() < tester.min_timeout+0.1
+    tester._expect(sweep)
+    assert tester._timeout() > tester.timeout_margin*100000*1e-3
+    assert tester._timeout(5) == 5
+    highres = TestSetup(channels=[Channel(number=1, channel_adc=ADCTypes.highresolution,
+        staircase_sweep=StaircaseSweep(Inputs.V, InputRanges_V.full_auto, 0, 1, 1000, 1e-2,
+                                       sweepmode=SweepMode.linear_up),
+        measurement=MeasureStaircaseSweep(Targets.I))])
+    assert estimate_duration(highres) >= 1000*20e-3
+    averaged = highres._replace(adc_modes=((ADCTypes.highresolution, ADCMode.manual, 4),))
+    assert estimate_duration(averaged) >= 4000*20e-3
+
+def state_skips_redundant_settings_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    b.write("CN 1")
+    b.write("DV 1,0,1,0.1")
+    del sim.written[:]
+    b.write("DV 1,0,1,0.1")
+    b.write("DV 1, 0, 1, 0.1")
+    assert sim.written == []
+    b.write("DV 1,0,1,0.1", force=True)
+    b.write("DZ 1")
+    b.write("DV 1,0,1,0.1")
+    assert sim.written == ["DV 1,0,1,0.1", "DZ 1", "DV 1,0,1,0.1"]
+    spot = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))],
+                     spgu_selector_setup=[])
+    b.run_test(spot)
+    del sim.written[:]
+    b.run_test(spot)
+    sent = ";".join(sim.written)
+    assert "FMT" not in sent and "AV" not in sent
+    assert "DV 1" in sent  # resent, the teardown disconnected the channel
+    b.write("XX 1")
+    assert b._drain_errors()[0].code == 100
+    assert b.state.settings == {}
+
+
+def keep_connected_session_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIMKEEP", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    def spot(v):
+        return TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, v, 0.1),
+                                           measurement=MeasureSpot(Targets.I))],
+                         spgu_selector_setup=[])
+    with b.connected():
+        b.run_test(spot(1))
+        assert "DZ 1" in sim.written and "CL 1" not in sim.written
+        del sim.written[:]
+        b.run_test(spot(2))
+        sent = ";".join(sim.written)
+        assert "CN" not in sent and "CL" not in sent
+        assert "DV 1,0,2,0.1" in sent
+        del sim.written[:]
+    assert "CL 1" in ";".join(sim.written)
+    del sim.written[:]
+    def fail(*args):
+        raise RuntimeError("measurement failed")
+    b.measure = fail
+    with b.connected():
+        with pytest.raises(RuntimeError):
+            b.run_test(spot(1))
+    assert "DZ 1;CL 1" in sim.written[sim.written.index("DZ"):]
+    assert "CL 1" in ";".join(sim.written)
+
+
+def compiled_plan_matches_run_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIMPLAN", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    spot = TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, 1, 0.1),
+                                       measurement=MeasureSpot(Targets.I))],
+                     spgu_selector_setup=[])
+    del sim.written[:]
+    plan = b.compile(spot)
+    assert sim.written == []
+    assert b.compile(spot) is plan and b.plans.hits == 1
+    assert plan.execute == "XE" and plan.read == "spot" and plan.measure_channels == (1,)
+    raw = lambda data: data[-1] if isinstance(data, tuple) else data
+    data = raw(b.run_plan(plan, auto_read=True)[1])
+    assert "1.00000E-03" in data
+    sent = list(sim.written)
+    assert sent[:len(plan.setup)] == list(plan.setup)
+    assert "DV 1,0,1,0.1" in plan.setup[0]
+    assert "CL 1" in plan.teardown[-1]
+    assert b.state.get("FMT") is not None and b.state.get("DV", 1) is None
+    del sim.written[:]
+    assert "1.00000E-03" in raw(b.run_test(spot, auto_read=True)[1])
+    assert "FMT" not in ";".join(sim.written)
+
+
+def auto_programs_store_and_evict_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIMPROG", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    b.auto_programs = ProgramCache(min_runs=2, max_programs=1)
+    def spot(v):
+        return TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, v, 0.1),
+                                           measurement=MeasureSpot(Targets.I))],
+                         spgu_selector_setup=[])
+    raw = lambda data: data[-1] if isinstance(data, tuple) else data
+    b.run_test(spot(1))
+    assert "ST 1000" not in sim.written
+    b.run_test(spot(1), auto_read=True)
+    assert "ST 1000" in sim.written and 1000 in sim.programs
+    del sim.written[:]
+    assert "1.00000E-03" in raw(b.run_test(spot(1), auto_read=True)[1])
+    assert sim.written[0] == "DO 1000" and "XE" not in sim.written
+    b.run_test(spot(2))
+    b.run_test(spot(2))
+    assert b.auto_programs.stored == {b.compile(spot(2)).key: 1000}
+    assert "DV 1,0,2,0.1,0" in sim.programs[1000]
+
+
+def program_variables_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIMVAR", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    def spot(v):
+        return TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, v, 0.1),
+                                           measurement=MeasureSpot(Targets.I))],
+                         spgu_selector_setup=[])
+    v = ProgramVariable(1, 1.)
+    with pytest.raises(ValueError):
+        b.run_test(spot(v))
+    b.auto_programs = ProgramCache()
+    raw = lambda data: data[-1] if isinstance(data, tuple) else data
+    assert "1.00000E-03" in raw(b.run_test(spot(v), auto_read=True)[1])
+    assert "DV 1,0,%R1,0.1,0" in sim.programs[1000]
+    del sim.written[:]
+    assert "2.00000E-03" in raw(b.run_test(spot(v.bind(2)), auto_read=True)[1])
+    assert sim.written[0] == "VAR 1,1,2.0;DO 1000"
+    del sim.written[:]
+    b.run_test(spot(v.bind(2)))
+    assert sim.written[0] == "DO 1000"
+
+
+def run_programs_in_batches_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIMBATCH", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}),
+              error_check=ErrorCheck.per_test)
+    sim = b._device
+    b.auto_programs = ProgramCache()
+    def spot(v):
+        return TestSetup(channels=[Channel(number=1, dcforce=DCForce(Inputs.V, v, 0.1),
+                                           measurement=MeasureSpot(Targets.I))],
+                         spgu_selector_setup=[])
+    setups = [spot(v) for v in (1, 2, 3)]*3+[spot(4)]
+    b.run_programs(setups[:4])
+    del sim.written[:]
+    raw = lambda data: data[-1] if isinstance(data, tuple) else data
+    results = [raw(r) for r in b.run_programs(setups)]
+    assert [w for w in sim.written if w.startswith("DO")] == ["DO 1000,1001,1002,1000,1001,1002,1000,1001", "DO 1002,1003"]
+    assert len(results) == 10
+    assert "1.00000E-03" in results[0] and "3.00000E-03" in results[8] and "4.00000E-03" in results[9]
+    assert results[0].count(",") == 1  # time stamp and current
+    b.record_program("read", elements=2)
+    b.write("CN 1;DV 1,0,5,0.1;MM 1,1;XE;CL 1")
+    b.stop_recording()
+    assert sim.programs[1] and "5.00000E-03" in raw(b.run_programs(["read", setups[0]])[0])
+
+
+def range_tables_test():
+    assert HRSMU.ranges.mincover_V(1.5) == MeasureRanges_V.V5_limited
+    assert HRSMU.ranges.mincover_V(-0.2, 0.1) == MeasureRanges_V.V0_5_limited
+    assert HRSMU.ranges.mincover_I(1e-3) == MeasureRanges_I.mA1_limited
+    assert HRSMU.ranges.mincover_I(2e-3, fixed=True) == MeasureRanges_I.mA10_fixed
+    assert HRSMU.ranges.mincover_I(1.) == MeasureRanges_I.full_auto
+    assert HPSMU.ranges.mincover_I(1e-12) == MeasureRanges_I.nA1_limited
+    assert InputRanges_V.V100_limited in HRSMU.ranges.input_set
+    assert InputRanges_V.V0_2_limited not in HRSMU.ranges.input_set
+
+
+def discovery_cache_test(tmp_path):
+    from agilentpyvisa.B1500.simulator import SimulatedB1500
+    cache = str(tmp_path/"discovery.json")
+    b = B1500("SIMDISC", resource_factory=SimulatedB1500.factory(), discovery_cache=cache)
+    assert any(w.startswith("*LRN?") for w in b._device.written)
+    channels = b.sub_channels
+    b = B1500("SIMDISC", resource_factory=SimulatedB1500.factory(), discovery_cache=cache,
+              init_reset=False)
+    written = b._device.written
+    assert "UNT? 0" in written and "*RST" not in written
+    assert not any(w.startswith("*LRN?") for w in written)
+    assert b.sub_channels == channels
+    b = B1500("SIMDISC", resource_factory=SimulatedB1500.factory(modules=("B1517A",)*2),
+              discovery_cache=cache)
+    assert any(w.startswith("*LRN?") for w in b._device.written)
+    assert len(b.sub_channels) == 2
+
+
+def lazy_imports_test():
+    import subprocess, sys
+    code = ("import sys, agilentpyvisa.B1500; "
+            "print(','.join(m for m in ('numpy','pandas','matplotlib','visa','pyvisa') if m in sys.modules))")
+    out = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+    assert out.strip() == ""
+    # the proxies import on first use
+    from agilentpyvisa.B1500.lazy import LazyModule
+    json = LazyModule("json")
+    assert json.loads("[1]") == [1]
+
+
+def estimate_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory())
+    sim = b._device
+    def sweep(mode):
+        return TestSetup(channels=[Channel(number=1, staircase_sweep=StaircaseSweep(
+            Inputs.V, InputRanges_V.full_auto, 0, 1, 100, 1e-2, sweepmode=mode, hold=0.5, delay=1e-2),
+            measurement=MeasureStaircaseSweep(Targets.I))], spgu_selector_setup=[])
+    del sim.written[:]
+    up = b.estimate(sweep(SweepMode.linear_up))
+    up_down = b.estimate(sweep(SweepMode.linear_up_down), runs=3)
+    assert sim.written == []
+    assert 1.5 < up.instrument < up_down.instrument/3
+    assert up_down.commands == 3*up.commands
+    assert up.host == up.commands*b.command_latency
+    assert 0 < b.calibrate_latency(samples=3) < 1
+    assert b.estimate(sweep(SweepMode.linear_up)).host == up.commands*b.command_latency
+
+
+def setup_templates_test():
+    spgu = SPGU(0, Param("peak", 1.), 1e-3, pulse_period=1e-2)
+    template = SetupTemplate(TestSetup(channels=[
+        Channel(number=101, spgu=spgu),
+        Channel(number=1, dcforce=DCForce(Inputs.V, Param("gate", 1.85), .1))],
+        spgu_selector_setup=[(0, 0)]))
+    setups = template.grid(peak=[-1, 2], gate=[0, 1, 2])
+    first = next(setups)
+    assert first.channels[0].spgu.pulse_peak == (-1.,) and first.channels[1].dcforce.value == 0.
+    rest = list(setups)
+    assert len(rest) == 5 and rest[-1].channels[0].spgu.pulse_peak == (2.,)
+    assert rest[-1].channels[1].dcforce.value == 2. and type(rest[-1]) is TestSetup
+    # unchanged parts are shared with the template
+    assert rest[-1].spgu_selector_setup is template.setup.spgu_selector_setup
+    assert template.fill(peak=3).channels[1].dcforce.value == 1.85
+    with pytest.raises(ValueError):
+        template.grid(peak=[1, 50])
+    with pytest.raises(ValueError):
+        template.random(10, seed=0, width=(0, 1))
+    peaks = [s.channels[0].spgu.pulse_peak[0] for s in template.random(10, seed=0, peak=(-2, 2))]
+    assert len(peaks) == 10 and all(-2 <= p <= 2 for p in peaks)
+
+
+def setups_are_hashable_test():
+    def setup(peak, variable=None):
+        return TestSetup(channels=[Channel(number=101, spgu=SPGU(0, peak, 1e-3, pulse_leading=[1e-8])),
+                                   Channel(number=1, dcforce=DCForce(Inputs.V, variable or 0., .1))],
+                         spgu_selector_setup=[(0, 0)])
+    a, b = setup(1.), setup(1.)
+    assert a.channels[0].spgu.pulse_leading == (1e-8,) and a.spgu_selector_setup == ((0, 0),)
+    assert hash(a) == hash(b) and {SetupKey(a): 1}[SetupKey(b)] == 1
+    assert SetupKey(a) != SetupKey(setup(2.))
+    with pytest.raises(AttributeError):
+        a.cached = True
+    # variables of the same number share the key, whatever their values
+    v = ProgramVariable(1, 2.)
+    assert SetupKey(setup(1., v)) == SetupKey(setup(1., v.bind(3.)))
+    assert v != 2. and v != ProgramVariable(2, 2.) and not v == 2.
+    assert SetupKey(setup(1., v)) != SetupKey(setup(1., 2.))
+
+
+def parse_binary4_test():
+    import math
+    import struct
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    from agilentpyvisa.B1500.helpers import parse_binary4, binary4_tables
+    from agilentpyvisa.B1500.SMUs import HRSMU, MFCFMU
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}))
+    sweep = TestSetup(channels=[Channel(number=1,
+        staircase_sweep=StaircaseSweep(Inputs.V, InputRanges_V.full_auto, -1, 1, 5, 1e-2, sweepmode=SweepMode.linear_up),
+        measurement=MeasureStaircaseSweep(Targets.I))], spgu_selector_setup=[], format=Format.binary4)
+    exc, (frame, data, raw) = b.run_test(sweep, force_wait=True, auto_read=True)
+    assert len(raw) == 4*len(data) == 20
+    assert data["value"] == pytest.approx([-1e-3, -0.5e-3, 0, 0.5e-3, 1e-3])
+    assert data["measured"].all() and (data["parameter"] == 1).all() and (data["channel"] == 1).all()
+    assert list(frame["value"]) == list(data["value"])
+    # words packed by hand, with values worked out from the manual tables:
+    # 25000 counts measured on the 1 mA range (code 17) of slot 1, -10000
+    # counts of source data on the 2 V range (code 10) of slot 3, with CR LF
+    words = [(1 << 31) | (1 << 30) | (17 << 25) | (25000 << 8) | 1,
+             (0 << 31) | (0 << 30) | (10 << 25) | ((-10000 & 0x1FFFF) << 8) | 3]
+    measured, source = parse_binary4(struct.pack(">2I", *words)+b"\r\n")
+    assert measured["measured"] and measured["channel"] == 1
+    assert measured["range"] == pytest.approx(1e-3) and measured["value"] == pytest.approx(0.5e-3)
+    assert not source["measured"] and source["channel"] == 3
+    assert source["range"] == 2. and source["value"] == -1.
+    # the CMU in slot 2 is not decoded
+    tables = binary4_tables({1: HRSMU.binary_ranges, 2: MFCFMU.binary_ranges})
+    measured, cmu = parse_binary4(struct.pack(">2I", words[0], words[0]+1), tables)
+    assert measured["value"] == pytest.approx(0.5e-3)
+    assert cmu["channel"] == 2 and math.isnan(cmu["range"]) and math.isnan(cmu["value"])
+
+
+def broken_session_retries_only_repeatable_calls_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory())
+    sim = b._device
+    def lost_after_delivery(message):
+        # the tester got the line, but the session broke before the reply
+        del sim.write
+        sim.write(message)
+        raise visa.VisaIOError(visa.constants.VI_ERROR_CONN_LOST)
+    del sim.written[:]
+    sim.write = lost_after_delivery
+    b._io("write", "CN 1")
+    assert sim.written == ["CN 1", "CN 1"]
+    del sim.written[:]
+    sim.write = lost_after_delivery
+    with pytest.raises(visa.VisaIOError):
+        b._io("write", "MM 1,1;XE")
+    assert sim.written == ["MM 1,1;XE"]
+    # the error queue is read through the same recovery
+    def lost_query(message):
+        del sim.query
+        raise visa.VisaIOError(visa.constants.VI_ERROR_CONN_LOST)
+    sim.query = lost_query
+    assert b._check_err().startswith("+0")
+
+
+def simulated_spgu_runs_through_B1500_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory(modules=("B1517A", "B1525A")))
+    sim = b._device
+    assert b.sub_channels == [1, 201, 202]
+    selector = [(SMU_SPGU_port.Module_1_Output_1, SMU_SPGU_state.connect_relay_SPGU)]
+    def train(channel, period, count):
+        return TestSetup(channels=[Channel(number=channel, spgu=SPGU(0, 1, 1e-4, pulse_period=period, condition=count))],
+                         spgu_selector_setup=selector)
+    # a long train only estimated must not make the next run wait for it
+    assert b.estimate(train(201, 0.1, 30)).instrument == pytest.approx(3)
+    del sim.written[:]
+    start = time.time()
+    b.run_test(train(202, 1e-3, 10), force_wait=True)
+    assert time.time()-start < 1
+    assert "SRP" in sim.written and "SPST?" in sim.written and "CL 202" in sim.written
+    assert b.last_errors == [] and not sim._errors
+
+
+def simulated_source_data_matches_output_elements_test():
+    from agilentpyvisa.B1500.simulator import SimulatedB1500, Resistor
+    b = B1500("SIM", resource_factory=SimulatedB1500.factory(duts={1: Resistor(1e3)}))
+    def sweep(format):
+        return TestSetup(channels=[Channel(number=1,
+            staircase_sweep=StaircaseSweep(Inputs.V, InputRanges_V.full_auto, 0, 1, 3, 1e-2, sweepmode=SweepMode.linear_up),
+            measurement=MeasureStaircaseSweep(Targets.I))], spgu_selector_setup=[],
+            format=format, output_mode=OutputMode.with_primarysource)
+    ascii = sweep(Format.ascii12_with_header_crl)
+    exc, (frame, series, raw) = b.run_test(ascii, force_wait=True, auto_read=True)
+    assert len(raw.strip().split(",")) == b.compile(ascii).elements == 9
+    assert list(series["Av"]) == pytest.approx([0, 0.5, 1])
+    binary = sweep(Format.binary4)
+    exc, (frame, data, raw) = b.run_test(binary, force_wait=True, auto_read=True)
+    assert len(data) == b.compile(binary).elements == 6
+    source = data[~data["measured"]]
+    assert (source["parameter"] == 0).all() and source["value"] == pytest.approx([0, 0.5, 1])